@@ -1,10 +1,187 @@
+import sys
+from pathlib import Path
+
 import fire
+from loguru import logger
 
+from mokuro.cache import cache, export_detector
 from mokuro.run import run
 
 
-def main():
-    fire.Fire(run)
+def export_detector_command(output_path: str = None, input_size: int = 1024):
+    """
+    Export the comic text detector to ONNX, for use with the onnxruntime backend.
+
+    Args:
+        output_path: Where to write the model. Defaults to the model cache, where the onnxruntime backend looks for it.
+        input_size: Page size (in pixels, square) the exported model takes.
+    """
+    if output_path is None:
+        output_path = cache.root / f'comictextdetector-{input_size}.onnx'
+    export_detector(output_path, input_size=input_size)
+
+
+def quantize_detector_command(calibration_path: str, input_size: int = 1024, max_pages: int = 64):
+    """
+    Quantize the comic text detector to int8, calibrating on sample pages, for detector_precision="int8".
+
+    Args:
+        calibration_path: A directory, zip or cbz of representative manga pages.
+        input_size: Detector input size used during calibration.
+        max_pages: Maximum number of pages to calibrate on.
+    """
+    from itertools import islice
+
+    from mokuro.comic_text_detector.quantization import quantize_detector
+    from mokuro.utils import imread
+    from mokuro.volume import volume_from_path
+
+    output_path = cache.root / 'comictextdetector-int8.pt'
+    volume = volume_from_path(Path(calibration_path).expanduser().absolute())
+    images = (imread(page.img_bytes) for page in islice(volume.get_pages(), max_pages))
+    logger.info(f'Calibrating text detector on {min(len(volume.namelist), max_pages)} pages from {volume.path}')
+    num_pages = quantize_detector(cache.comic_text_detector, images, output_path, input_size=input_size)
+    logger.info(f'Saved int8 text detector calibrated on {num_pages} pages to {output_path}')
+
+
+def serve_command(
+        socket_path: str = None,
+        pretrained_model_name_or_path: str = 'kha-white/manga-ocr-base',
+        force_cpu: bool = False,
+        detector_backend: str = 'torch',
+        detector_input_size: int = 1024,
+        detector_coarse_input_size: int = None,
+        detector_precision: str = 'fp32',
+        detector_dynamic_shape: bool = False,
+        detector_batch_size: int = None,
+        disable_mask_refinement: bool = False,
+        ocr_memo_size: int = 4096,
+        ocr_memo_fuzzy: bool = False,
+        disable_cache: bool = False,
+        http_port: int = None,
+        http_host: str = '127.0.0.1',
+        batch_size: int = 4,
+        max_wait: float = 0.05,
+):
+    """
+    Keep the models loaded and process volumes submitted with `mokuro submit`, one job at a time.
+    With http_port, serve single pages over HTTP instead: POST image bytes to /ocr for the page's
+    OCR JSON, and GET /metrics for queue depth and batch sizes.
+
+    Args:
+        socket_path: Unix socket to listen on. Defaults to mokuro.sock in the model cache (~/.cache/manga-ocr).
+        pretrained_model_name_or_path: Name or path of the manga-ocr model.
+        force_cpu: Force the use of CPU even if CUDA is available.
+        detector_backend: Text detector runtime, as for `mokuro`.
+        detector_input_size: Text detector input size, as for `mokuro`.
+        detector_coarse_input_size: Coarse-to-fine detection input size, as for `mokuro`.
+        detector_precision: Text detector precision, as for `mokuro`.
+        detector_dynamic_shape: Aspect-preserving detector inputs, as for `mokuro`.
+        detector_batch_size: Pages per text detector batch, as for `mokuro`. Defaults to batch_size when serving over HTTP, 1 otherwise.
+        disable_mask_refinement: Skip refining the text mask, as for `mokuro`.
+        ocr_memo_size: Size of the per-volume OCR memo, as for `mokuro`.
+        ocr_memo_fuzzy: Also reuse OCR text for lookalike crops, as for `mokuro`.
+        disable_cache: Don't read or write the per-page OCR result cache.
+        http_port: Serve page OCR over HTTP on this port instead of volumes on the Unix socket.
+        http_host: Address the HTTP server binds to.
+        batch_size: Most pages per OCR batch.
+        max_wait: Seconds a batch waits for more concurrent pages when serving over HTTP.
+    """
+    from mokuro import MokuroGenerator
+
+    if detector_batch_size is None:
+        detector_batch_size = batch_size if http_port is not None else 1
+    generator = MokuroGenerator(
+        pretrained_model_name_or_path=pretrained_model_name_or_path,
+        force_cpu=force_cpu,
+        detector_backend=detector_backend,
+        detector_input_size=detector_input_size,
+        detector_coarse_input_size=detector_coarse_input_size,
+        detector_precision=detector_precision,
+        detector_dynamic_shape=detector_dynamic_shape,
+        refine_mask=not disable_mask_refinement,
+        ocr_memo_size=ocr_memo_size,
+        ocr_memo_fuzzy=ocr_memo_fuzzy,
+        disable_cache=disable_cache,
+        queue_size=batch_size,
+        detector_batch_size=detector_batch_size,
+    )
+    if http_port is not None:
+        from mokuro.http_server import serve_http
+        serve_http(generator, host=http_host, port=http_port, max_wait=max_wait)
+    else:
+        from mokuro.server import serve
+        serve(generator, socket_path=socket_path)
+
+
+def submit_command(*paths: str, parent_dir: str = None, socket_path: str = None, ignore_errors: bool = False):
+    """
+    Queue volumes on a running `mokuro serve` daemon and follow their progress.
+    Exits with status 1 if any volume fails.
+
+    Args:
+        paths: Paths to manga volumes (directories, zip or cbz files).
+        parent_dir: Parent directory to scan for volumes. If provided, all volumes inside this directory will be processed.
+        socket_path: The daemon's Unix socket. Defaults to mokuro.sock in the model cache (~/.cache/manga-ocr).
+        ignore_errors: Continue processing a volume even if some of its pages fail.
+    """
+    from tqdm import tqdm
+
+    from mokuro.run import normalize_volume_paths
+    from mokuro.server import submit
+
+    volume_paths = normalize_volume_paths(paths, parent_dir)
+    if not volume_paths:
+        logger.error('Found no paths to process. Did you set the paths correctly?')
+        sys.exit(1)
+
+    progressbar = None
+    try:
+        for event in submit(volume_paths, socket_path=socket_path, ignore_errors=ignore_errors):
+            kind = event['event']
+            if kind == 'error':
+                logger.error(event['error'])
+                sys.exit(1)
+            elif kind == 'queued':
+                logger.info(f'Queued {len(event["volumes"])} volumes, {event["jobs_ahead"]} jobs ahead')
+            elif kind == 'volume_started':
+                progressbar = tqdm(desc=Path(event['volume']).name, total=event['total'], unit='pages')
+            elif kind == 'page':
+                progressbar.update(event['done'] - progressbar.n)
+            elif kind in ('volume_finished', 'volume_failed'):
+                progressbar.close()
+                if kind == 'volume_failed':
+                    logger.error(f'Failed to process {event["volume"]}: {event["error"]}')
+            elif kind == 'finished':
+                logger.info(f'Processed successfully: {event["num_successful"]}/{event["num_volumes"]}')
+                sys.exit(0 if event['num_successful'] == event['num_volumes'] else 1)
+    except (FileNotFoundError, ConnectionRefusedError):
+        logger.error('Could not connect to the mokuro daemon. Is `mokuro serve` running?')
+        sys.exit(1)
+    logger.error('The mokuro daemon closed the connection before the job finished')
+    sys.exit(1)
+
+
+COMMANDS = {
+    'run': run,
+    'export-detector': export_detector_command,
+    'quantize-detector': quantize_detector_command,
+    'serve': serve_command,
+    'submit': submit_command,
+}
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if argv and argv[0] in ('-h', '--help'):
+        pass  # list the commands
+    elif not argv or argv[0] not in COMMANDS:
+        # `mokuro <paths> [flags]` is short for `mokuro run <paths> [flags]`; anything that doesn't
+        # start with a command, including flags followed by a path named like one, is a run.
+        argv = ['run', *argv]
+    elif argv[0] != 'run' and Path(argv[0]).exists():
+        logger.warning(f'Running the {argv[0]} command; to process the path {argv[0]} instead, use `mokuro run {argv[0]}`')
+    fire.Fire(COMMANDS, command=argv, name='mokuro')
 
 if __name__ == '__main__':
     main()
@@ -1,3 +1,7 @@
+import hashlib
+import json
+import os
+import threading
 from pathlib import Path
 
 import requests
@@ -22,6 +26,22 @@ class _cache:
         self._download_if_needed(path, url)
         return path
 
+    @property
+    def comic_text_detector_int8(self):
+        path = self.root / 'comictextdetector-int8.pt'
+        if not path.is_file():
+            raise FileNotFoundError(
+                f'{path} not found. Create it by calibrating on some sample pages: '
+                'mokuro quantize-detector /path/to/pages'
+            )
+        return path
+
+    def comic_text_detector_onnx(self, input_size=1024):
+        path = self.root / f'comictextdetector-{input_size}.onnx'
+        if not path.is_file():
+            export_detector(path, input_size=input_size)
+        return path
+
     def _download_if_needed(self, path, url):
         if not path.is_file():
             logger.info(f'Downloading {url}')
@@ -34,5 +54,153 @@ class _cache:
                         f.write(chunk)
             logger.info(f'Finished downloading {url}')
 
+    def page_results(self, max_size=1 << 30):
+        return PageResultCache(self.root / 'pages', max_size=max_size)
+
+    def volume_manifest(self):
+        return VolumeManifest(self.root / 'volume-manifest.json')
+
+
+def export_detector(output_path, input_size=1024):
+    from mokuro.comic_text_detector.basemodel import export_onnx
+
+    output_path = Path(output_path)
+    logger.info(f'Exporting text detector to {output_path}')
+    tmp_path = output_path.with_name(f'{output_path.name}.{os.getpid()}.tmp')
+    export_onnx(cache.comic_text_detector, tmp_path, input_size=input_size)
+    tmp_path.replace(output_path)
+    logger.info(f'Finished exporting text detector to {output_path}')
+
+
+def file_version(path: Path) -> str:
+    """Identifies a file's contents for PageResultCache keys, by its name, size and mtime, without reading it."""
+    stat = Path(path).stat()
+    return f'{Path(path).name}:{stat.st_size}:{stat.st_mtime_ns}'
+
+
+class PageResultCache:
+    """
+    Persistent per-page OCR results, keyed by a hash of the page bytes and the
+    versions of everything that produced them. Entries are evicted least
+    recently used first (by mtime, which is bumped on every hit) once the
+    total size goes over `max_size` bytes (down to 90% of it, so eviction
+    doesn't rescan the directory on every write).
+    """
+
+    def __init__(self, root: Path, max_size: int):
+        self.root = root
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._size = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(img_bytes: bytes, *versions: str) -> str:
+        h = hashlib.sha256(img_bytes)
+        for version in versions:
+            h.update(b'\0' + version.encode())
+        return h.hexdigest()
+
+    def get(self, key: str) -> dict | None:
+        path = self._path(key)
+        try:
+            result = json.loads(path.read_text(encoding='utf-8'))
+            os.utime(path)
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return result
+
+    def put(self, key: str, result_json: str):
+        path = self._path(key)
+        path.parent.mkdir(exist_ok=True)
+        tmp_path = path.with_name(f'{path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+        tmp_path.write_text(result_json, encoding='utf-8')
+        tmp_path.replace(path)
+        with self._lock:
+            if self._size is None:
+                self._size = sum(p.stat().st_size for p in self.root.glob('*/*.json'))
+            else:
+                self._size += path.stat().st_size
+            if self._size > self.max_size:
+                self._evict()
+
+    def _evict(self):
+        entries = []
+        for p in self.root.glob('*/*.json'):
+            try:
+                entries.append((p.stat().st_mtime, p.stat().st_size, p))
+            except FileNotFoundError:  # evicted by another process
+                continue
+        entries.sort()
+        self._size = sum(size for _, size, _ in entries)
+        for _, size, p in entries:
+            if self._size <= self.max_size * 0.9:
+                break
+            p.unlink(missing_ok=True)
+            self._size -= size
+
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / f'{key}.json'
+
+
+class VolumeManifest:
+    """
+    The image names found in each scanned volume, so that rescanning an
+    unchanged volume doesn't sniff every file again. An entry is only used
+    while the volume's path, mtime and size all still match, and is dropped
+    when the manifest is saved once they don't.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        try:
+            self._entries = json.loads(path.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            self._entries = {}
+        self._lock = threading.Lock()
+        self._modified = False
+
+    def get(self, volume_path: Path) -> list[str] | None:
+        entry = self._entries.get(str(volume_path))
+        if entry is not None and self._is_current(volume_path, entry):
+            return entry['names']
+        return None
+
+    def put(self, volume_path: Path, names: list[str]):
+        with self._lock:
+            self._entries[str(volume_path)] = {'stat': self._stat(volume_path), 'names': names}
+            self._modified = True
+
+    def save(self):
+        with self._lock:
+            stale = [path for path, entry in self._entries.items() if not self._is_current(Path(path), entry)]
+            for path in stale:
+                del self._entries[path]
+            if not self._modified and not stale:
+                return
+            tmp_path = self.path.with_name(f'{self.path.name}.{os.getpid()}.tmp')
+            tmp_path.write_text(json.dumps(self._entries), encoding='utf-8')
+            tmp_path.replace(self.path)
+            self._modified = False
+
+    @classmethod
+    def _is_current(cls, volume_path: Path, entry: dict) -> bool:
+        stat = cls._stat(volume_path)
+        return stat is not None and stat == entry['stat']
+
+    @staticmethod
+    def _stat(volume_path: Path) -> list[int] | None:
+        try:
+            stat = volume_path.stat()
+        except OSError:  # moved or deleted
+            return None
+        return [stat.st_mtime_ns, stat.st_size]
+
 
 cache = _cache()
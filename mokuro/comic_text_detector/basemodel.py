@@ -1,5 +1,6 @@
 import copy
 import glob
+import inspect
 
 import cv2
 import numpy as np
@@ -9,7 +10,7 @@ import torch.nn.functional as F
 from torchsummary import summary
 
 from .models.yolov5.common import C3, Conv
-from .models.yolov5.yolo import Model, load_yolov5_ckpt
+from .models.yolov5.yolo import Detect, Model, load_yolov5_ckpt
 from .utils.weight_init import init_weights
 from .utils.yolov5_utils import fuse_conv_and_bn
 
@@ -107,9 +108,7 @@ class DBHead(nn.Module):
 
     def forward(self, f80, f40, u40, shrink_with_sigmoid=True, step_eval=False):
         shrink_with_sigmoid = self.shrink_with_sigmoid
-        u80 = self.upconv3(torch.cat([f40, u40], dim = 1)) # 256@80
-        x = self.upconv4(torch.cat([f80, u80], dim = 1)) # 128@160
-        x = self.conv(x)
+        x = self._neck(f80, f40, u40)
         threshold_maps = self.thresh(x)
         x = self.binarize(x)
         shrink_maps = torch.sigmoid(x)
@@ -126,6 +125,15 @@ class DBHead(nn.Module):
             else:
                 return torch.cat((shrink_maps, threshold_maps), dim=1)
 
+    def forward_shrink(self, f80, f40, u40):
+        """Inference-only forward: just the shrink maps (channel 0 of `forward`'s eval output), without the threshold branch."""
+        return torch.sigmoid(self.binarize(self._neck(f80, f40, u40)))
+
+    def _neck(self, f80, f40, u40):
+        u80 = self.upconv3(torch.cat([f40, u40], dim = 1)) # 256@80
+        x = self.upconv4(torch.cat([f80, u80], dim = 1)) # 128@160
+        return self.conv(x)
+
     def init_weight(self, init_func):
         self.apply(init_func)
 
@@ -245,6 +253,58 @@ class TextDetBase(nn.Module):
         lines = self.text_det(*features, step_eval=False)
         return blks[0], mask, lines
 
+class TextDetBaseInference(TextDetBase):
+    """
+    TextDetBase specialised for inference. The DB threshold branch, whose maps
+    are never read at inference, is dropped, so `lines` holds only the shrink
+    maps.
+    """
+    def __init__(self, model_path, device='cpu', half=False, fuse=False, act='leaky'):
+        super(TextDetBaseInference, self).__init__(model_path, device=device, half=half, fuse=fuse, act=act)
+        del self.text_det.thresh
+
+    def forward(self, features):
+        blks, features = self.blk_det(features, detect=True)
+        mask, features = self.text_seg(*features, forward_mode=TEXTDET_INFERENCE)
+        lines = self.text_det.forward_shrink(*features)
+        return blks[0], mask, lines
+
+def export_onnx(model_path, onnx_path, input_size=1024, act='leaky', opset_version=14):
+    """Trace TextDetBaseInference to ONNX, with a dynamic batch dimension and a fixed input_size×input_size page."""
+    net = TextDetBaseInference(model_path, device='cpu', act=act).eval()
+    for m in net.modules():
+        if isinstance(m, Detect):
+            m.onnx_dynamic = True  # don't bake the grids cached by a previous forward into the graph
+    dummy = torch.zeros(1, 3, input_size, input_size)
+    batch_axis = {0: 'batch'}
+    kwargs = {}
+    if 'dynamo' in inspect.signature(torch.onnx.export).parameters:
+        kwargs['dynamo'] = False  # the dynamo exporter needs onnxscript and ignores dynamic_axes
+    torch.onnx.export(
+        net, dummy, str(onnx_path),
+        input_names=['images'],
+        output_names=['blks', 'mask', 'lines_map'],
+        dynamic_axes={'images': batch_axis, 'blks': batch_axis, 'mask': batch_axis, 'lines_map': batch_axis},
+        opset_version=opset_version,
+        **kwargs,
+    )
+
+class TextDetBaseORT:
+    def __init__(self, model_path, num_threads=0):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = num_threads  # 0 lets onnxruntime pick
+        self.session = ort.InferenceSession(str(model_path), options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, im_in):
+        blks, mask, lines_map = self.session.run(None, {self.input_name: im_in})
+        return blks, mask, lines_map
+
+# (blks, mask, lines_map) as named by export_onnx, and by comic-text-detector's own export.
+DNN_OUTPUT_NAMES = (('blks', 'mask', 'lines_map'), ('blk', 'seg', 'det'))
+
 class TextDetBaseDNN:
     def __init__(self, input_size, model_path):
         self.input_size = input_size
@@ -252,10 +312,24 @@ class TextDetBaseDNN:
         self.uoln = self.model.getUnconnectedOutLayersNames()
 
     def __call__(self, im_in):
-        blob = cv2.dnn.blobFromImage(im_in, scalefactor=1 / 255.0, size=(self.input_size, self.input_size))
+        if not isinstance(im_in, list):
+            im_in = [im_in]
+        blob = cv2.dnn.blobFromImages(im_in, scalefactor=1 / 255.0, size=(self.input_size, self.input_size))
         self.model.setInput(blob)
-        blks, mask, lines_map  = self.model.forward(self.uoln)
-        return blks, mask, lines_map
+        return self.order_outputs(dict(zip(self.uoln, self.model.forward(self.uoln))))
+
+    @staticmethod
+    def order_outputs(outputs: dict):
+        """(blks, mask, lines_map) out of the outputs by name, as some versions of opencv return them in another order."""
+        for names in DNN_OUTPUT_NAMES:
+            if set(outputs) == set(names):
+                return tuple(outputs[name] for name in names)
+        # Named otherwise: the blocks are the only 3-D output, and a lines map with the threshold branch has 2 channels.
+        blks = [out for out in outputs.values() if out.ndim == 3]
+        maps = sorted((out for out in outputs.values() if out.ndim == 4), key=lambda out: out.shape[1])
+        if len(blks) == 1 and [out.shape[1] for out in maps] == [1, 2]:
+            return blks[0], maps[0], maps[1]
+        raise ValueError(f'Unrecognized text detector outputs: {sorted(outputs)}')
 
 if __name__ == '__main__':
     device = 'cuda'
@@ -6,27 +6,36 @@ import numpy as np
 import torch
 from tqdm import tqdm
 
-from .basemodel import TextDetBase, TextDetBaseDNN
+from .basemodel import TextDetBaseDNN, TextDetBaseInference, TextDetBaseORT
 from .utils.db_utils import SegDetectorRepresenter
 from .utils.imgproc_utils import letterbox
 from .utils.textblock import group_output
-from .utils.textmask import refine_mask, refine_undetected_mask, REFINEMASK_INPAINT, REFINEMASK_ANNOTATION
-from .utils.yolov5_utils import non_max_suppression
+from .utils.textmask import LazyRefinedMask, refine_mask, refine_undetected_mask, REFINEMASK_INPAINT, REFINEMASK_ANNOTATION
+from .utils.yolov5_utils import non_max_suppression, non_max_suppression_numpy
 
 
 def preprocess_img(img, input_size=(1024, 1024), device='cpu', bgr2rgb=True, half=False, to_tensor=True):
-    if bgr2rgb:
+    if bgr2rgb and not to_tensor:
         img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
     img_in, ratio, (dw, dh) = letterbox(img, new_shape=input_size, auto=False, stride=64)
     if to_tensor:
-        img_in = img_in.transpose((2, 0, 1))[::-1]  # HWC to CHW, BGR to RGB
-        img_in = np.array([np.ascontiguousarray(img_in)]).astype(np.float32) / 255
-        if to_tensor:
-            img_in = torch.from_numpy(img_in).to(device)
-            if half:
-                img_in = img_in.half()
+        # The tensor path used to convert BGR to RGB and then flip the channels straight back,
+        # so with bgr2rgb the network gets the BGR channels as-is, and without it RGB.
+        img_in = img_in.transpose((2, 0, 1))  # HWC to CHW
+        if not bgr2rgb:
+            img_in = img_in[::-1]
+        img_in = np.ascontiguousarray(img_in[None])
+        img_in = torch.from_numpy(img_in).to(device).float().div_(255)
+        if half:
+            img_in = img_in.half()
     return img_in, ratio, int(dw), int(dh)
 
+def dynamic_input_size(img_shape, input_size=1024, stride=64):
+    """(h, w) that scales the page's long side to input_size and rounds its short side up to a multiple of stride."""
+    h, w = img_shape[:2]
+    r = input_size / max(h, w)
+    return tuple(min(input_size, int(np.ceil(side * r / stride)) * stride) for side in (h, w))
+
 def postprocess_mask(img: Union[torch.Tensor, np.ndarray], thresh=None):
     # img = img.permute(1, 2, 0)
     if isinstance(img, torch.Tensor):
@@ -43,11 +52,22 @@ def postprocess_mask(img: Union[torch.Tensor, np.ndarray], thresh=None):
 
     return img.astype(np.uint8)
 
+# Above this many candidates past the confidence filter, NMS goes through torchvision instead of NumPy.
+NUMPY_NMS_MAX_CANDIDATES = 1000
+
 def postprocess_yolo(det, conf_thresh, nms_thresh, resize_ratio, sort_func=None):
-    det = non_max_suppression(det, conf_thresh, nms_thresh)[0]
-    # bbox = det[..., 0:4]
-    if det.device != 'cpu':
-        det = det.detach_().cpu().numpy()
+    # det holds a single image's predictions; pages leave only tens of candidates after the confidence
+    # filter, which NumPy suppresses quicker than the torch round-trip (and without torchvision).
+    det = det[0][det[0][:, 4] > conf_thresh]
+    if len(det) <= NUMPY_NMS_MAX_CANDIDATES:
+        if isinstance(det, torch.Tensor):
+            det = det.detach().cpu().numpy()
+        det = non_max_suppression_numpy(det, conf_thresh, nms_thresh)
+    else:
+        if isinstance(det, np.ndarray):
+            det = torch.from_numpy(det)
+        det = non_max_suppression(det[None], conf_thresh, nms_thresh)[0]
+        det = det.detach().cpu().numpy()
     det[..., [0, 2]] = det[..., [0, 2]] * resize_ratio[0]
     det[..., [1, 3]] = det[..., [1, 3]] * resize_ratio[1]
     if sort_func is not None:
@@ -62,62 +82,171 @@ class TextDetector:
     lang_list = ['eng', 'ja', 'unknown']
     langcls2idx = {'eng': 0, 'ja': 1, 'unknown': 2}
 
-    def __init__(self, model_path, input_size=1024, device='cpu', half=False, nms_thresh=0.35, conf_thresh=0.4, mask_thresh=0.3, act='leaky'):
+    def __init__(self, model_path, input_size=1024, device='cpu', half=False, nms_thresh=0.35, conf_thresh=0.4, mask_thresh=0.3, act='leaky', backend=None, quantized_model_path=None, dynamic_shape=False,
+                 coarse_input_size=None, min_font_size=10, max_uncovered=0.3):
         super(TextDetector, self).__init__()
         cuda = device == 'cuda'
 
-        if Path(model_path).suffix == '.onnx':
-            self.model = cv2.dnn.readNetFromONNX(model_path)
+        if backend is None:
+            backend = 'opencv' if Path(model_path).suffix == '.onnx' else 'torch'
+        if backend == 'opencv':
             self.net = TextDetBaseDNN(input_size, model_path)
-            self.backend = 'opencv'
+        elif backend == 'onnxruntime':
+            self.net = TextDetBaseORT(model_path)
+        elif backend == 'torch' and quantized_model_path is not None:
+            from .quantization import load_quantized_detector
+            self.net = load_quantized_detector(model_path, quantized_model_path, act=act)
+        elif backend == 'torch':
+            self.net = TextDetBaseInference(model_path, device=device, act=act)
         else:
-            self.net = TextDetBase(model_path, device=device, act=act)
-            self.backend = 'torch'
+            raise ValueError(f'Unknown text detector backend: {backend}')
+        if dynamic_shape and backend != 'torch':
+            raise ValueError('dynamic_shape is only supported with the torch backend')
+        if coarse_input_size is not None and backend != 'torch':
+            raise ValueError('coarse_input_size is only supported with the torch backend')
+        self.backend = backend
+        self.dynamic_shape = dynamic_shape
 
         if isinstance(input_size, int):
             input_size = (input_size, input_size)
         self.input_size = input_size
+        self.coarse_input_size = coarse_input_size
+        self.min_font_size = min_font_size
+        self.max_uncovered = max_uncovered
+        self.num_coarse = 0  # pages detected at coarse_input_size
+        self.num_escalated = 0  # of those, pages detected again at input_size
         self.device = device
         self.half = half
         self.conf_thresh = conf_thresh
         self.nms_thresh = nms_thresh
-        self.seg_rep = SegDetectorRepresenter(thresh=0.3)
+        self.seg_rep = SegDetectorRepresenter(thresh=0.3, min_score=0.6)
+
+    @torch.no_grad()
+    def __call__(self, img, refine_mode=REFINEMASK_INPAINT, keep_undetected_mask=False, refine=True, lazy_refine=False):
+        return self.detect_batch([img], refine_mode=refine_mode, keep_undetected_mask=keep_undetected_mask, refine=refine, lazy_refine=lazy_refine)[0]
 
     @torch.no_grad()
-    def __call__(self, img, refine_mode=REFINEMASK_INPAINT, keep_undetected_mask=False):
-        img_in, ratio, dw, dh = preprocess_img(img, input_size=self.input_size, device=self.device, half=self.half, to_tensor=self.backend=='torch')
-        im_h, im_w = img.shape[:2]
-
-        blks, mask, lines_map = self.net(img_in)
-
-        resize_ratio = (im_w / (self.input_size[0] - dw), im_h / (self.input_size[1] - dh))
-        blks = postprocess_yolo(blks, self.conf_thresh, self.nms_thresh, resize_ratio)
-
-        if self.backend == 'opencv':
-            if mask.shape[1] == 2:     # some version of opencv spit out reversed result
-                tmp = mask
-                mask = lines_map
-                lines_map = tmp
-        mask = postprocess_mask(mask)
-
-        lines, scores = self.seg_rep(self.input_size, lines_map)
-        box_thresh = 0.6
-        idx = np.where(scores[0] > box_thresh)
-        lines, scores = lines[0][idx], scores[0][idx]
-
-        # map output to input img
-        mask = mask[: mask.shape[0]-dh, : mask.shape[1]-dw]
-        mask = cv2.resize(mask, (im_w, im_h), interpolation=cv2.INTER_LINEAR)
-        if lines.size == 0 :
-            lines = []
-        else :
-            lines = lines.astype(np.float64)
-            lines[..., 0] *= resize_ratio[0]
-            lines[..., 1] *= resize_ratio[1]
-            lines = lines.astype(np.int32)
-        blk_list = group_output(blks, lines, im_w, im_h, mask)
-        mask_refined = refine_mask(img, mask, blk_list, refine_mode=refine_mode)
-        if keep_undetected_mask:
-            mask_refined = refine_undetected_mask(img, mask, mask_refined, blk_list, refine_mode=refine_mode)
-
-        return mask, mask_refined, blk_list
+    def detect_batch(self, images, refine_mode=REFINEMASK_INPAINT, keep_undetected_mask=False, refine=True, lazy_refine=False):
+        """
+        Letterbox every page into a single N×3×H×W input, run the network once and
+        split the blocks, mask and lines maps back out per page.
+        Returns a (mask, mask_refined, blk_list) tuple per page, like `__call__`.
+        With dynamic_shape the batch is letterboxed to the smallest stride-aligned
+        shape that fits every page with its long side at input_size, instead of a
+        square. With refine=False mask_refined is None; the raw mask is still computed,
+        as group_output filters lines and blocks with it. With lazy_refine
+        mask_refined is a LazyRefinedMask that refines only the regions asked for.
+        With coarse_input_size, pages are first detected at that size and only
+        detected again at input_size if `needs_escalation` says the lettering is
+        too small or too much of the mask went undetected.
+        """
+        if self.coarse_input_size is None:
+            detections = self.detect_raw(images, self.input_size)
+        else:
+            coarse_size = (self.coarse_input_size, self.coarse_input_size)
+            detections = self.detect_raw(images, coarse_size)
+            escalate = [
+                ii for ii, (img, (mask, blk_list)) in enumerate(zip(images, detections))
+                if self.needs_escalation(img.shape, mask, blk_list)
+            ]
+            if escalate:
+                fine = self.detect_raw([images[ii] for ii in escalate], self.input_size)
+                for ii, detection in zip(escalate, fine):
+                    detections[ii] = detection
+            self.num_coarse += len(images)
+            self.num_escalated += len(escalate)
+
+        results = []
+        for img, (mask, blk_list) in zip(images, detections):
+            if not refine:
+                results.append((mask, None, blk_list))
+                continue
+            if lazy_refine:
+                lazy_mask = LazyRefinedMask(img, mask, blk_list, keep_undetected_mask=keep_undetected_mask, refine_mode=refine_mode)
+                results.append((mask, lazy_mask, blk_list))
+                continue
+            mask_refined = refine_mask(img, mask, blk_list, refine_mode=refine_mode)
+            if keep_undetected_mask:
+                mask_refined = refine_undetected_mask(img, mask, mask_refined, blk_list, refine_mode=refine_mode)
+            results.append((mask, mask_refined, blk_list))
+        return results
+
+    def needs_escalation(self, img_shape, mask, blk_list):
+        """
+        Whether a coarse detection should be redone at full input size: the median
+        font size, in coarse input pixels, is below min_font_size, or more than
+        max_uncovered of the text mask lies outside every detected block.
+        """
+        im_h, im_w = img_shape[:2]
+        if blk_list:
+            scale = self.coarse_input_size / max(im_h, im_w)
+            if np.median([blk.font_size for blk in blk_list]) * scale < self.min_font_size:
+                return True
+        text = mask > 30
+        num_text = np.count_nonzero(text)
+        if num_text == 0:
+            return False
+        for blk in blk_list:
+            x1, y1, x2, y2 = blk.xyxy
+            text[max(y1, 0): y2, max(x1, 0): x2] = False
+        return np.count_nonzero(text) / num_text > self.max_uncovered
+
+    @torch.no_grad()
+    def detect_raw(self, images, input_size):
+        """
+        Detection without mask refinement at the given (h, w) input size.
+        Returns a (mask, blk_list) tuple per page.
+        """
+        torch_backend = self.backend == 'torch'
+        if self.dynamic_shape:
+            shapes = [dynamic_input_size(img.shape, max(input_size)) for img in images]
+            input_size = (max(h for h, w in shapes), max(w for h, w in shapes))
+        inputs, paddings = [], []
+        for img in images:
+            img_in, ratio, dw, dh = preprocess_img(
+                img, input_size=input_size,
+                device=self.device if torch_backend else 'cpu',
+                half=self.half and torch_backend,
+                to_tensor=self.backend != 'opencv',
+            )
+            inputs.append(img_in)
+            paddings.append((dw, dh))
+        if torch_backend:
+            batch_in = torch.cat(inputs)
+        elif self.backend == 'onnxruntime':
+            batch_in = torch.cat(inputs).numpy()
+        else:
+            batch_in = inputs
+
+        blks, masks, lines_maps = self.net(batch_in)
+
+        if isinstance(masks, torch.Tensor):
+            masks = masks.detach().cpu().numpy()
+        lines_batch, scores_batch = self.seg_rep(input_size, lines_maps)
+
+        results = []
+        for ii, (img, (dw, dh)) in enumerate(zip(images, paddings)):
+            im_h, im_w = img.shape[:2]
+            # input_size is (h, w); dw, dh are the right and bottom padding.
+            resize_ratio = (im_w / (input_size[1] - dw), im_h / (input_size[0] - dh))
+            page_blks = postprocess_yolo(blks[ii: ii+1], self.conf_thresh, self.nms_thresh, resize_ratio)
+            mask = postprocess_mask(masks[ii])
+
+            box_thresh = 0.6
+            idx = np.where(scores_batch[ii] > box_thresh)
+            lines = lines_batch[ii][idx]
+
+            # map output to input img
+            mask = mask[: mask.shape[0]-dh, : mask.shape[1]-dw]
+            mask = cv2.resize(mask, (im_w, im_h), interpolation=cv2.INTER_LINEAR)
+            if lines.size == 0 :
+                lines = []
+            else :
+                lines = lines.astype(np.float64)
+                lines[..., 0] *= resize_ratio[0]
+                lines[..., 1] *= resize_ratio[1]
+                lines = lines.astype(np.int32)
+            blk_list = group_output(page_blks, lines, im_w, im_h, mask)
+            results.append((mask, blk_list))
+
+        return results
@@ -19,6 +19,7 @@ class Detect(nn.Module):
         self.na = len(anchors[0]) // 2  # number of anchors
         self.grid = [torch.zeros(1)] * self.nl  # init grid
         self.anchor_grid = [torch.zeros(1)] * self.nl  # init anchor grid
+        self.grid_cache = {}  # (nx, ny, i, device) -> (grid, anchor_grid), for inputs of varying shape
         self.register_buffer('anchors', torch.tensor(anchors).float().view(self.nl, -1, 2))  # shape(nl,na,2)
         self.m = nn.ModuleList(nn.Conv2d(x, self.no * self.na, 1) for x in ch)  # output conv
         self.inplace = inplace  # use in-place ops (e.g. slice assignment)
@@ -31,8 +32,10 @@ class Detect(nn.Module):
             x[i] = x[i].view(bs, self.na, self.no, ny, nx).permute(0, 1, 3, 4, 2).contiguous()
 
             if not self.training:  # inference
-                if self.onnx_dynamic or self.grid[i].shape[2:4] != x[i].shape[2:4]:
+                if self.onnx_dynamic:
                     self.grid[i], self.anchor_grid[i] = self._make_grid(nx, ny, i)
+                elif self.grid[i].shape[2:4] != x[i].shape[2:4]:
+                    self.grid[i], self.anchor_grid[i] = self._cached_grid(nx, ny, i)
 
                 y = x[i].sigmoid()
                 if self.inplace:
@@ -46,6 +49,12 @@ class Detect(nn.Module):
 
         return x if self.training else (torch.cat(z, 1), x)
 
+    def _cached_grid(self, nx, ny, i):
+        key = (nx, ny, i, str(self.anchors.device))
+        if key not in self.grid_cache:
+            self.grid_cache[key] = self._make_grid(nx, ny, i)
+        return self.grid_cache[key]
+
     def _make_grid(self, nx=20, ny=20, i=0):
         d = self.anchors[i].device
         if check_version(torch.__version__, '1.10.0'):  # torch>=1.10.0 meshgrid workaround for torch>=0.7 compatibility
@@ -280,6 +289,8 @@ def load_yolov5(weights, map_location='cuda', fuse=True, inplace=True, out_indic
                 if not isinstance(m.anchor_grid, list):  # new Detect Layer compatibility
                     delattr(m, 'anchor_grid')
                     setattr(m, 'anchor_grid', [torch.zeros(1)] * m.nl)
+                if not hasattr(m, 'grid_cache'):
+                    m.grid_cache = {}
         elif type(m) is Conv:
             m._non_persistent_buffers_set = set()  # pytorch 1.6.0 compatibility
     model.out_indices = out_indices
@@ -308,6 +319,8 @@ def load_yolov5_ckpt(weights, map_location='cpu', fuse=True, inplace=True, out_i
                 if not isinstance(m.anchor_grid, list):  # new Detect Layer compatibility
                     delattr(m, 'anchor_grid')
                     setattr(m, 'anchor_grid', [torch.zeros(1)] * m.nl)
+                if not hasattr(m, 'grid_cache'):
+                    m.grid_cache = {}
         elif type(m) is Conv:
             m._non_persistent_buffers_set = set()  # pytorch 1.6.0 compatibility
     model.out_indices = out_indices
@@ -0,0 +1,150 @@
+import copy
+from contextlib import contextmanager
+from typing import Iterable
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from .basemodel import TEXTDET_INFERENCE, get_base_det_models
+from .inference import preprocess_img
+from .models.yolov5.yolo import Detect
+
+
+class _BlkDet(nn.Module):
+    # FX can only trace tensor arguments, so the sub-networks' mode flags are fixed here.
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, x):
+        return self.model(x, detect=True)
+
+
+class _TextSeg(nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, f160, f80, f40, f20, f3):
+        return self.model(f160, f80, f40, f20, f3, forward_mode=TEXTDET_INFERENCE)
+
+
+class _TextDet(nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, f80, f40, u40):
+        return self.model.forward_shrink(f80, f40, u40)
+
+
+class TextDetBaseInt8(nn.Module):
+    """TextDetBase with its three sub-networks statically quantized to int8 (CPU only)."""
+
+    def __init__(self, blk_det, text_seg, text_det):
+        super().__init__()
+        self.blk_det = blk_det
+        self.text_seg = text_seg
+        self.text_det = text_det
+
+    def forward(self, features):
+        blks, features = self.blk_det(features)
+        mask, features = self.text_seg(*features)
+        lines = self.text_det(*features)
+        return blks[0], mask, lines
+
+
+# Quantized engines in order of preference. The saved state depends on the engine's default qconfig
+# (x86's observes convolution weights per channel, qnnpack's per tensor), so it's saved along with it.
+_ENGINES = ('x86', 'qnnpack')
+
+
+def _pick_engine() -> str:
+    supported = torch.backends.quantized.supported_engines
+    for engine in _ENGINES:
+        if engine in supported:
+            return engine
+    raise RuntimeError(f'The int8 text detector needs one of the {_ENGINES} quantized engines, this torch has {supported}')
+
+
+@contextmanager
+def _quantized_engine(engine):
+    """Prepare and pack weights for `engine` within, leaving the process-wide setting as it was after."""
+    if engine not in torch.backends.quantized.supported_engines:
+        raise RuntimeError(f'The int8 text detector was quantized for the {engine} engine, which this torch lacks')
+    previous = torch.backends.quantized.engine
+    torch.backends.quantized.engine = engine
+    try:
+        yield
+    finally:
+        torch.backends.quantized.engine = previous
+
+
+def _prepare(model_path, input_size, act, engine):
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.fx.custom_config import PrepareCustomConfig
+    from torch.ao.quantization.quantize_fx import prepare_fx
+
+    qconfig_mapping = get_default_qconfig_mapping(engine)
+    # Detect rebuilds its anchor grids based on the input shape, which FX can't trace; it stays in fp32.
+    custom_config = PrepareCustomConfig().set_non_traceable_module_classes([Detect])
+
+    blk_det, text_seg, text_det = get_base_det_models(model_path, device='cpu', act=act)
+    blk_det, text_seg, text_det = _BlkDet(blk_det), _TextSeg(text_seg), _TextDet(text_det)
+
+    # Trace each sub-network with example inputs of the shapes it sees at inference.
+    x = torch.zeros(1, 3, input_size, input_size)
+    with torch.no_grad():
+        blks, features = blk_det(x)
+        mask, seg_features = text_seg(*features)
+    prepared = []
+    for model, example_inputs in ((blk_det, (x,)), (text_seg, tuple(features)), (text_det, tuple(seg_features))):
+        prepared.append(prepare_fx(model.eval(), qconfig_mapping, example_inputs, prepare_custom_config=custom_config))
+    return prepared
+
+
+def quantize_detector(model_path, images: Iterable[np.ndarray], output_path, input_size=1024, act='leaky'):
+    """
+    Calibrate on `images` (BGR pages, as read by mokuro) and save int8 weights and
+    activation ranges for the detector's sub-networks to `output_path`.
+    Returns the number of calibration pages used.
+    """
+    from torch.ao.quantization.quantize_fx import convert_fx
+
+    engine = _pick_engine()
+    with _quantized_engine(engine):
+        prepared = _prepare(model_path, input_size, act, engine)
+        net = TextDetBaseInt8(*prepared)
+        num_images = 0
+        with torch.no_grad():
+            for img in images:
+                img_in, *_ = preprocess_img(img, input_size=(input_size, input_size))
+                net(img_in)
+                num_images += 1
+        if num_images == 0:
+            raise ValueError('No calibration images')
+
+        converted = [convert_fx(copy.deepcopy(model)) for model in prepared]
+    torch.save({
+        'input_size': input_size,
+        'engine': engine,
+        'blk_det': converted[0].state_dict(),
+        'text_seg': converted[1].state_dict(),
+        'text_det': converted[2].state_dict(),
+    }, output_path)
+    return num_images
+
+
+def load_quantized_detector(model_path, int8_path, act='leaky') -> TextDetBaseInt8:
+    """Rebuild the int8 graph from the fp32 checkpoint and load the calibrated state saved by `quantize_detector`."""
+    from torch.ao.quantization.quantize_fx import convert_fx
+
+    state = torch.load(int8_path, map_location='cpu')
+    engine = state.get('engine', 'x86')  # files saved before the engine was recorded were all x86
+    with _quantized_engine(engine):
+        prepared = _prepare(model_path, state['input_size'], act, engine)
+        converted = [convert_fx(model) for model in prepared]
+        for model, key in zip(converted, ('blk_det', 'text_seg', 'text_det')):
+            model.load_state_dict(state[key])
+    return TextDetBaseInt8(*converted).eval()
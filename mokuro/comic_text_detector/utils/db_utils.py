@@ -30,12 +30,13 @@ def iou_rotate(box_a, box_b, method='union'):
         return iou
 
 class SegDetectorRepresenter():
-    def __init__(self, thresh=0.3, box_thresh=0.7, max_candidates=1000, unclip_ratio=1.5):
+    def __init__(self, thresh=0.3, box_thresh=0.7, max_candidates=1000, unclip_ratio=1.5, min_score=None):
         self.min_size = 3
         self.thresh = thresh
         self.box_thresh = box_thresh
         self.max_candidates = max_candidates
         self.unclip_ratio = unclip_ratio
+        self.min_score = min_score  # boxes_from_bitmap drops boxes scoring <= min_score
 
     def __call__(self, batch, pred, is_output_polygon=False):
         '''
@@ -124,6 +125,8 @@ class SegDetectorRepresenter():
         '''
         _bitmap: single map with shape (H, W),
             whose values are binarized as {0, 1}
+        Returns an (N, 4, 2) int16 array of boxes and their (N,) scores, leaving out
+        contours too thin for a box and, with min_score, boxes scoring <= min_score.
         '''
 
         assert len(_bitmap.shape) == 2
@@ -132,38 +135,61 @@ class SegDetectorRepresenter():
             pred = pred.cpu().detach().numpy()
         else:
             bitmap = _bitmap
+        if pred.dtype == np.float16:
+            pred = pred.astype(np.float32)
         height, width = bitmap.shape
-        contours, _ = cv2.findContours((bitmap * 255).astype(np.uint8), cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
-        num_contours = min(len(contours), self.max_candidates)
-        boxes = np.zeros((num_contours, 4, 2), dtype=np.int16)
-        scores = np.zeros((num_contours,), dtype=np.float32)
+        bitmap = (bitmap * 255).astype(np.uint8)
+        all_contours, _ = cv2.findContours(bitmap, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+        contours = all_contours[:self.max_candidates]
+
+        if self.min_score is not None and self.min_score >= self.thresh and len(contours) > 0:
+            # Every pixel of an 8-connected component is above thresh, and filling the outer contour
+            # of a component without holes only adds background pixels, which are not, so the
+            # component's mean bounds box_score_fast from above. Components averaging <= min_score
+            # are rejected from one bincount over the labels. A hole may hold other components,
+            # which would raise the fill's mean, so components with holes are always scored.
+            num_labels, labels, stats, _ = cv2.connectedComponentsWithStats(bitmap, connectivity=8)
+            fg = np.flatnonzero(bitmap)
+            sums = np.bincount(labels.ravel()[fg], weights=pred.ravel()[fg], minlength=num_labels)
+            component_scores = sums / np.maximum(stats[:, cv2.CC_STAT_AREA], 1)
+            # hole contours run the other way round, along pixels of the component around them
+            outer = np.array([cv2.contourArea(contour, oriented=True) <= 0 for contour in all_contours])
+            for contour in (c for c, is_outer in zip(all_contours, outer) if not is_outer):
+                x, y = contour[0, 0]
+                component_scores[labels[y, x]] = np.inf
+        else:
+            component_scores = None
 
-        for index in range(num_contours):
-            contour = contours[index].squeeze(1)
+        if not isinstance(dest_width, int):
+            dest_width = dest_width.item()
+            dest_height = dest_height.item()
+
+        boxes, scores = [], []
+        for index, contour in enumerate(contours):
+            if component_scores is not None and outer[index]:
+                x, y = contour[0, 0]
+                if component_scores[labels[y, x]] <= self.min_score:
+                    continue
+            contour = contour.squeeze(1)
             points, sside = self.get_mini_boxes(contour)
-            # if sside < self.min_size:
-            #     continue
             if sside < 2:
                 continue
             points = np.array(points)
             score = self.box_score_fast(pred, contour)
-            # if self.box_thresh > score:
-            #     continue
+            if self.min_score is not None and score <= self.min_score:
+                continue
 
             box = self.unclip(points, unclip_ratio=self.unclip_ratio).reshape(-1, 1, 2)
             box, sside = self.get_mini_boxes(box)
-            # if sside < 5:
-            #     continue
             box = np.array(box)
-            if not isinstance(dest_width, int):
-                dest_width = dest_width.item()
-                dest_height = dest_height.item()
-
             box[:, 0] = np.clip(np.round(box[:, 0] / width * dest_width), 0, dest_width)
             box[:, 1] = np.clip(np.round(box[:, 1] / height * dest_height), 0, dest_height)
-            boxes[index, :, :] = box.astype(np.int16)
-            scores[index] = score
-        return boxes, scores
+            boxes.append(box.astype(np.int16))
+            scores.append(score)
+
+        if not boxes:
+            return np.zeros((0, 4, 2), dtype=np.int16), np.zeros((0,), dtype=np.float32)
+        return np.stack(boxes), np.array(scores, dtype=np.float32)
 
     def unclip(self, box, unclip_ratio=1.5):
         poly = Polygon(box)
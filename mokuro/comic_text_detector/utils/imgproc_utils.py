@@ -19,6 +19,28 @@ def union_area(bboxa, bboxb):
         return -1
     return (y2 - y1) * (x2 - x1)
 
+def union_area_matrix(bboxes_a, bboxes_b):
+    """union_area for every pair of an (N, 4) and an (M, 4) array of xyxy boxes, as an (N, M) array."""
+    bboxes_a = np.asarray(bboxes_a)[:, None]
+    bboxes_b = np.asarray(bboxes_b)[None]
+    x1 = np.maximum(bboxes_a[..., 0], bboxes_b[..., 0])
+    y1 = np.maximum(bboxes_a[..., 1], bboxes_b[..., 1])
+    x2 = np.minimum(bboxes_a[..., 2], bboxes_b[..., 2])
+    y2 = np.minimum(bboxes_a[..., 3], bboxes_b[..., 3])
+    return np.where((y2 < y1) | (x2 < x1), -1, (y2 - y1) * (x2 - x1))
+
+def box_means(img, bboxes):
+    """img[y1: y2, x1: x2].mean() for every row of an (N, 4) array of non-negative xyxy boxes, from one integral image."""
+    im_h, im_w = img.shape[:2]
+    bboxes = np.asarray(bboxes, dtype=np.int64).reshape(-1, 4)
+    x1, x2 = np.clip(bboxes[:, 0], 0, im_w), np.clip(bboxes[:, 2], 0, im_w)
+    y1, y2 = np.clip(bboxes[:, 1], 0, im_h), np.clip(bboxes[:, 3], 0, im_h)
+    x2, y2 = np.maximum(x1, x2), np.maximum(y1, y2)
+    integral = cv2.integral(img, sdepth=cv2.CV_64F)
+    sums = integral[y2, x2] - integral[y1, x2] - integral[y2, x1] + integral[y1, x1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return sums / ((y2 - y1) * (x2 - x1))    # nan for empty boxes, like the mean of an empty slice
+
 def get_yololabel_strings(clslist, labellist):
     content = ''
     for cls, xywh in zip(clslist, labellist):
@@ -0,0 +1,97 @@
+import cv2
+import numpy as np
+
+
+class LineCropper:
+    """
+    Crops every line of a page's blocks like TextBlk.get_transformed_region, but with
+    all the line transforms worked out up front, so each one can be applied to both
+    the page and its mask:
+
+    * axis-aligned lines (nearly all of them) are cut out with a slice and a resize,
+    * the rest are warped with the perspective transform of their four corners, solved
+      for all of them at once (getPerspectiveTransform, not a RANSAC homography),
+    * crops come out in the orientation the OCR model reads them: vertical lines stay
+      upright instead of being rotated to horizontal and back.
+
+    Lines are addressed by block and line index, in the order of blk_list.
+    """
+
+    def __init__(self, blk_list, img_shape, textheight=64):
+        im_h, im_w = img_shape[:2]
+        self.offsets = np.cumsum([0] + [len(blk) for blk in blk_list])
+        if not blk_list or self.offsets[-1] == 0:
+            self.vertical = np.zeros(0, dtype=bool)
+            return
+        src_pts = np.concatenate([blk.lines_array() for blk in blk_list])
+        self.vertical = np.concatenate([np.full(len(blk), bool(blk.vertical)) for blk in blk_list])
+        e_size = np.concatenate([
+            np.full(len(blk), blk.font_size / 3 if blk.language == 'eng' or (blk.language == 'unknown' and not blk.vertical) else 0)
+            for blk in blk_list
+        ])
+
+        expand = e_size > 0
+        src_pts[expand] += e_size[expand, None, None] * np.array([[-1, -1], [1, -1], [1, 1], [-1, 1]])
+        src_pts[expand, :, 0] = np.clip(src_pts[expand, :, 0], 0, im_w)
+        src_pts[expand, :, 1] = np.clip(src_pts[expand, :, 1], 0, im_h)
+
+        middle_pnt = (src_pts[:, [1, 2, 3, 0]] + src_pts) / 2
+        len_v = np.linalg.norm(middle_pnt[:, 2] - middle_pnt[:, 0], axis=1)  # along the line for vertical lines
+        len_h = np.linalg.norm(middle_pnt[:, 1] - middle_pnt[:, 3], axis=1)
+        ratio = len_v / len_h
+        w = np.where(self.vertical, int(textheight), np.round(textheight / ratio))
+        h = np.where(self.vertical, np.round(textheight * ratio), int(textheight))
+        self.sizes = np.maximum(np.column_stack([w, h]), 1).astype(np.int64)
+
+        x, y = src_pts[..., 0], src_pts[..., 1]
+        self.axis_aligned = (
+            (x[:, 0] == x[:, 3]) & (x[:, 1] == x[:, 2]) & (y[:, 0] == y[:, 1]) & (y[:, 2] == y[:, 3])
+            & (x[:, 0] < x[:, 1]) & (y[:, 0] < y[:, 3])
+            # a slice would cut off what lies past the page border, which the warp fills in with black
+            & (x[:, 0] >= 0) & (y[:, 0] >= 0) & (x[:, 1] < im_w) & (y[:, 3] < im_h)
+        )
+        self.slices = np.column_stack([x[:, 0], y[:, 0], x[:, 1] + 1, y[:, 3] + 1]).astype(np.int64)
+        self.matrices = np.full((len(src_pts), 3, 3), np.nan)
+        warped = ~self.axis_aligned
+        if warped.any():
+            self.matrices[warped] = perspective_transforms(src_pts[warped], self.sizes[warped])
+
+    def __len__(self):
+        return len(self.vertical)
+
+    def line_index(self, blk_idx, line_idx):
+        return self.offsets[blk_idx] + line_idx
+
+    def crop(self, img, blk_idx, line_idx):
+        """The crop of a line out of img, which may be the page or anything page-sized, such as its mask."""
+        ii = self.line_index(blk_idx, line_idx)
+        dsize = tuple(int(s) for s in self.sizes[ii])
+        if self.axis_aligned[ii]:
+            x1, y1, x2, y2 = self.slices[ii]
+            return cv2.resize(img[y1: y2, x1: x2], dsize, interpolation=cv2.INTER_LINEAR)
+        return cv2.warpPerspective(img, self.matrices[ii], dsize)
+
+
+def perspective_transforms(src_pts, sizes):
+    """
+    cv2.getPerspectiveTransform from each (4, 2) quad of src_pts to the corners of a w×h
+    crop, for an (N, 4, 2) array of quads and an (N, 2) array of (w, h) sizes, solving all
+    N 8×8 systems in one go.
+    """
+    w, h = np.maximum(sizes[:, 0] - 1, 1), np.maximum(sizes[:, 1] - 1, 1)
+    zero = np.zeros_like(w)
+    dst_pts = np.stack([np.column_stack(p) for p in ((zero, zero), (w, zero), (w, h), (zero, h))], axis=1).astype(np.float64)
+
+    n = len(src_pts)
+    x, y = src_pts[..., 0], src_pts[..., 1]
+    u, v = dst_pts[..., 0], dst_pts[..., 1]
+    ones, zeros = np.ones_like(x), np.zeros_like(x)
+    rows_u = np.stack([x, y, ones, zeros, zeros, zeros, -u * x, -u * y], axis=-1)
+    rows_v = np.stack([zeros, zeros, zeros, x, y, ones, -v * x, -v * y], axis=-1)
+    a = np.concatenate([rows_u, rows_v], axis=1)
+    b = np.concatenate([u, v], axis=1)
+    try:
+        coeffs = np.linalg.solve(a, b[..., None])[..., 0]
+    except np.linalg.LinAlgError:  # some degenerate quad; don't let it take the others down with it
+        coeffs = (np.linalg.pinv(a) @ b[..., None])[..., 0]
+    return np.concatenate([coeffs, np.ones((n, 1))], axis=1).reshape(n, 3, 3)
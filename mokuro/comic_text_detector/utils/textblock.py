@@ -4,17 +4,26 @@ from typing import List
 
 import cv2
 import numpy as np
+import shapely
 from shapely.geometry import Polygon
 
-from .imgproc_utils import union_area, xywh2xyxypoly, rotate_polygons
+from .imgproc_utils import box_means, union_area_matrix, xywh2xyxypoly, rotate_polygons
 
 LANG_LIST = ['eng', 'ja', 'unknown']
 LANGCLS2IDX = {'eng': 0, 'ja': 1, 'unknown': 2}
 
 
-class TextBlock(object):
+class TextBlk:
+    """
+    A detected text block: just what detection, grouping and OCR use, in __slots__,
+    with lines kept as a single (N, 4, 2) int32 array of quads.
+    TextBlock adds the translation and rendering attributes of the original
+    comic-text-detector on top.
+    """
+    __slots__ = ('xyxy', '_lines', 'language', 'vertical', 'font_size', 'distance', 'angle', 'vec', 'norm', 'merged', 'weight')
+
     def __init__(self, xyxy: List,
-                       lines: List = None,
+                       lines = None,
                        language: str = 'unknown',
                        vertical: bool = False,
                        font_size: float = -1,
@@ -23,28 +32,7 @@ class TextBlock(object):
                        vec: List = None,
                        norm: float = -1,
                        merged: bool = False,
-                       weight: float = -1,
-                       text: List = None,
-                       translation: str = "",
-                       fg_r = 0,
-                       fg_g = 0,
-                       fg_b = 0,
-                       bg_r = 0,
-                       bg_g = 0,
-                       bg_b = 0,
-                       line_spacing = 1.,
-                       font_family: str = "",
-                       bold: bool = False,
-                       underline: bool = False,
-                       italic: bool = False,
-                       alignment: int = -1,
-                       alpha: float = 255,
-                       rich_text: str = "",
-                       _bounding_rect: List = None,
-                       accumulate_color = True,
-                       default_stroke_width = 0.2,
-                       target_lang: str = "",
-                       **kwargs) -> None:
+                       weight: float = -1) -> None:
         self.xyxy = [int(num) for num in xyxy]                    # boundingbox of textblock
         self.lines = [] if lines is None else lines     # polygons of textlines
         self.vertical = vertical            # orientation of textlines
@@ -58,37 +46,25 @@ class TextBlock(object):
         self.merged = merged
         self.weight = weight
 
-        self.text = text if text is not None else []
-        self.prob = 1
+    @property
+    def lines(self) -> np.ndarray:
+        return self._lines
 
-        self.translation = translation
+    @lines.setter
+    def lines(self, lines):
+        self._lines = np.asarray(lines, dtype=np.int32).reshape(-1, 4, 2)
 
-        # note they're accumulative rgb values of textlines
-        self.fg_r = fg_r
-        self.fg_g = fg_g
-        self.fg_b = fg_b
-        self.bg_r = bg_r
-        self.bg_g = bg_g
-        self.bg_b = bg_b
+    def add_line(self, line):
+        self._lines = np.concatenate([self._lines, np.asarray(line, dtype=np.int32).reshape(1, 4, 2)])
 
-        # self.stroke_width = stroke_width
-        self.font_family: str = font_family
-        self.bold: bool = bold
-        self.underline: bool = underline
-        self.italic: bool = italic
-        self.alpha = alpha
-        self.rich_text = rich_text
-        self.line_spacing = line_spacing
-        # self.alignment = alignment
-        self._alignment = alignment
-        self._target_lang = target_lang
-
-        self._bounding_rect = _bounding_rect
-        self.default_stroke_width = default_stroke_width
-        self.accumulate_color = accumulate_color
+    def copy(self):
+        # Shallow, apart from xyxy, which adjust_bbox updates in place.
+        blk = copy.copy(self)
+        blk.xyxy = list(self.xyxy)
+        return blk
 
     def adjust_bbox(self, with_bbox=False):
-        lines = self.lines_array().astype(np.int32)
+        lines = self.lines
         if with_bbox:
             self.xyxy[0] = min(lines[..., 0].min(), self.xyxy[0])
             self.xyxy[1] = min(lines[..., 1].min(), self.xyxy[1])
@@ -104,11 +80,10 @@ class TextBlock(object):
         if self.distance is not None:
             idx = np.argsort(self.distance)
             self.distance = self.distance[idx]
-            lines = np.array(self.lines, dtype=np.int32)
-            self.lines = lines[idx].tolist()
+            self.lines = self.lines[idx]
 
     def lines_array(self, dtype=np.float64):
-        return np.array(self.lines, dtype=dtype)
+        return self.lines.astype(dtype)
 
     def aspect_ratio(self) -> float:
         min_rect = self.min_rect()
@@ -138,19 +113,10 @@ class TextBlock(object):
 
     # equivalent to qt's boundingRect, ignore angle
     def bounding_rect(self):
-        if self._bounding_rect is None:
-        # if True:
-            min_bbox = self.min_rect(rotate_back=False)[0]
-            x, y = min_bbox[0]
-            w, h = min_bbox[2] - min_bbox[0]
-            return [x, y, w, h]
-        return self._bounding_rect
-
-    def __getattribute__(self, name: str):
-        if name == 'pts':
-            return self.lines_array()
-        # else:
-        return object.__getattribute__(self, name)
+        min_bbox = self.min_rect(rotate_back=False)[0]
+        x, y = min_bbox[0]
+        w, h = min_bbox[2] - min_bbox[0]
+        return [x, y, w, h]
 
     def __len__(self):
         return len(self.lines)
@@ -158,10 +124,6 @@ class TextBlock(object):
     def __getitem__(self, idx):
         return self.lines[idx]
 
-    def to_dict(self):
-        blk_dict = copy.deepcopy(vars(self))
-        return blk_dict
-
     def get_transformed_region(self, img, idx, textheight) -> np.ndarray :
         im_h, im_w = img.shape[:2]
         direction = 'v' if self.vertical else 'h'
@@ -183,19 +145,108 @@ class TextBlock(object):
             h = int(textheight)
             w = int(round(textheight / ratio))
             dst_pts = np.array([[0, 0], [w - 1, 0], [w - 1, h - 1], [0, h - 1]]).astype(np.float32)
-            M, _ = cv2.findHomography(src_pts, dst_pts, cv2.RANSAC, 5.0)
+            M = cv2.getPerspectiveTransform(src_pts.astype(np.float32), dst_pts)
             region = cv2.warpPerspective(img, M, (w, h))
         elif direction == 'v' :
             w = int(textheight)
             h = int(round(textheight * ratio))
             dst_pts = np.array([[0, 0], [w - 1, 0], [w - 1, h - 1], [0, h - 1]]).astype(np.float32)
-            M, _ = cv2.findHomography(src_pts, dst_pts, cv2.RANSAC, 5.0)
+            M = cv2.getPerspectiveTransform(src_pts.astype(np.float32), dst_pts)
             region = cv2.warpPerspective(img, M, (w, h))
             region = cv2.rotate(region, cv2.ROTATE_90_COUNTERCLOCKWISE)
         # cv2.imshow('region'+str(idx), region)
         # cv2.waitKey(0)
         return region
 
+
+class TextBlock(TextBlk):
+    """
+    The original comic-text-detector block: TextBlk plus the translation and
+    rendering attributes mokuro doesn't use, kept for code written against it.
+    """
+    def __init__(self, xyxy: List,
+                       lines: List = None,
+                       language: str = 'unknown',
+                       vertical: bool = False,
+                       font_size: float = -1,
+                       distance: List = None,
+                       angle: int = 0,
+                       vec: List = None,
+                       norm: float = -1,
+                       merged: bool = False,
+                       weight: float = -1,
+                       text: List = None,
+                       translation: str = "",
+                       fg_r = 0,
+                       fg_g = 0,
+                       fg_b = 0,
+                       bg_r = 0,
+                       bg_g = 0,
+                       bg_b = 0,
+                       line_spacing = 1.,
+                       font_family: str = "",
+                       bold: bool = False,
+                       underline: bool = False,
+                       italic: bool = False,
+                       alignment: int = -1,
+                       alpha: float = 255,
+                       rich_text: str = "",
+                       _bounding_rect: List = None,
+                       accumulate_color = True,
+                       default_stroke_width = 0.2,
+                       target_lang: str = "",
+                       **kwargs) -> None:
+        super(TextBlock, self).__init__(xyxy, lines, language, vertical, font_size, distance, angle, vec, norm, merged, weight)
+
+        self.text = text if text is not None else []
+        self.prob = 1
+
+        self.translation = translation
+
+        # note they're accumulative rgb values of textlines
+        self.fg_r = fg_r
+        self.fg_g = fg_g
+        self.fg_b = fg_b
+        self.bg_r = bg_r
+        self.bg_g = bg_g
+        self.bg_b = bg_b
+
+        # self.stroke_width = stroke_width
+        self.font_family: str = font_family
+        self.bold: bool = bold
+        self.underline: bool = underline
+        self.italic: bool = italic
+        self.alpha = alpha
+        self.rich_text = rich_text
+        self.line_spacing = line_spacing
+        # self.alignment = alignment
+        self._alignment = alignment
+        self._target_lang = target_lang
+
+        self._bounding_rect = _bounding_rect
+        self.default_stroke_width = default_stroke_width
+        self.accumulate_color = accumulate_color
+
+    @property
+    def pts(self):
+        return self.lines_array()
+
+    def copy(self):
+        blk = super(TextBlock, self).copy()
+        blk.text = list(self.text)
+        return blk
+
+    def bounding_rect(self):
+        if self._bounding_rect is None:
+            return super(TextBlock, self).bounding_rect()
+        return self._bounding_rect
+
+    def to_dict(self):
+        blk_dict = {name: getattr(self, name) for name in TextBlk.__slots__ if name != '_lines'}
+        blk_dict['lines'] = self.lines.tolist()
+        blk_dict.update(vars(self))
+        return copy.deepcopy(blk_dict)
+
     def get_text(self):
         if isinstance(self.text, str):
             return self.text
@@ -267,7 +318,7 @@ class TextBlock(object):
             return self.default_stroke_width
         return 0
 
-def sort_textblk_list(blk_list: List[TextBlock], im_w: int, im_h: int) -> List[TextBlock]:
+def sort_textblk_list(blk_list: List[TextBlk], im_w: int, im_h: int) -> List[TextBlk]:
     if len(blk_list) == 0:
         return blk_list
     num_ja = 0
@@ -302,7 +353,7 @@ def sort_textblk_list(blk_list: List[TextBlock], im_w: int, im_h: int) -> List[T
     blk_list.sort(key=lambda blk: blk.weight)
     return blk_list
 
-def examine_textblk(blk: TextBlock, im_w: int, im_h: int, sort: bool = False) -> None:
+def examine_textblk(blk: TextBlk, im_w: int, im_h: int, sort: bool = False) -> None:
     lines = blk.lines_array()
     middle_pnts = (lines[:, [1, 2, 3, 0]] + lines) / 2
     vec_v = middle_pnts[:, 2] - middle_pnts[:, 0]   # vertical vectors of textlines
@@ -330,7 +381,7 @@ def examine_textblk(blk: TextBlock, im_w: int, im_h: int, sort: bool = False) ->
     distance = np.linalg.norm(distance_vectors, axis=1)     # distance between textlinecenters and origin
     rad_matrix = np.arccos(np.einsum('ij, j->i', distance_vectors, primary_vec) / (distance * primary_norm))
     distance = np.abs(np.sin(rad_matrix) * distance)
-    blk.lines = lines.astype(np.int32).tolist()
+    blk.lines = lines
     blk.distance = distance
     blk.angle = rotation_angle
     if vertical:
@@ -344,7 +395,30 @@ def examine_textblk(blk: TextBlock, im_w: int, im_h: int, sort: bool = False) ->
     if sort:
         blk.sort_lines()
 
-def try_merge_textline(blk: TextBlock, blk2: TextBlock, fntsize_tol=1.3, distance_tol=2) -> bool:
+def quads_intersect(quads_a, quads_b) -> np.ndarray:
+    """
+    Polygon(a).intersects(Polygon(b)) for every pair of rows of two (N, 4, 2) arrays of quads,
+    by the separating axis theorem. Pairs with a quad that isn't strictly convex fall back to Shapely.
+    """
+    quads_a = np.asarray(quads_a, np.float64).reshape(-1, 4, 2)
+    quads_b = np.asarray(quads_b, np.float64).reshape(-1, 4, 2)
+    result = np.ones(len(quads_a), dtype=bool)
+    convex = np.ones(len(quads_a), dtype=bool)
+    for p, q in ((quads_a, quads_b), (quads_b, quads_a)):
+        edges = np.roll(p, -1, axis=1) - p
+        cross = edges[..., 0] * np.roll(edges, -1, axis=1)[..., 1] - edges[..., 1] * np.roll(edges, -1, axis=1)[..., 0]
+        convex &= np.all(cross > 0, axis=1) | np.all(cross < 0, axis=1)
+        normals = np.stack([-edges[..., 1], edges[..., 0]], axis=-1)
+        proj_p = np.einsum('nkd,njd->nkj', normals, p)
+        proj_q = np.einsum('nkd,njd->nkj', normals, q)
+        # touching counts as intersecting, as in Shapely
+        separated = (proj_p.max(axis=-1) < proj_q.min(axis=-1)) | (proj_q.max(axis=-1) < proj_p.min(axis=-1))
+        result &= ~separated.any(axis=1)
+    for ii in np.flatnonzero(~convex):
+        result[ii] = Polygon(quads_a[ii]).intersects(Polygon(quads_b[ii]))
+    return result
+
+def try_merge_textline(blk: TextBlk, blk2: TextBlk, fntsize_tol=1.3, distance_tol=2, intersects: bool = None) -> bool:
     if blk2.merged:
         return False
     fntsize_div = blk.font_size / blk2.font_size
@@ -355,8 +429,9 @@ def try_merge_textline(blk: TextBlock, blk2: TextBlock, fntsize_tol=1.3, distanc
     cos_vec = vec_prod / blk.norm / blk2.norm
     distance = blk2.distance[-1] - blk.distance[-1]
     distance_p1 = np.linalg.norm(np.array(blk2.lines[-1][0]) - np.array(blk.lines[-1][0]))
-    l1, l2 = Polygon(blk.lines[-1]), Polygon(blk2.lines[-1])
-    if not l1.intersects(l2):
+    if intersects is None:
+        intersects = Polygon(blk.lines[-1]).intersects(Polygon(blk2.lines[-1]))
+    if not intersects:
         if fntsize_div > fntsize_tol or 1 / fntsize_div > fntsize_tol:
             return False
         if abs(cos_vec) < 0.866:   # cos30
@@ -364,7 +439,7 @@ def try_merge_textline(blk: TextBlock, blk2: TextBlock, fntsize_tol=1.3, distanc
         if distance > distance_tol * fntsz_avg or distance_p1 > fntsz_avg * 2.5:
             return False
     # merge
-    blk.lines.append(blk2.lines[0])
+    blk.add_line(blk2.lines[0])
     blk.vec = vec_sum
     blk.angle = int(round(np.rad2deg(math.atan2(vec_sum[1], vec_sum[0]))))
     if blk.vertical:
@@ -375,85 +450,118 @@ def try_merge_textline(blk: TextBlock, blk2: TextBlock, fntsize_tol=1.3, distanc
     blk2.merged = True
     return True
 
-def merge_textlines(blk_list: List[TextBlock]) -> List[TextBlock]:
+def merge_textlines(blk_list: List[TextBlk], fntsize_tol=1.3, distance_tol=2) -> List[TextBlk]:
     if len(blk_list) < 2:
         return blk_list
     blk_list.sort(key=lambda blk: blk.distance[0])
+    # Scattered blocks hold a single line each, so index those once. try_merge_textline can only
+    # merge a block whose line intersects the current block's last line, or whose first point lies
+    # within distance_p1 <= 2.5 * fntsz_avg <= 2.5 * fntsize_tol * font_size of that line's.
+    quads = np.array([blk.lines[-1] for blk in blk_list], dtype=np.float64)
+    tree = shapely.STRtree(shapely.box(quads[..., 0].min(1), quads[..., 1].min(1), quads[..., 0].max(1), quads[..., 1].max(1)))
+    reach_r = 2.5 * fntsize_tol
     merged_list = []
     for ii, current_blk in enumerate(blk_list):
         if current_blk.merged:
             continue
-        for jj, blk in enumerate(blk_list[ii+1:]):
-            try_merge_textline(current_blk, blk)
+        start = ii + 1
+        while start < len(blk_list):
+            # The current block changes with every merge, so its candidates are looked up again after each.
+            line = np.array(current_blk.lines[-1], dtype=np.float64)
+            r = reach_r * current_blk.font_size + 1
+            x1, y1 = np.minimum(line.min(axis=0), line[0] - r) - 1
+            x2, y2 = np.maximum(line.max(axis=0), line[0] + r) + 1
+            candidates = np.sort(tree.query(shapely.box(x1, y1, x2, y2)))
+            candidates = [jj for jj in candidates[candidates >= start] if not blk_list[jj].merged]
+            if not candidates:
+                break
+            intersects = quads_intersect(np.broadcast_to(line, (len(candidates), 4, 2)), quads[candidates])
+            for jj, intersect in zip(candidates, intersects):
+                if try_merge_textline(current_blk, blk_list[jj], fntsize_tol, distance_tol, intersects=intersect):
+                    start = jj + 1
+                    break
+            else:
+                break
         merged_list.append(current_blk)
     for blk in merged_list:
         blk.adjust_bbox(with_bbox=False)
     return merged_list
 
-def split_textblk(blk: TextBlock):
-    font_size, distance, lines = blk.font_size, blk.distance, blk.lines
-    l0 = np.array(blk.lines[0])
-    lines.sort(key=lambda line: np.linalg.norm(np.array(line[0]) - l0[0]))
+def split_textblk(blk: TextBlk):
+    font_size, distance = blk.font_size, blk.distance
+    l0 = blk.lines[0]
+    order = np.argsort(np.linalg.norm(blk.lines[:, 0] - l0[0], axis=1), kind='stable')
+    blk.lines = lines = blk.lines[order]
     distance_tol = font_size * 2
-    current_blk = copy.deepcopy(blk)
-    current_blk.lines = [l0]
-    sub_blk_list = [current_blk]
-    textblock_splitted = False
+    groups = [[0]]
+    adjacent_intersect = quads_intersect(lines[:-1], lines[1:])
     for jj, line in enumerate(lines[1:]):
-        l1, l2 = Polygon(lines[jj]), Polygon(line)
         split = False
-        if not l1.intersects(l2):
+        if not adjacent_intersect[jj]:
             line_disance = abs(distance[jj+1] - distance[jj])
             if line_disance > distance_tol:
                 split = True
             elif blk.vertical and abs(blk.angle) < 15:
-                if len(current_blk.lines) > 1 or line_disance > font_size:
+                if len(groups[-1]) > 1 or line_disance > font_size:
                     split = abs(lines[jj][0][1] - line[0][1]) > font_size
         if split:
-            current_blk = copy.deepcopy(current_blk)
-            current_blk.lines = [line]
-            sub_blk_list.append(current_blk)
+            groups.append([jj + 1])
         else:
-            current_blk.lines.append(line)
-    if len(sub_blk_list) > 1:
-        textblock_splitted = True
-        for current_blk in sub_blk_list:
-            current_blk.adjust_bbox(with_bbox=False)
+            groups[-1].append(jj + 1)
+    sub_blk_list = []
+    for group in groups:
+        sub_blk = blk.copy()
+        sub_blk.lines = lines[group]
+        sub_blk_list.append(sub_blk)
+    textblock_splitted = len(sub_blk_list) > 1
+    if textblock_splitted:
+        for sub_blk in sub_blk_list:
+            sub_blk.adjust_bbox(with_bbox=False)
     return textblock_splitted, sub_blk_list
 
-def group_output(blks, lines, im_w, im_h, mask=None, sort_blklist=True) -> List[TextBlock]:
-    blk_list: List[TextBlock] = []
+def group_output(blks, lines, im_w, im_h, mask=None, sort_blklist=True) -> List[TextBlk]:
+    blk_list: List[TextBlk] = []
     scattered_lines = {'ver': [], 'hor': []}
     for bbox, cls, conf in zip(*blks):
         # cls could give wrong result
-        blk_list.append(TextBlock(bbox, language=LANG_LIST[cls]))
+        blk_list.append(TextBlk(bbox, language=LANG_LIST[cls]))
 
     # step1: filter & assign lines to textblocks
     bbox_score_thresh = 0.4
     mask_score_thresh = 0.1
+    if len(lines) > 0:
+        line_boxes = np.concatenate([lines.min(axis=1), lines.max(axis=1)], axis=1)     # xyxy of every line
+        line_areas = (line_boxes[:, 3] - line_boxes[:, 1]) * (line_boxes[:, 2] - line_boxes[:, 0])
+        if blk_list:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                scores = union_area_matrix(line_boxes, [blk.xyxy for blk in blk_list]) / line_areas[:, None]
+            scores[np.isnan(scores)] = -np.inf
+            bbox_idxs = scores.argmax(axis=1)
+            bbox_scores = scores[np.arange(len(lines)), bbox_idxs]
+        else:
+            bbox_idxs = np.full(len(lines), -1)
+            bbox_scores = np.full(len(lines), -1.)
+        assigned = bbox_scores > bbox_score_thresh
+        mask_scores = np.full(len(lines), np.nan)
+        if mask is not None:
+            mask_scores[~assigned] = box_means(mask, line_boxes[~assigned]) / 255
+
     for ii, line in enumerate(lines):
-        bx1, bx2 = line[:, 0].min(), line[:, 0].max()
-        by1, by2 = line[:, 1].min(), line[:, 1].max()
-        bbox_score, bbox_idx = -1, -1
-        line_area = (by2-by1) * (bx2-bx1)
+        if assigned[ii]:
+            continue
+        # if no textblock was assigned, check whether there is "enough" textmask
+        if mask_scores[ii] < mask_score_thresh:
+            continue
+        bx1, by1, bx2, by2 = line_boxes[ii]
+        blk = TextBlk([bx1, by1, bx2, by2], line)
+        examine_textblk(blk, im_w, im_h, sort=False)
+        if blk.vertical:
+            scattered_lines['ver'].append(blk)
+        else:
+            scattered_lines['hor'].append(blk)
+    if len(lines) > 0:
         for jj, blk in enumerate(blk_list):
-            score = union_area(blk.xyxy, [bx1, by1, bx2, by2]) / line_area
-            if bbox_score < score:
-                bbox_score = score
-                bbox_idx = jj
-        if bbox_score > bbox_score_thresh:
-            blk_list[bbox_idx].lines.append(line)
-        else:   # if no textblock was assigned, check whether there is "enough" textmask
-            if mask is not None:
-                mask_score = mask[by1: by2, bx1: bx2].mean() / 255
-                if mask_score < mask_score_thresh:
-                    continue
-            blk = TextBlock([bx1, by1, bx2, by2], [line])
-            examine_textblk(blk, im_w, im_h, sort=False)
-            if blk.vertical:
-                scattered_lines['ver'].append(blk)
-            else:
-                scattered_lines['hor'].append(blk)
+            blk.lines = lines[assigned & (bbox_idxs == jj)]
 
     # step2: filter textblocks, sort & split textlines
     final_blk_list = []
@@ -466,7 +574,7 @@ def group_output(blks, lines, im_w, im_h, mask=None, sort_blklist=True) -> List[
                 if mask_score < mask_score_thresh:
                     continue
             xywh = np.array([[bx1, by1, bx2-bx1, by2-by1]])
-            blk.lines = xywh2xyxypoly(xywh).reshape(-1, 4, 2).tolist()
+            blk.lines = xywh2xyxypoly(xywh)
         examine_textblk(blk, im_w, im_h, sort=True)
 
         # split manga text if there is a distance gap
@@ -505,12 +613,12 @@ def group_output(blks, lines, im_w, im_h, mask=None, sort_blklist=True) -> List[
             lines = blk.lines_array() + shifted_vec
             lines[..., 0] = np.clip(lines[..., 0], 0, im_w-1)
             lines[..., 1] = np.clip(lines[..., 1], 0, im_h-1)
-            blk.lines = lines.astype(np.int64).tolist()
+            blk.lines = lines.astype(np.int64)
             blk.font_size += expand_size
 
     return final_blk_list
 
-def visualize_textblocks(canvas, blk_list:  List[TextBlock]):
+def visualize_textblocks(canvas, blk_list:  List[TextBlk]):
     lw = max(round(sum(canvas.shape) / 2 * 0.003), 2)  # line width
     for ii, blk in enumerate(blk_list):
         bx1, by1, bx2, by2 = blk.xyxy
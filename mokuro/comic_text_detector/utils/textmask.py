@@ -2,7 +2,7 @@ from os import stat
 from typing import List
 import cv2
 import numpy as np
-from .textblock import TextBlock
+from .textblock import TextBlk
 from .imgproc_utils import draw_connected_labels, expand_textwindow, union_area
 
 WHITE = (255, 255, 255)
@@ -70,7 +70,7 @@ def get_topk_masklist(im_grey, pred_mask):
         mask_list.append([threshed, xor_sum])
     return mask_list
 
-def merge_mask_list(mask_list, pred_mask, blk: TextBlock = None, pred_thresh=30, text_window=None, filter_with_lines=False, refine_mode=REFINEMASK_INPAINT):
+def merge_mask_list(mask_list, pred_mask, blk: TextBlk = None, pred_thresh=30, text_window=None, filter_with_lines=False, refine_mode=REFINEMASK_INPAINT):
     mask_list.sort(key=lambda x: x[1])
     linemask = None
     if blk is not None and filter_with_lines:
@@ -88,24 +88,18 @@ def merge_mask_list(mask_list, pred_mask, blk: TextBlock = None, pred_thresh=30,
         pred_mask = cv2.erode(pred_mask, element, iterations=1)
         _, pred_mask = cv2.threshold(pred_mask, 60, 255, cv2.THRESH_BINARY)
     connectivity = 8
+    # Turning a pixel on changes its xor with pred_mask from p to 255 - p, so adding a component lowers
+    # the total xor iff the sum of (255 - 2p) over its pixels that aren't on yet is negative.
+    # Components of one labels image are disjoint, so each can be decided against the same mask_merged.
+    gain_px = 255 - 2 * pred_mask.astype(np.int64)
     mask_merged = np.zeros_like(pred_mask)
     for ii, (candidate_mask, xor_sum) in enumerate(mask_list):
         num_labels, labels, stats, centroids = cv2.connectedComponentsWithStats(candidate_mask, connectivity, cv2.CV_16U)
-        for label_index, stat, centroid in zip(range(num_labels), stats, centroids):
-            if label_index != 0: # skip background label
-                x, y, w, h, area = stat
-                if w * h < 3:
-                    continue
-                x1, y1, x2, y2 = x, y, x+w, y+h
-                label_local = labels[y1: y2, x1: x2]
-                label_coordinates = np.where(label_local==label_index)
-                tmp_merged = np.zeros_like(label_local, np.uint8)
-                tmp_merged[label_coordinates] = 255
-                tmp_merged = cv2.bitwise_or(mask_merged[y1: y2, x1: x2], tmp_merged)
-                xor_merged = cv2.bitwise_xor(tmp_merged, pred_mask[y1: y2, x1: x2]).sum()
-                xor_origin = cv2.bitwise_xor(mask_merged[y1: y2, x1: x2], pred_mask[y1: y2, x1: x2]).sum()
-                if xor_merged < xor_origin:
-                    mask_merged[y1: y2, x1: x2] = tmp_merged
+        free = mask_merged == 0
+        gain = np.bincount(labels[free], weights=gain_px[free], minlength=num_labels)
+        accept = (gain < 0) & (stats[:, 2] * stats[:, 3] >= 3)
+        accept[0] = False    # skip background label
+        mask_merged[accept[labels]] = 255
 
     if refine_mode == REFINEMASK_INPAINT:
         mask_merged = cv2.dilate(mask_merged, np.ones((3, 3), np.uint8), iterations=1)
@@ -116,23 +110,19 @@ def merge_mask_list(mask_list, pred_mask, blk: TextBlock = None, pred_thresh=30,
         area_thresh = sorted_area[-2]
     else:
         area_thresh = sorted_area[-1]
-    for label_index, stat, centroid in zip(range(num_labels), stats, centroids):
-        x, y, w, h, area = stat
-        if area < area_thresh:
-            x1, y1, x2, y2 = x, y, x+w, y+h
-            label_local = labels[y1: y2, x1: x2]
-            label_coordinates = np.where(label_local==label_index)
-            tmp_merged = np.zeros_like(label_local, np.uint8)
-            tmp_merged[label_coordinates] = 255
-            tmp_merged = cv2.bitwise_or(mask_merged[y1: y2, x1: x2], tmp_merged)
-            xor_merged = cv2.bitwise_xor(tmp_merged, pred_mask[y1: y2, x1: x2]).sum()
-            xor_origin = cv2.bitwise_xor(mask_merged[y1: y2, x1: x2], pred_mask[y1: y2, x1: x2]).sum()
-            if xor_merged < xor_origin:
-                mask_merged[y1: y2, x1: x2] = tmp_merged
+    # Label 0 is mask_merged itself, which filling leaves unchanged.
+    gain = np.bincount(labels.ravel(), weights=gain_px.ravel(), minlength=num_labels)
+    accept = (gain < 0) & (stats[:, -1] < area_thresh)
+    accept[0] = False
+    mask_merged[accept[labels]] = 255
     return mask_merged
 
 
-def refine_undetected_mask(img: np.ndarray, mask_pred: np.ndarray, mask_refined: np.ndarray, blk_list: List[TextBlock], refine_mode=REFINEMASK_INPAINT):
+def undetected_blocks(mask_pred: np.ndarray, mask_refined: np.ndarray, blk_list: List[TextBlk]) -> List[TextBlk]:
+    """
+    Boxes around the parts of mask_pred that mask_refined leaves out and that lie mostly outside every block.
+    Clears the pixels mask_refined covers from mask_pred in place, as the boxes are then refined against it.
+    """
     mask_pred[np.where(mask_refined > 30)] = 0
     _, pred_mask_t = cv2.threshold(mask_pred, 30, 255, cv2.THRESH_BINARY)
     num_labels, labels, stats, centroids = cv2.connectedComponentsWithStats(pred_mask_t, 4, cv2.CV_16U)
@@ -150,24 +140,71 @@ def refine_undetected_mask(img: np.ndarray, mask_pred: np.ndarray, mask_refined:
                 if bbox_s > bbox_score:
                     bbox_score = bbox_s
             if bbox_score / w / h < 0.5:
-                seg_blk_list.append(TextBlock(bbox))
+                seg_blk_list.append(TextBlk(bbox))
+    return seg_blk_list
+
+
+def refine_undetected_mask(img: np.ndarray, mask_pred: np.ndarray, mask_refined: np.ndarray, blk_list: List[TextBlk], refine_mode=REFINEMASK_INPAINT):
+    seg_blk_list = undetected_blocks(mask_pred, mask_refined, blk_list)
     if len(seg_blk_list) > 0:
         mask_refined = cv2.bitwise_or(mask_refined, refine_mask(img, mask_pred, seg_blk_list, refine_mode=refine_mode))
     return mask_refined
 
 
-def refine_mask(img: np.ndarray, pred_mask: np.ndarray, blk_list: List[TextBlock], refine_mode: int = REFINEMASK_INPAINT) -> np.ndarray:
+def refine_mask(img: np.ndarray, pred_mask: np.ndarray, blk_list: List[TextBlk], refine_mode: int = REFINEMASK_INPAINT) -> np.ndarray:
     mask_refined = np.zeros_like(pred_mask)
     for blk in blk_list:
-        bx1, by1, bx2, by2 = expand_textwindow(img.shape, blk.xyxy, expand_r=16)
-        im = np.ascontiguousarray(img[by1: by2, bx1: bx2])
-        msk = np.ascontiguousarray(pred_mask[by1: by2, bx1: bx2])
-        mask_list = get_topk_masklist(im, msk)
-        mask_list += get_otsuthresh_masklist(im, msk, per_channel=False)
-        mask_merged = merge_mask_list(mask_list, msk, blk=blk, text_window=[bx1, by1, bx2, by2], refine_mode=refine_mode)
-        mask_refined[by1: by2, bx1: bx2] = cv2.bitwise_or(mask_refined[by1: by2, bx1: bx2], mask_merged)
+        refine_window(img, pred_mask, mask_refined, blk.xyxy, blk=blk, refine_mode=refine_mode)
     return mask_refined
 
+def refine_window(img: np.ndarray, pred_mask: np.ndarray, mask_refined: np.ndarray, xyxy, blk: TextBlk = None, refine_mode: int = REFINEMASK_INPAINT) -> None:
+    """Refine pred_mask over xyxy (plus a margin) and OR the result into mask_refined in place."""
+    bx1, by1, bx2, by2 = expand_textwindow(img.shape, xyxy, expand_r=16)
+    im = np.ascontiguousarray(img[by1: by2, bx1: bx2])
+    msk = np.ascontiguousarray(pred_mask[by1: by2, bx1: bx2])
+    mask_list = get_topk_masklist(im, msk)
+    mask_list += get_otsuthresh_masklist(im, msk, per_channel=False)
+    mask_merged = merge_mask_list(mask_list, msk, blk=blk, text_window=[bx1, by1, bx2, by2], refine_mode=refine_mode)
+    mask_refined[by1: by2, bx1: bx2] = cv2.bitwise_or(mask_refined[by1: by2, bx1: bx2], mask_merged)
+
+class LazyRefinedMask:
+    """
+    `refine_mask`, followed by `refine_undetected_mask` with keep_undetected_mask, but only
+    computed where it is asked for. `refine_region` refines every window overlapping xyxy,
+    once, and returns the page-sized mask, which equals the eagerly refined one inside every
+    region asked for so far. Finding the undetected regions takes every block refined, so
+    with keep_undetected_mask the first call refines all the blocks.
+    """
+    def __init__(self, img: np.ndarray, pred_mask: np.ndarray, blk_list: List[TextBlk], keep_undetected_mask: bool = False, refine_mode: int = REFINEMASK_INPAINT):
+        self.img = img
+        self.pred_mask = pred_mask
+        self.blk_list = blk_list
+        self.keep_undetected_mask = keep_undetected_mask
+        self.refine_mode = refine_mode
+        self.mask_refined = np.zeros_like(pred_mask)
+        self.refined = set()  # ids of the blocks refined so far
+        self.undetected = None  # (pred_mask with the blocks cleared, undetected blocks), once found
+
+    def refine_region(self, xyxy) -> np.ndarray:
+        if self.keep_undetected_mask and self.undetected is None:
+            self._refine(self.blk_list, self.pred_mask, None)
+            pred_mask = self.pred_mask.copy()
+            self.undetected = pred_mask, undetected_blocks(pred_mask, self.mask_refined, self.blk_list)
+        self._refine(self.blk_list, self.pred_mask, xyxy)
+        if self.undetected is not None:
+            self._refine(self.undetected[1], self.undetected[0], xyxy)
+        return self.mask_refined
+
+    def _refine(self, blk_list, pred_mask, xyxy):
+        """Refine the blocks whose windows overlap xyxy (all of them if None) and haven't been yet."""
+        for blk in blk_list:
+            if id(blk) in self.refined:
+                continue
+            if xyxy is not None and union_area(expand_textwindow(self.img.shape, blk.xyxy, expand_r=16), xyxy) < 0:
+                continue
+            refine_window(self.img, pred_mask, self.mask_refined, blk.xyxy, blk=blk, refine_mode=self.refine_mode)
+            self.refined.add(id(blk))
+
 # def extract_textballoon(img, pred_textmsk=None, global_mask=None):
 #     if len(img.shape) > 2 and img.shape[2] == 3:
 #         img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
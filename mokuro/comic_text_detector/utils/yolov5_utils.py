@@ -6,7 +6,6 @@ import torch.nn.functional as F
 import cv2
 import numpy as np
 import time
-import torchvision
 
 def scale_img(img, ratio=1.0, same_shape=False, gs=32):  # img(16,3,256,416)
     # scales img(bs,3,y,x) by ratio constrained to gs-multiple
@@ -129,6 +128,8 @@ def non_max_suppression(prediction, conf_thres=0.25, iou_thres=0.45, classes=Non
          list of detections, on (n,6) tensor per image [xyxy, conf, cls]
     """
 
+    import torchvision
+
     if isinstance(prediction, np.ndarray):
         prediction = torch.from_numpy(prediction)
 
@@ -217,6 +218,34 @@ def non_max_suppression(prediction, conf_thres=0.25, iou_thres=0.45, classes=Non
 
     return output
 
+def non_max_suppression_numpy(x, conf_thres=0.25, iou_thres=0.45, max_det=300, max_wh=4096):
+    """non_max_suppression for a single image's (n, 5 + nc) NumPy predictions, without torch or torchvision.
+    Greedy NMS, one vectorized IoU row per kept box, so it suits the tens of candidates a page has left
+    after the confidence filter.
+
+    Returns:
+         (n, 6) float32 array of detections [xyxy, conf, cls], by descending conf
+    """
+    x = x[x[:, 4] > conf_thres].astype(np.float32)
+    if not len(x):
+        return np.zeros((0, 6), dtype=np.float32)
+    scores = x[:, 5:] * x[:, 4:5]  # conf = obj_conf * cls_conf
+    cls = scores.argmax(1)
+    conf = scores[np.arange(len(x)), cls]
+    x = np.concatenate((xywh2xyxy(x[:, :4]), conf[:, None], cls[:, None].astype(np.float32)), 1)[conf > conf_thres]
+
+    boxes = x[:, :4] + x[:, 5:6] * max_wh  # offset by class, so only boxes of the same class overlap
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    order = np.argsort(-x[:, 4], kind='stable')
+    keep = []
+    while len(order) and len(keep) < max_det:
+        i, order = order[0], order[1:]
+        keep.append(i)
+        wh = np.minimum(boxes[i, 2:], boxes[order, 2:]) - np.maximum(boxes[i, :2], boxes[order, :2])
+        inter = np.clip(wh, 0, None).prod(1)
+        order = order[inter / (areas[i] + areas[order] - inter) <= iou_thres]
+    return x[keep]
+
 def xywh2xyxy(x):
     # Convert nx4 boxes from [x, y, w, h] to [x1, y1, x2, y2] where xy1=top-left, xy2=bottom-right
     y = x.clone() if isinstance(x, torch.Tensor) else np.copy(x)
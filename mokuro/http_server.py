@@ -0,0 +1,130 @@
+"""
+A local HTTP endpoint that OCRs single pages with a warm MokuroGenerator.
+
+    POST /ocr       body: the image bytes   ->  the page JSON process_volume writes to _ocr/
+    GET  /metrics                           ->  queue depth and batch size counts
+
+Pages from concurrent requests go through one shared pipeline, whose detection and
+OCR stages wait up to `max_wait` seconds to fill a batch before running it. The OCR
+memo only spans a batch, as requests needn't come from the same volume.
+"""
+import json
+import queue
+import threading
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from loguru import logger
+
+from mokuro.manga_page_ocr import InvalidImage
+from mokuro.mokuro_generator import safe_json_dumps
+
+
+class _PageRequest:
+    """A page as the generator's pipeline expects it (see MokuroGenerator.build_pipeline), plus its response."""
+
+    def __init__(self, img_bytes: bytes):
+        self.img_bytes = img_bytes
+        self.cached = None
+        self.output = None
+        self.done = threading.Event()
+
+
+class PageOcrServer(ThreadingHTTPServer):
+    """Serves page OCR for `generator` at address, batching concurrent requests within max_wait seconds."""
+    daemon_threads = True
+
+    def __init__(self, address, generator, max_wait=0.05):
+        self.pending = queue.Queue()
+        self.num_requests = 0
+        self.num_errors = 0
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        self.mpocr_model = generator.init_models()
+        self.pipeline = generator.build_pipeline(self.mpocr_model, max_wait=max_wait, ocr_memo_per_batch=True)
+        super().__init__(address, _RequestHandler)
+        self._consumer = threading.Thread(target=self._respond, name='mokuro-http', daemon=True)
+        self._consumer.start()
+
+    def ocr(self, img_bytes: bytes):
+        """The page result for img_bytes, or the exception processing it raised."""
+        request = _PageRequest(img_bytes)
+        with self._lock:
+            self.num_requests += 1
+            self.in_flight += 1
+        self.pending.put(request)
+        request.done.wait()
+        with self._lock:
+            self.in_flight -= 1
+            self.num_errors += isinstance(request.output, Exception)
+        return request.output
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                'requests': self.num_requests,
+                'errors': self.num_errors,
+                # pages received but not yet answered, and those of them not yet taken up by the pipeline
+                'queue_depth': self.in_flight,
+                'waiting': self.pending.qsize(),
+                'batch_sizes': {
+                    stage: dict(sorted(counts.items()))
+                    for stage, counts in self.pipeline.batch_size_snapshot().items()
+                },
+            }
+
+    def server_close(self):
+        super().server_close()
+        self.pending.put(None)
+
+    def _pages(self):
+        while (request := self.pending.get()) is not None:
+            yield request
+
+    def _respond(self):
+        for request, output in self.pipeline(self._pages()):
+            request.output = output
+            request.done.set()
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        if self.path != '/ocr':
+            self.send_json(HTTPStatus.NOT_FOUND, json.dumps({'error': f'No such endpoint: {self.path}'}))
+            return
+        img_bytes = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        output = self.server.ocr(img_bytes)
+        if isinstance(output, InvalidImage):
+            self.send_json(HTTPStatus.BAD_REQUEST, json.dumps({'error': str(output)}))
+        elif isinstance(output, Exception):
+            logger.opt(exception=output).error('Failed to process a page')
+            self.send_json(HTTPStatus.INTERNAL_SERVER_ERROR, json.dumps({'error': str(output)}))
+        else:
+            self.send_json(HTTPStatus.OK, safe_json_dumps(output))
+
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_json(HTTPStatus.NOT_FOUND, json.dumps({'error': f'No such endpoint: {self.path}'}))
+            return
+        self.send_json(HTTPStatus.OK, json.dumps(self.server.metrics()))
+
+    def send_json(self, status, body: str):
+        body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(f'{self.address_string()} - {format % args}')
+
+
+def serve_http(generator, host='127.0.0.1', port=8000, max_wait=0.05):
+    """Serve page OCR on host:port until interrupted."""
+    with PageOcrServer((host, port), generator, max_wait=max_wait) as server:
+        logger.info(f'Serving page OCR on http://{host}:{server.server_port}/ocr')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            logger.info('Shutting down')
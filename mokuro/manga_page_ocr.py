@@ -1,10 +1,14 @@
+import hashlib
+from collections import OrderedDict
+
 import cv2
 import numpy as np
-from PIL import Image
+from PIL import Image, UnidentifiedImageError
 from loguru import logger
 from uuid_utils import uuid7
 
 from mokuro.cache import cache
+from mokuro.comic_text_detector.utils.linecrop import LineCropper
 from mokuro.utils import imread
 
 
@@ -19,17 +23,31 @@ class MangaPageOcr:
         pretrained_model_name_or_path='kha-white/manga-ocr-base',
         force_cpu=False,
         detector_input_size=1024,
+        detector_backend='torch',
+        detector_precision='fp32',
+        detector_dynamic_shape=False,
+        detector_coarse_input_size=None,
         text_height=64,
         max_ratio_vert=16,
         max_ratio_hor=8,
         anchor_window=2,
         disable_ocr=False,
+        ocr_batch_size=16,
+        refine_mask=True,
+        ocr_memo_size=4096,
+        ocr_memo_fuzzy=False,
     ):
         self.text_height = text_height
         self.max_ratio_vert = max_ratio_vert
         self.max_ratio_hor = max_ratio_hor
         self.anchor_window = anchor_window
         self.disable_ocr = disable_ocr
+        self.ocr_batch_size = ocr_batch_size
+        self.refine_mask = refine_mask
+        self.ocr_memo = OcrMemo(ocr_memo_size, fuzzy=ocr_memo_fuzzy) if ocr_memo_size > 0 and not disable_ocr else None
+        self.detector_weights = []
+        self.text_detector = None
+        self.mocr_version = None
 
         if not self.disable_ocr:
             from .comic_text_detector.inference import TextDetector
@@ -41,81 +59,198 @@ class MangaPageOcr:
 
             import torch
             device = 'cuda' if torch.cuda.is_available() and not force_cpu else 'cpu'
-            logger.info(f'Initializing text detector, using device {device}')
+            if detector_precision == 'int8':
+                if detector_backend != 'torch':
+                    raise ValueError('detector_precision="int8" is only supported with detector_backend="torch"')
+                device = 'cpu'  # quantized kernels are CPU only
+            logger.info(f'Initializing text detector, using {detector_backend} ({detector_precision}) on device {device}')
 
+            if detector_backend == 'onnxruntime':
+                model_path = cache.comic_text_detector_onnx(detector_input_size)
+            else:
+                model_path = cache.comic_text_detector
+            quantized_model_path = cache.comic_text_detector_int8 if detector_precision == 'int8' else None
+            # the weight files the detector was built from, which cached page results depend on
+            self.detector_weights = [model_path] + ([quantized_model_path] if quantized_model_path is not None else [])
             self.text_detector = TextDetector(
-                model_path=cache.comic_text_detector,
+                model_path=model_path,
                 input_size=detector_input_size,
                 device=device,
                 act='leaky',
+                backend=detector_backend,
+                quantized_model_path=quantized_model_path,
+                dynamic_shape=detector_dynamic_shape,
+                coarse_input_size=detector_coarse_input_size,
             )
             self.mocr = MangaOcr(pretrained_model_name_or_path, force_cpu)
             self.mocr_version = __manga_ocr_version__
 
     def __call__(self, img_path):
-        img = imread(img_path)
+        """Process one page, given either its path or its bytes."""
+        img = self.read(img_path)
+        result, mask_refined, blk_list = self.detect(img)
+        crops = self.extract_crops(img, mask_refined, blk_list)
+        return self.recognize(result, crops)
+
+    @staticmethod
+    def read(img_path):
+        try:
+            img = imread(img_path)
+        except UnidentifiedImageError as e:
+            raise InvalidImage() from e
         if img is None:
             raise InvalidImage()
-        height, width, *_ = img.shape
-        result = {'img_width': width, 'img_height': height, 'blocks': []}
+        return img
+
+    def detect(self, img):
+        """Run the text detector, returning the page result (without any text yet), the refined mask and blocks."""
+        return self.detect_batch([img])[0]
+
+    def detect_batch(self, imgs):
+        """`detect` for several pages, with a single forward pass through the detector."""
+        results = []
+        for img in imgs:
+            height, width, *_ = img.shape
+            results.append({'img_width': width, 'img_height': height, 'blocks': []})
 
         if self.disable_ocr:
-            return result
+            return [(result, None, []) for result in results]
+
+        # The refined mask is only read for over-long lines in split_into_chunks, so it is refined lazily there.
+        detections = self.text_detector.detect_batch(
+            imgs, refine_mode=1, keep_undetected_mask=True, refine=self.refine_mask, lazy_refine=True
+        )
+        outputs = []
+        for result, (mask, mask_refined, blk_list) in zip(results, detections):
+            for blk in blk_list:
+                result['blocks'].append({
+                    "uuid": uuid7().hex,
+                    'box': list(blk.xyxy),
+                    'vertical': blk.vertical,
+                    'font_size': int(blk.font_size),  # Font size in pixels should be integer.
+                    'lines_coords': [line.tolist() for line in blk.lines_array()],
+                    'lines': [],
+                })
+            outputs.append((result, mask_refined, blk_list))
+        return outputs
 
-        mask, mask_refined, blk_list = self.text_detector(img, refine_mode=1, keep_undetected_mask=True)
+    def extract_crops(self, img, mask_refined, blk_list):
+        """Cut every detected line into crops oriented for the OCR model: one list of chunks per line, per block."""
+        cropper = LineCropper(blk_list, img.shape, textheight=self.text_height)
+        crops = []
         for blk_idx, blk in enumerate(blk_list):
-            result_blk = {
-                "uuid": uuid7().hex,
-                'box': list(blk.xyxy),
-                'vertical': blk.vertical,
-                'font_size': int(blk.font_size),  # Font size in pixels should be integer.
-                'lines_coords': [],
-                'lines': [],
-            }
-
-            for line_idx, line in enumerate(blk.lines_array()):
-                if blk.vertical:
-                    max_ratio = self.max_ratio_vert
-                else:
-                    max_ratio = self.max_ratio_hor
+            if blk.vertical:
+                max_ratio = self.max_ratio_vert
+            else:
+                max_ratio = self.max_ratio_hor
 
+            blk_crops = []
+            for line_idx in range(len(blk.lines)):
                 line_crops, cut_points = self.split_into_chunks(
                     img,
                     mask_refined,
+                    cropper,
                     blk,
+                    blk_idx,
                     line_idx,
                     textheight=self.text_height,
                     max_ratio=max_ratio,
                     anchor_window=self.anchor_window
                 )
+                blk_crops.append(line_crops)
+            crops.append(blk_crops)
+        return crops
 
-                line_text = ''
-                for line_crop in line_crops:
-                    if blk.vertical:
-                        line_crop = cv2.rotate(line_crop, cv2.ROTATE_90_CLOCKWISE)
-                    line_text += self.mocr(Image.fromarray(line_crop))
-                line_text = (line_text
-                    .replace("．．．", "⋯")  # replace triple full stop with proper ellipse
-                    .replace("。。。", "⋯")  # replace triple full stop with proper ellipse
-                    .replace("！！", "‼︎")  # replace double ! with single character.
-                    .replace("？！", "⁈")  # replace ? ! with single character.
-                    .replace("！？", "⁉︎")  # replace ! ? with single character.
-                    .replace("「", "｢")  # replace open quote with slimmer character.
-                    .replace("」", "｣")  # replace close quote with slimmer character.
-                )
-                result_blk['lines_coords'].append(line.tolist())
-                result_blk['lines'].append(line_text)
+    def recognize(self, result, crops):
+        """OCR the crops produced by `extract_crops` and fill in the text of each block in `result`."""
+        return self.recognize_batch([(result, crops)])[0]
+
+    def recognize_batch(self, pages):
+        """
+        `recognize` for several pages: every line crop of every page is gathered,
+        sent through the OCR model `ocr_batch_size` crops at a time, and the text
+        is scattered back into the blocks it came from.
+        """
+        flat_crops = []
+        for result, crops in pages:
+            for blk_crops in crops:
+                for line_crops in blk_crops:
+                    flat_crops += line_crops
 
-            result['blocks'].append(result_blk)
+        texts = iter(self.ocr_crops(flat_crops))
+        for result, crops in pages:
+            for result_blk, blk_crops in zip(result['blocks'], crops):
+                for line_crops in blk_crops:
+                    line_text = ''.join(next(texts) for _ in line_crops)
+                    result_blk['lines'].append(self.postprocess_text(line_text))
+        return [result for result, crops in pages]
 
-        return result
+    def ocr_crops(self, crops):
+        """
+        `run_ocr` through the OCR memo: crops seen before (recurring names, SFX, headers),
+        including repeats within `crops`, reuse their text instead of going through the model.
+        """
+        if self.ocr_memo is None:
+            return self.run_ocr(crops)
+
+        texts = [None] * len(crops)
+        pending = {}  # key -> indices of the crops sharing it that still need OCR
+        for i, crop in enumerate(crops):
+            key = self.ocr_memo.key(crop)
+            if key in pending:
+                pending[key].append(i)
+                self.ocr_memo.hits += 1
+            elif (text := self.ocr_memo.get(key)) is not None:
+                texts[i] = text
+            else:
+                pending[key] = [i]
+
+        try:
+            for (key, indices), text in zip(pending.items(), self.run_ocr([crops[ii[0]] for ii in pending.values()])):
+                self.ocr_memo.put(key, text)
+                for i in indices:
+                    texts[i] = text
+        finally:
+            self.ocr_memo.discard_pending()
+        return texts
+
+    def run_ocr(self, crops):
+        """Equivalent to calling `self.mocr` on each crop, but batched through the encoder-decoder."""
+        if not crops:
+            return []
+        from manga_ocr.ocr import post_process
+
+        texts = []
+        for i in range(0, len(crops), self.ocr_batch_size):
+            # MangaOcr works on greyscale, and the processor resizes every crop to the
+            # same input size, so batches need no padding. Finished sequences are padded
+            # by `generate` and the padding is dropped again by `skip_special_tokens`.
+            images = [Image.fromarray(crop).convert('L').convert('RGB') for crop in crops[i: i + self.ocr_batch_size]]
+            pixel_values = self.mocr.processor(images, return_tensors='pt').pixel_values
+            token_ids = self.mocr.model.generate(pixel_values.to(self.mocr.model.device), max_length=300).cpu()
+            texts += [post_process(self.mocr.tokenizer.decode(ids, skip_special_tokens=True)) for ids in token_ids]
+        return texts
 
     @staticmethod
-    def split_into_chunks(img, mask_refined, blk, line_idx, textheight, max_ratio=16, anchor_window=2):
-        line_crop = blk.get_transformed_region(img, line_idx, textheight)
+    def postprocess_text(line_text):
+        return (line_text
+            .replace("．．．", "⋯")  # replace triple full stop with proper ellipse
+            .replace("。。。", "⋯")  # replace triple full stop with proper ellipse
+            .replace("！！", "‼︎")  # replace double ! with single character.
+            .replace("？！", "⁈")  # replace ? ! with single character.
+            .replace("！？", "⁉︎")  # replace ! ? with single character.
+            .replace("「", "｢")  # replace open quote with slimmer character.
+            .replace("」", "｣")  # replace close quote with slimmer character.
+        )
 
-        h, w, *_ = line_crop.shape
-        ratio = w / h
+    @staticmethod
+    def split_into_chunks(img, mask_refined, cropper, blk, blk_idx, line_idx, textheight, max_ratio=16, anchor_window=2):
+        # Vertical lines come out of the cropper upright, so they are measured and cut along axis 0.
+        axis = 0 if blk.vertical else 1
+        line_crop = cropper.crop(img, blk_idx, line_idx)
+
+        w = line_crop.shape[axis]
+        ratio = w / line_crop.shape[1 - axis]
 
         if ratio <= max_ratio:
             return [line_crop], []
@@ -131,12 +266,24 @@ class MangaPageOcr:
             from scipy.signal.windows import gaussian
             k = gaussian(textheight * 2, textheight / 8)
 
-            line_mask = blk.get_transformed_region(mask_refined, line_idx, textheight)
+            if mask_refined is not None:
+                if not isinstance(mask_refined, np.ndarray):
+                    # A LazyRefinedMask: refine just around this line, with room for the cropper's padding.
+                    pts = np.asarray(blk.lines[line_idx])
+                    pad = int(np.ceil(blk.font_size / 3))
+                    x1, y1 = pts.min(axis=0) - pad
+                    x2, y2 = pts.max(axis=0) + pad
+                    mask_refined = mask_refined.refine_region((max(x1, 0), max(y1, 0), x2, y2))
+                line_mask = cropper.crop(mask_refined, blk_idx, line_idx)
+            else:
+                # Without a refined mask, take the dark (text) pixels of the crop itself.
+                gray = cv2.cvtColor(line_crop, cv2.COLOR_BGR2GRAY)
+                _, line_mask = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
             num_chunks = int(np.ceil(ratio / max_ratio))
 
             anchors = np.linspace(0, w, num_chunks + 1)[1:-1]
 
-            line_density = line_mask.sum(axis=0)
+            line_density = line_mask.sum(axis=1 - axis)
             line_density = np.convolve(line_density, k, 'same')
             line_density /= line_density.max()
 
@@ -154,4 +301,143 @@ class MangaPageOcr:
 
                 cut_points.append(p)
 
-            return np.split(line_crop, cut_points, axis=1), cut_points
+            return np.split(line_crop, cut_points, axis=axis), cut_points
+
+
+class OcrMemo:
+    """
+    Text of recently OCR'd line crops, so that text recurring within a volume (speaker
+    names, sound effects, chapter headers, page furniture) is only OCR'd once.
+
+    By default only crops with identical pixels match. With `fuzzy`, a crop's fingerprint
+    is its shape bucket (orientation and rounded aspect ratio) and a thumbnail: the crop in
+    grayscale, downscaled to 16 pixels across its short side and 16 times the aspect ratio
+    along its long side, then contrast stretched. A crop then matches a remembered one of
+    the same bucket whose thumbnail is within `tolerance` grey levels (root mean square) of
+    its own, so re-scans and re-crops of the same text still match, at the risk of
+    lookalike lines sharing text. At most `max_size` crops are remembered, least recently
+    used first out.
+    """
+
+    def __init__(self, max_size=4096, fuzzy=False, tolerance=8):
+        self.max_size = max_size
+        self.fuzzy = fuzzy
+        self.tolerance = tolerance
+        self.hits = 0
+        self.misses = 0
+        self._texts = OrderedDict()  # key -> text
+        self._thumbs = {}  # bucket -> _ThumbnailIndex of the remembered crops
+        # Crops keyed but not put yet, kept out of the LRU so they can't push out remembered text.
+        self._pending = {}  # key -> thumbnail
+        self._pending_thumbs = {}  # bucket -> _ThumbnailIndex of the pending crops
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def key(self, crop: np.ndarray) -> tuple:
+        """The key of a remembered or pending crop that crop matches, or else a new key for it."""
+        if not self.fuzzy:
+            return crop.shape, hashlib.blake2b(np.ascontiguousarray(crop).tobytes(), digest_size=16).digest()
+
+        gray = crop if crop.ndim == 2 else cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)
+        h, w = gray.shape
+        vertical = h > w
+        aspect = max(1, round(max(h, w) / max(min(h, w), 1)))
+        dsize = (16, 16 * aspect) if vertical else (16 * aspect, 16)
+        thumb = cv2.resize(gray, dsize, interpolation=cv2.INTER_AREA)
+        thumb = cv2.normalize(thumb, None, 0, 255, cv2.NORM_MINMAX)
+        bucket = (vertical, aspect)
+
+        key = bucket, hashlib.blake2b(thumb.tobytes(), digest_size=16).digest()
+        if key in self._texts or key in self._pending:
+            return key
+        for indices in (self._thumbs, self._pending_thumbs):
+            index = indices.get(bucket)
+            if index is not None and (match := index.nearest(thumb, self.tolerance)) is not None:
+                return match
+        self._pending[key] = thumb
+        self._pending_thumbs.setdefault(bucket, _ThumbnailIndex()).add(key, thumb)
+        return key
+
+    def get(self, key: tuple) -> str | None:
+        text = self._texts.get(key)
+        if text is None:
+            self.misses += 1
+            return None
+        self._texts.move_to_end(key)
+        self.hits += 1
+        return text
+
+    def put(self, key: tuple, text: str):
+        thumb = self._pending.pop(key, None)
+        if thumb is not None:
+            self._pending_thumbs[key[0]].remove(key)
+            if key not in self._texts:
+                self._thumbs.setdefault(key[0], _ThumbnailIndex()).add(key, thumb)
+        self._texts[key] = text
+        self._texts.move_to_end(key)
+        while len(self._texts) > self.max_size:
+            evicted, _ = self._texts.popitem(last=False)
+            if evicted[0] in self._thumbs:
+                self._thumbs[evicted[0]].remove(evicted)
+
+    def discard_pending(self):
+        """Forget the crops that were keyed but never put, such as those of a batch whose OCR failed."""
+        self._pending.clear()
+        self._pending_thumbs.clear()
+
+    def clear(self):
+        self._texts.clear()
+        self._thumbs.clear()
+        self.discard_pending()
+        self.hits = 0
+        self.misses = 0
+
+
+class _ThumbnailIndex:
+    """Same-sized thumbnails as the rows of a growable matrix, for nearest-neighbour lookups by RMS distance."""
+
+    def __init__(self):
+        self.keys = []
+        self.slots = {}
+        self.rows = None
+        self.norms = None
+
+    def add(self, key, thumb):
+        row = thumb.astype(np.float32).ravel()
+        n = len(self.keys)
+        if self.rows is None or n == len(self.rows):
+            rows = np.empty((max(16, 2 * n), len(row)), np.float32)
+            norms = np.empty(len(rows), np.float32)
+            if n:
+                rows[:n], norms[:n] = self.rows, self.norms
+            self.rows, self.norms = rows, norms
+        self.rows[n] = row
+        self.norms[n] = row @ row
+        self.slots[key] = n
+        self.keys.append(key)
+
+    def remove(self, key):
+        slot = self.slots.pop(key, None)
+        if slot is None:
+            return
+        last = len(self.keys) - 1
+        if slot != last:  # move the last row into the hole
+            self.rows[slot], self.norms[slot] = self.rows[last], self.norms[last]
+            self.keys[slot] = self.keys[last]
+            self.slots[self.keys[slot]] = slot
+        self.keys.pop()
+
+    def nearest(self, thumb, tolerance):
+        """The key of the closest thumbnail, if it is within tolerance, else None."""
+        n = len(self.keys)
+        if n == 0:
+            return None
+        row = thumb.astype(np.float32).ravel()
+        dist2 = self.norms[:n] + row @ row - 2 * (self.rows[:n] @ row)
+        best = dist2.argmin()
+        if dist2[best] <= tolerance ** 2 * len(row):
+            return self.keys[best]
+        return None
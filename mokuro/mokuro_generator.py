@@ -1,17 +1,22 @@
+from contextlib import closing
 from datetime import datetime
 import json
 import warnings
-from zipfile import ZipFile, ZIP_DEFLATED
+from typing import Iterator
+from zipfile import ZipFile, ZIP_DEFLATED, ZIP_STORED
 
 from loguru import logger
 from tqdm import TqdmExperimentalWarning
 warnings.filterwarnings("ignore", category=TqdmExperimentalWarning)
 from tqdm.autonotebook import tqdm
+from uuid_utils import uuid7
 
 from mokuro import __version__, __comic_text_detector_version__
+from mokuro.cache import cache, file_version, PageResultCache
 from mokuro.manga_page_ocr import MangaPageOcr
-from mokuro.utils import NumpyEncoder
-from mokuro.volume import Volume
+from mokuro.pipeline import Finished, Pipeline
+from mokuro.utils import NumpyEncoder, write_raw_zip_member
+from mokuro.volume import Page, Volume
 
 
 class MokuroGenerator:
@@ -20,11 +25,20 @@ class MokuroGenerator:
         pretrained_model_name_or_path='kha-white/manga-ocr-base',
         force_cpu=False,
         disable_ocr=False,
+        queue_size=4,
+        detector_batch_size=1,
+        disable_cache=False,
+        cache_max_size=1 << 30,
         **kwargs
     ):
         self.pretrained_model_name_or_path = pretrained_model_name_or_path
         self.force_cpu = force_cpu
         self.disable_ocr = disable_ocr
+        self.queue_size = queue_size
+        self.detector_batch_size = detector_batch_size
+        self.result_cache: PageResultCache | None = None
+        if not disable_ocr and not disable_cache:
+            self.result_cache = cache.page_results(max_size=cache_max_size)
         self.kwargs = kwargs
         self._mpocr: MangaPageOcr | None = None
 
@@ -38,7 +52,8 @@ class MokuroGenerator:
             )
         return self._mpocr
 
-    def process_volume(self, volume: Volume, ignore_errors=False):
+    def process_volume(self, volume: Volume, ignore_errors=False, progress=None):
+        """Process a volume into its .mbz.zip. `progress(done, total)` is called after each page, if given."""
         mpocr_model = self.init_models()
         timestamp = datetime.now().isoformat()
         metadata = {
@@ -56,20 +71,116 @@ class MokuroGenerator:
             'pages': [],
         }
         progressbar = lambda i: tqdm(i, desc="Processing pages...", total=len(volume.namelist), unit="pages")
-        with ZipFile(volume.output_path, "w", ZIP_DEFLATED, compresslevel=9) as output:
-            for stem, img_path in progressbar(volume.get_img_paths()):
-                try:
-                    result = mpocr_model(img_path)
-                except Exception as e:
+        pipeline = self.build_pipeline(mpocr_model)
+        pages = self.read_pages(volume, mpocr_model)
+        if mpocr_model.ocr_memo is not None:
+            mpocr_model.ocr_memo.clear()  # memoize within the volume
+        cache_counts = self.cache_counts()
+        escalation_counts = self.escalation_counts(mpocr_model)
+        results = pipeline(pages)
+        with ZipFile(volume.output_path, "w", ZIP_DEFLATED, compresslevel=9) as output, closing(results):
+            for done, (page, result) in enumerate(progressbar(results), 1):
+                if isinstance(result, Exception):
                     if not ignore_errors:
-                        raise e
-                    logger.error(f'failed to parse {str(img_path)} - {e}')
+                        raise result
+                    logger.error(f'failed to parse {volume.path / page.name} - {result}')
                 else:
-                    ocr_path = f"_ocr/{stem}.json"
-                    output.writestr(ocr_path, safe_json_dumps(result))
-                    output.writestr(img_path.name, img_path.read_bytes())
-                    metadata['pages'].append((img_path.name, ocr_path))
+                    result_json = safe_json_dumps(result)
+                    if page.cache_key is not None and page.cached is None:
+                        self.result_cache.put(page.cache_key, result_json)
+                    ocr_path = f"_ocr/{page.stem}.json"
+                    output.writestr(ocr_path, result_json)
+                    if page.raw_member is not None:
+                        write_raw_zip_member(output, *page.raw_member, page.name)
+                    else:
+                        # Supported image formats are already compressed, deflating them again gains nothing.
+                        output.writestr(page.name, page.img_bytes, compress_type=ZIP_STORED)
+                    metadata['pages'].append((page.name, ocr_path))
+                if progress is not None:
+                    progress(done, len(volume.namelist))
             output.writestr("mokuro-metadata.json", json.dumps(metadata))
+        if self.result_cache is not None:
+            hits, misses = (now - before for now, before in zip(self.cache_counts(), cache_counts))
+            logger.info(f'Page cache hits: {hits}, misses: {misses}')
+        if escalation_counts is not None:
+            coarse, escalated = (now - before for now, before in zip(self.escalation_counts(mpocr_model), escalation_counts))
+            logger.info(f'Detector escalations: {escalated} of {coarse} pages redone at full input size')
+        if mpocr_model.ocr_memo is not None:
+            memo = mpocr_model.ocr_memo
+            logger.info(f'OCR memo hits: {memo.hits}, misses: {memo.misses} ({memo.hit_rate:.1%} of line crops reused)')
+            memo.clear()  # don't hold on to it between volumes, e.g. while `mokuro serve` idles
+
+    def cache_counts(self) -> tuple[int, int]:
+        if self.result_cache is None:
+            return 0, 0
+        return self.result_cache.hits, self.result_cache.misses
+
+    @staticmethod
+    def escalation_counts(mpocr_model: MangaPageOcr) -> tuple[int, int] | None:
+        """Pages the detector ran at its coarse input size, and how many of those it redid at full size, if coarse-to-fine."""
+        detector = mpocr_model.text_detector
+        if detector is None or detector.coarse_input_size is None:
+            return None
+        return detector.num_coarse, detector.num_escalated
+
+    def read_pages(self, volume: Volume, mpocr_model: MangaPageOcr) -> Iterator[Page]:
+        """
+        Read each page and look it up in the result cache.
+        Run on the pipeline's feeder thread, while a zip volume's archive is still open.
+        """
+        versions = None
+        if self.result_cache is not None:
+            versions = (
+                __version__,
+                __comic_text_detector_version__,
+                mpocr_model.mocr_version,
+                str(self.pretrained_model_name_or_path),
+                repr(sorted(self.kwargs.items())),
+                # the detector's weights aren't versioned with it: a re-download, a re-export or
+                # a re-calibration must not be served results from the old ones
+                *(file_version(path) for path in mpocr_model.detector_weights),
+            )
+        for page in volume.get_pages():
+            if versions is not None:
+                page.cache_key = self.result_cache.key(page.img_bytes, *versions)
+                page.cached = self.result_cache.get(page.cache_key)
+            yield page
+
+    def build_pipeline(self, mpocr_model: MangaPageOcr, max_wait: float = 0.0, ocr_memo_per_batch: bool = False) -> Pipeline:
+        """
+        Split page processing into read/decode, detection, line-crop extraction
+        and OCR stages. Archive writing happens on the consuming thread.
+        Pages need only `img_bytes` and `cached` (None, or a cached result).
+        Detection and OCR batches wait up to max_wait seconds for more pages.
+        With ocr_memo_per_batch, the OCR memo is cleared before each OCR batch,
+        for pages that don't come from the same volume.
+        """
+        def read(page):
+            if page.cached is not None:
+                for blk in page.cached['blocks']:
+                    blk['uuid'] = uuid7().hex  # block uuids are fresh on every run, cached or not
+                return Finished(page.cached)
+            return mpocr_model.read(page.img_bytes)
+
+        def detect(imgs):
+            return [(img, *detected) for img, detected in zip(imgs, mpocr_model.detect_batch(imgs))]
+
+        def extract_crops(detected):
+            img, result, mask_refined, blk_list = detected
+            return result, mpocr_model.extract_crops(img, mask_refined, blk_list)
+
+        def recognize(pages):
+            if ocr_memo_per_batch and mpocr_model.ocr_memo is not None:
+                mpocr_model.ocr_memo.clear()
+            return mpocr_model.recognize_batch(pages)
+
+        return Pipeline(
+            [('read', read), ('detect', detect), ('crop', extract_crops), ('ocr', recognize)],
+            queue_size=self.queue_size,
+            # OCR batches span every page that's ready, so sparse pages still fill a batch.
+            batch_sizes={'detect': self.detector_batch_size, 'ocr': self.queue_size},
+            max_wait=max_wait,
+        )
 
 
 def safe_json_dumps(obj: dict) -> str:
@@ -0,0 +1,71 @@
+import multiprocessing as mp
+import queue
+
+from loguru import logger
+
+from mokuro.mokuro_generator import MokuroGenerator
+from mokuro.volume import Volume
+
+
+def process_volumes_parallel(volumes: list[Volume], workers: int, ignore_errors=False, **generator_kwargs):
+    """
+    Process volumes in `workers` separate processes, each holding its own models.
+    Volumes are handed out from a shared queue.
+    Returns the number processed successfully and the total page cache (hits, misses).
+    """
+    # spawn rather than fork: forking a process that may already hold CUDA or OpenMP state is unsafe.
+    ctx = mp.get_context('spawn')
+    jobs = ctx.Queue()
+    results = ctx.Queue()
+    for job in enumerate(volumes):
+        jobs.put(job)
+    for _ in range(workers):
+        jobs.put(None)
+
+    processes = [
+        ctx.Process(target=_worker, args=(jobs, results, workers, ignore_errors, generator_kwargs), daemon=True)
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+
+    num_successful = 0
+    num_reported = 0
+    cache_counts = [0, 0]
+    while num_reported < len(volumes):
+        try:
+            i, success, hits, misses = results.get(timeout=1)
+        except queue.Empty:
+            if not any(process.is_alive() for process in processes):
+                logger.error(f'All workers exited with {len(volumes) - num_reported} volumes unreported')
+                break
+            continue
+        num_reported += 1
+        num_successful += success
+        cache_counts[0] += hits
+        cache_counts[1] += misses
+        logger.info(f'Finished {num_reported}/{len(volumes)}: {volumes[i].path}')
+
+    for process in processes:
+        process.join(timeout=5)
+    return num_successful, tuple(cache_counts)
+
+
+def _worker(jobs, results, workers, ignore_errors, generator_kwargs):
+    import torch
+    # torch defaults to one intra-op thread per physical core; share those between the workers.
+    torch.set_num_threads(max(1, torch.get_num_threads() // workers))
+
+    mg = MokuroGenerator(**generator_kwargs)
+    while (job := jobs.get()) is not None:
+        i, volume = job
+        before = mg.cache_counts()
+        try:
+            mg.process_volume(volume, ignore_errors=ignore_errors)
+        except Exception:
+            logger.exception(f'Error while processing {volume.path}')
+            success = False
+        else:
+            success = True
+        hits, misses = (now - then for now, then in zip(mg.cache_counts(), before))
+        results.put((i, success, hits, misses))
@@ -0,0 +1,180 @@
+import queue
+import threading
+import time
+from collections import Counter
+from typing import Callable, Iterable, Iterator
+
+_DONE = object()
+
+
+class Finished:
+    """Returned by a stage when an item's output is already final; later stages pass it through untouched."""
+
+    def __init__(self, output):
+        self.output = output
+
+
+class Pipeline:
+    """
+    Runs items through a chain of stages, each stage on its own thread(s),
+    connected by bounded queues so that I/O, decoding and inference overlap.
+
+    Results are yielded as ``(item, output)`` pairs in input order (a reorder
+    buffer holds back anything that finishes early). If a stage raises, the
+    exception is passed through the remaining stages untouched and yielded in
+    place of the output, so the consumer decides whether to re-raise or skip.
+    Likewise a stage can return `Finished(output)` to skip the remaining stages.
+    The items iterable is consumed on a dedicated feeder thread.
+    Closing the results iterator early (or an error in the consumer) stops the
+    stages, and waits for any call already running to return.
+
+    A stage listed in ``batch_sizes`` is always called with a list of up to that
+    many values (whatever is queued when it becomes free, or arrives within
+    ``max_wait`` seconds of the first value) and returns a list. The sizes of the
+    batches each such stage ran are counted in ``batch_size_counts``; read them
+    with `batch_size_snapshot` while the pipeline is running.
+    """
+
+    def __init__(self,
+                 stages: list[tuple[str, Callable]],
+                 queue_size: int = 4,
+                 workers: dict[str, int] | None = None,
+                 batch_sizes: dict[str, int] | None = None,
+                 max_wait: float = 0.0):
+        self.stages = stages
+        self.queue_size = queue_size
+        self.workers = workers or {}
+        self.batch_sizes = batch_sizes or {}
+        self.max_wait = max_wait
+        self.batch_size_counts = {name: Counter() for name in self.batch_sizes}
+        self._counts_lock = threading.Lock()
+
+    def batch_size_snapshot(self) -> dict[str, dict[int, int]]:
+        """A copy of ``batch_size_counts``, safe to read while stages are still running."""
+        with self._counts_lock:
+            return {name: dict(counts) for name, counts in self.batch_size_counts.items()}
+
+    def __call__(self, items: Iterable) -> Iterator:
+        stop = threading.Event()
+        queues = [queue.Queue(self.queue_size) for _ in range(len(self.stages) + 1)]
+        source_errors = []
+        threads = [threading.Thread(target=self._feed, args=(items, queues[0], stop, source_errors), daemon=True)]
+        for (name, fn), q_in, q_out in zip(self.stages, queues, queues[1:]):
+            num_workers = self.workers.get(name, 1)
+            batch_size = self.batch_sizes.get(name)
+            remaining = [num_workers]
+            lock = threading.Lock()
+            for i in range(num_workers):
+                threads.append(threading.Thread(
+                    target=self._work,
+                    args=(fn, batch_size, q_in, q_out, stop, remaining, lock, self.batch_size_counts.get(name)),
+                    name=f'mokuro-{name}-{i}',
+                    daemon=True,
+                ))
+        for thread in threads:
+            thread.start()
+
+        try:
+            pending = {}
+            next_idx = 0
+            while True:
+                entry = queues[-1].get()
+                if entry is _DONE:
+                    break
+                idx, item, output = entry
+                if isinstance(output, Finished):
+                    output = output.output
+                pending[idx] = (item, output)
+                while next_idx in pending:
+                    yield pending.pop(next_idx)
+                    next_idx += 1
+            if source_errors:
+                raise source_errors[0]
+        finally:
+            stop.set()  # stage threads poll this, so none stay blocked on a full queue
+            for thread in threads:
+                thread.join()  # don't leave a stage running on shared models after the caller moved on
+
+    @staticmethod
+    def _put(q, entry, stop):
+        while not stop.is_set():
+            try:
+                q.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _feed(self, items, q_out, stop, errors):
+        try:
+            for idx, item in enumerate(items):
+                if not self._put(q_out, (idx, item, item), stop):
+                    return
+        except Exception as e:
+            # The source itself failed; re-raised by the consumer once the stages drain.
+            errors.append(e)
+        self._put(q_out, _DONE, stop)
+
+    def _work(self, fn, batch_size, q_in, q_out, stop, remaining, lock, batch_size_counts):
+        while not stop.is_set():
+            try:
+                entries = [q_in.get(timeout=0.1)]
+            except queue.Empty:
+                continue
+            # Batched stages take whatever else is already waiting, or arrives within max_wait, up to batch_size.
+            deadline = time.monotonic() + self.max_wait
+            while len(entries) < (batch_size or 1) and entries[-1] is not _DONE:
+                timeout = deadline - time.monotonic()
+                try:
+                    entries.append(q_in.get(timeout=timeout) if timeout > 0 else q_in.get_nowait())
+                except queue.Empty:
+                    break
+            done = entries[-1] is _DONE
+            if done:
+                entries.pop()
+
+            if entries:
+                if batch_size_counts is not None:
+                    with self._counts_lock:
+                        batch_size_counts[len(entries)] += 1
+                outputs = self._apply(fn, batch_size, [value for idx, item, value in entries])
+                for (idx, item, value), output in zip(entries, outputs):
+                    if not self._put(q_out, (idx, item, output), stop):
+                        return
+
+            if done:
+                # Leave the marker for sibling workers; the last one forwards it.
+                self._put(q_in, _DONE, stop)
+                with lock:
+                    remaining[0] -= 1
+                    last = remaining[0] == 0
+                if last:
+                    self._put(q_out, _DONE, stop)
+                return
+
+    @staticmethod
+    def _apply(fn, batch_size, values):
+        if batch_size is None:
+            value, = values
+            if isinstance(value, (Exception, Finished)):
+                return [value]
+            try:
+                return [fn(value)]
+            except Exception as e:
+                return [e]
+
+        outputs = list(values)
+        todo = [i for i, value in enumerate(values) if not isinstance(value, (Exception, Finished))]
+        if not todo:
+            return outputs
+        try:
+            for i, output in zip(todo, fn([values[i] for i in todo])):
+                outputs[i] = output
+        except Exception:
+            # Retry one at a time so a single bad page doesn't fail its whole batch.
+            for i in todo:
+                try:
+                    outputs[i], = fn([values[i]])
+                except Exception as e:
+                    outputs[i] = e
+        return outputs
@@ -3,16 +3,29 @@ from pathlib import Path
 from loguru import logger
 
 from mokuro import MokuroGenerator
-from mokuro.volume import volume_from_path
+from mokuro.cache import cache
+from mokuro.parallel import process_volumes_parallel
+from mokuro.volume import scan_volumes
 
 
 def run(*paths: str | Path,
         parent_dir: str | Path = None,
         pretrained_model_name_or_path: str = 'kha-white/manga-ocr-base',
         force_cpu: bool = False,
+        detector_backend: str = 'torch',
+        detector_input_size: int = 1024,
+        detector_coarse_input_size: int = None,
+        detector_precision: str = 'fp32',
+        detector_dynamic_shape: bool = False,
+        detector_batch_size: int = 1,
+        disable_mask_refinement: bool = False,
+        ocr_memo_size: int = 4096,
+        ocr_memo_fuzzy: bool = False,
         disable_confirmation: bool = False,
         disable_ocr: bool = False,
         ignore_errors: bool = False,
+        disable_cache: bool = False,
+        workers: int = 1,
         ):
     """
     Process manga volumes with mokuro.
@@ -22,9 +35,20 @@ def run(*paths: str | Path,
         parent_dir: Parent directory to scan for volumes. If provided, all volumes inside this directory will be processed.
         pretrained_model_name_or_path: Name or path of the manga-ocr model.
         force_cpu: Force the use of CPU even if CUDA is available.
+        detector_backend: Text detector runtime, "torch" or "onnxruntime" (CPU only, needs the onnxruntime extra).
+        detector_input_size: Side of the square the text detector letterboxes pages to (the long side with detector_dynamic_shape).
+        detector_coarse_input_size: If set (e.g. 640), detect at this size first and only redo pages with small or missed lettering at detector_input_size. Torch backend only.
+        detector_precision: "fp32", or "int8" to run a detector quantized with `mokuro quantize-detector` (CPU only, torch backend).
+        detector_dynamic_shape: Letterbox pages to their own aspect ratio (long side detector_input_size, short side rounded up to 64) instead of a 1024x1024 square. Torch backend only.
+        detector_batch_size: Number of pages the text detector runs on at once. Larger batches use the CPU/GPU better at the cost of memory.
+        disable_mask_refinement: Skip refining the text mask. The detector's raw mask still filters blocks and lines; over-long lines are then split using the crop's own dark pixels.
+        ocr_memo_size: How many recently OCR'd line crops to remember within a volume, so recurring text (names, SFX, headers) is only OCR'd once. 0 disables the memo.
+        ocr_memo_fuzzy: Also reuse OCR text for crops that only look the same once downscaled (re-scans, re-crops), instead of only for crops with identical pixels. Faster on scanned volumes, but lookalike lines can get each other's text.
         disable_confirmation: Disable confirmation prompt. If False, the user will be prompted to confirm the list of volumes to be processed.
         disable_ocr: Disable OCR processing. Generate mokuro/HTML files without OCR results.
         ignore_errors: Continue processing volumes even if an error occurs.
+        disable_cache: Don't read or write the per-page OCR result cache in ~/.cache/manga-ocr/pages.
+        workers: Number of volumes to process in parallel, each in its own process with its own copy of the models.
     """
 
     if disable_ocr:
@@ -32,31 +56,19 @@ def run(*paths: str | Path,
 
     logger.info('Scanning paths...')
 
-    normalized_paths = []
-    for path in paths:
-        path_normalized = Path(path).expanduser().absolute()
-        if not path_normalized.exists():
-            logger.error(f'Invalid path: {path_normalized}')
-            return
-        normalized_paths.append(path_normalized)
-
-    if parent_dir is not None:
-        for p in Path(parent_dir).expanduser().absolute().iterdir():
-            if (p not in normalized_paths and
-                    (p.is_dir() and p.stem != '_ocr') or
-                    (p.is_file() and p.suffix.lower() in {'.zip', '.cbz'})
-            ):
-                normalized_paths.append(p)
-
-    volumes = [volume_from_path(path) for path in normalized_paths]
+    normalized_paths = normalize_volume_paths(paths, parent_dir)
+    if normalized_paths is None:
+        return
 
-    if len(volumes) == 0:
+    if len(normalized_paths) == 0:
         logger.error('Found no paths to process. Did you set the paths correctly?')
         return
 
-    print(f'\nFound {len(volumes)} volumes:\n')
-    for volume in volumes:
+    print(f'\nFound {len(normalized_paths)} volumes:\n')
+    volumes = []
+    for volume in scan_volumes(normalized_paths, cache.volume_manifest()):
         print(volume)
+        volumes.append(volume)
 
     msg = '\nEach of the paths above will be treated as one volume.\n'
     print(msg)
@@ -66,21 +78,65 @@ def run(*paths: str | Path,
         if inp.lower() not in ('y', 'yes'):
             return
 
-    mg = MokuroGenerator(
+    generator_kwargs = dict(
         pretrained_model_name_or_path=pretrained_model_name_or_path,
         force_cpu=force_cpu,
+        detector_backend=detector_backend,
+        detector_input_size=detector_input_size,
+        detector_coarse_input_size=detector_coarse_input_size,
+        detector_precision=detector_precision,
+        detector_dynamic_shape=detector_dynamic_shape,
+        detector_batch_size=detector_batch_size,
+        refine_mask=not disable_mask_refinement,
+        ocr_memo_size=ocr_memo_size,
+        ocr_memo_fuzzy=ocr_memo_fuzzy,
         disable_ocr=disable_ocr,
+        disable_cache=disable_cache,
     )
 
-    num_successful = 0
-    for i, volume in enumerate(volumes):
-        logger.info(f'Processing {i + 1}/{len(volumes)}: {volume.path}')
+    if workers > 1 and len(volumes) > 1:
+        workers = min(workers, len(volumes))
+        logger.info(f'Processing {len(volumes)} volumes with {workers} workers')
+        num_successful, (cache_hits, cache_misses) = process_volumes_parallel(
+            volumes, workers, ignore_errors=ignore_errors, **generator_kwargs
+        )
+    else:
+        mg = MokuroGenerator(**generator_kwargs)
+
+        num_successful = 0
+        for i, volume in enumerate(volumes):
+            logger.info(f'Processing {i + 1}/{len(volumes)}: {volume.path}')
+
+            try:
+                mg.process_volume(volume, ignore_errors=ignore_errors)
+            except Exception:
+                logger.exception(f'Error while processing {volume.path}')
+            else:
+                num_successful += 1
+        cache_hits, cache_misses = mg.cache_counts()
+
+    logger.info(
+        f'Processed successfully: {num_successful}/{len(volumes)} '
+        f'(page cache hits: {cache_hits}, misses: {cache_misses})'
+    )
+
+
+def normalize_volume_paths(paths, parent_dir=None) -> list[Path] | None:
+    """Absolute paths of the given volumes and those inside parent_dir, or None (logging it) if a path doesn't exist."""
+    normalized_paths = []
+    for path in paths:
+        path_normalized = Path(path).expanduser().absolute()
+        if not path_normalized.exists():
+            logger.error(f'Invalid path: {path_normalized}')
+            return None
+        normalized_paths.append(path_normalized)
 
-        try:
-            mg.process_volume(volume, ignore_errors=ignore_errors)
-        except Exception:
-            logger.exception(f'Error while processing {volume.path}')
-        else:
-            num_successful += 1
+    if parent_dir is not None:
+        for p in Path(parent_dir).expanduser().absolute().iterdir():
+            if (p not in normalized_paths and
+                    (p.is_dir() and p.stem != '_ocr') or
+                    (p.is_file() and p.suffix.lower() in {'.zip', '.cbz'})
+            ):
+                normalized_paths.append(p)
 
-    logger.info(f'Processed successfully: {num_successful}/{len(volumes)}')
+    return normalized_paths
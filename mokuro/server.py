@@ -0,0 +1,156 @@
+"""
+A daemon that keeps a MokuroGenerator, with its models loaded, between jobs, so that
+small jobs don't pay for importing torch and loading the models every time.
+
+Clients talk to it over a Unix socket, one job per connection, in newline-delimited
+JSON. A job is a single request line:
+
+    {"paths": ["/abs/path/to/volume", ...], "ignore_errors": false}
+
+answered by a stream of event lines until the job is done:
+
+    {"event": "queued", "volumes": [...], "jobs_ahead": 0}
+    {"event": "volume_started", "volume": "...", "total": 180}
+    {"event": "page", "volume": "...", "done": 1, "total": 180}
+    {"event": "volume_finished", "volume": "...", "output": "....mbz.zip"}
+    {"event": "volume_failed", "volume": "...", "error": "..."}
+    {"event": "finished", "num_successful": 1, "num_volumes": 1}
+
+or a single {"event": "error", "error": "..."} if the request can't be queued.
+Jobs are processed one at a time, in the order they were submitted.
+"""
+import json
+import queue
+import socket
+import socketserver
+import threading
+from pathlib import Path
+from typing import Iterator
+
+from loguru import logger
+
+from mokuro.cache import cache
+from mokuro.volume import scan_volumes
+
+
+def default_socket_path() -> Path:
+    return cache.root / 'mokuro.sock'
+
+
+class _Job:
+    def __init__(self, volumes, ignore_errors):
+        self.volumes = volumes
+        self.ignore_errors = ignore_errors
+        self.events = queue.Queue()
+
+    def send(self, **event):
+        self.events.put(event)
+
+
+class MokuroServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Serves jobs for `generator` on a Unix socket at socket_path, until shut down."""
+    daemon_threads = True
+
+    def __init__(self, socket_path, generator, manifest=None):
+        self.generator = generator
+        self.manifest = manifest
+        self.jobs = queue.Queue()
+        self.running = False
+        self._scan_lock = threading.Lock()
+        super().__init__(str(socket_path), _RequestHandler)
+        self._worker = threading.Thread(target=self._process_jobs, name='mokuro-serve', daemon=True)
+        self._worker.start()
+
+    def server_close(self):
+        super().server_close()
+        self.jobs.put(None)
+        Path(self.server_address).unlink(missing_ok=True)
+
+    def scan(self, paths):
+        with self._scan_lock:
+            return list(scan_volumes(paths, self.manifest))
+
+    def _process_jobs(self):
+        while (job := self.jobs.get()) is not None:
+            self.running = True
+            num_successful = 0
+            for volume in job.volumes:
+                name = str(volume.path)
+                logger.info(f'Processing {name}')
+                job.send(event='volume_started', volume=name, total=len(volume.namelist))
+                try:
+                    self.generator.process_volume(
+                        volume,
+                        ignore_errors=job.ignore_errors,
+                        progress=lambda done, total: job.send(event='page', volume=name, done=done, total=total),
+                    )
+                except Exception as e:
+                    logger.exception(f'Error while processing {name}')
+                    job.send(event='volume_failed', volume=name, error=str(e))
+                else:
+                    num_successful += 1
+                    job.send(event='volume_finished', volume=name, output=str(volume.output_path))
+            job.send(event='finished', num_successful=num_successful, num_volumes=len(job.volumes))
+            job.events.put(None)
+            self.running = False
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+            paths = [Path(p) for p in request['paths']]
+            missing = [str(p) for p in paths if not p.is_absolute() or not p.exists()]
+            if missing:
+                raise ValueError(f'Invalid paths (they must exist and be absolute): {missing}')
+            volumes = self.server.scan(paths)
+        except Exception as e:
+            self.send({'event': 'error', 'error': str(e)})
+            return
+
+        job = _Job(volumes, ignore_errors=bool(request.get('ignore_errors', False)))
+        jobs_ahead = self.server.jobs.qsize() + self.server.running
+        self.send({'event': 'queued', 'volumes': [str(v.path) for v in volumes], 'jobs_ahead': jobs_ahead})
+        self.server.jobs.put(job)
+        try:
+            while (event := job.events.get()) is not None:
+                self.send(event)
+        except OSError:  # the client went away; the job still runs to completion
+            logger.warning(f'Client disconnected from job {[str(v.path) for v in volumes]}')
+
+    def send(self, event):
+        self.wfile.write(json.dumps(event, ensure_ascii=False).encode('utf-8') + b'\n')
+        self.wfile.flush()
+
+
+def serve(generator, socket_path=None):
+    """Warm up `generator`'s models and serve jobs on socket_path until interrupted."""
+    socket_path = Path(socket_path or default_socket_path())
+    if socket_path.exists():
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.connect(str(socket_path))
+        except ConnectionRefusedError:
+            socket_path.unlink()  # left behind by a daemon that didn't shut down cleanly
+        else:
+            raise RuntimeError(f'A mokuro daemon is already listening on {socket_path}')
+
+    generator.init_models()
+    with MokuroServer(socket_path, generator, cache.volume_manifest()) as server:
+        logger.info(f'Listening on {socket_path}')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            logger.info('Shutting down')
+
+
+def submit(paths, socket_path=None, ignore_errors=False) -> Iterator[dict]:
+    """Submit volumes (absolute paths) to the daemon on socket_path, yielding its events as they come."""
+    socket_path = Path(socket_path or default_socket_path())
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(str(socket_path))
+        request = {'paths': [str(p) for p in paths], 'ignore_errors': ignore_errors}
+        sock.sendall(json.dumps(request, ensure_ascii=False).encode('utf-8') + b'\n')
+        with sock.makefile('r', encoding='utf-8') as events:
+            for line in events:
+                yield json.loads(line)
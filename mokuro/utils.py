@@ -1,4 +1,9 @@
 import json
+import struct
+from io import BytesIO
+from pathlib import Path
+import zlib
+from zipfile import BadZipFile, ZipFile, ZipInfo, ZIP_DEFLATED, ZIP_STORED
 
 import cv2
 import numpy as np
@@ -16,6 +21,97 @@ class NumpyEncoder(json.JSONEncoder):
 
 
 def imread(path) -> np.ndarray | None:
-    """cv2.imread, but works with Unicode paths"""
-    image = Image.open(path).convert('RGB')
-    return cv2.cvtColor(np.asarray(image), cv2.COLOR_RGB2BGR)
+    """
+    cv2.imread, but works with Unicode paths and with image bytes already in memory.
+    Decodes straight to BGR with OpenCV; PIL is only used for formats OpenCV can't read (AVIF).
+    """
+    if isinstance(path, bytes):
+        data = path
+    elif hasattr(path, 'read'):
+        data = path.read()
+    else:
+        data = Path(path).read_bytes()
+
+    img = None
+    if data and data[4:12] not in (b'ftypavif', b'ftypavis'):  # cv2.imdecode raises on an empty buffer
+        # Match PIL, which doesn't apply EXIF orientation either.
+        img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION)
+    if img is None:
+        image = Image.open(BytesIO(data)).convert('RGB')
+        img = cv2.cvtColor(np.asarray(image), cv2.COLOR_RGB2BGR)
+    return img
+
+
+# The ZipFile internals read_raw_zip_member relies on; they're private, so check they're still there.
+_RAW_READ_ATTRS = ('_lock', 'fp')
+
+
+def read_raw_zip_member(archive: ZipFile, zinfo: ZipInfo) -> bytes | None:
+    """
+    Read a member's data as it is stored in the archive, without decompressing it.
+    Returns None if this Python's ZipFile lacks the internals needed to, so read it with `archive.read` instead.
+    """
+    if not all(hasattr(archive, attr) for attr in _RAW_READ_ATTRS):
+        return None
+    with archive._lock:
+        archive.fp.seek(zinfo.header_offset)
+        header = archive.fp.read(30)
+        if header[:4] != b'PK\x03\x04':
+            raise BadZipFile(f'Bad local file header for {zinfo.filename}')
+        name_len, extra_len = struct.unpack('<HH', header[26:30])
+        archive.fp.seek(name_len + extra_len, 1)
+        return archive.fp.read(zinfo.compress_size)
+
+
+def decompress_zip_member(zinfo: ZipInfo, raw: bytes) -> bytes | None:
+    """Decompress raw member data in memory. Returns None for compression methods other than stored/deflated."""
+    if zinfo.compress_type == ZIP_STORED:
+        data = raw
+    elif zinfo.compress_type == ZIP_DEFLATED:
+        data = zlib.decompress(raw, -15)
+    else:
+        return None
+    if zlib.crc32(data) != zinfo.CRC:
+        raise BadZipFile(f'Bad CRC-32 for {zinfo.filename}')
+    return data
+
+
+# The ZipFile internals write_raw_zip_member relies on; they're private, so check they're still there.
+_RAW_COPY_ATTRS = ('_lock', '_writing', '_writecheck', '_didModify', 'fp', 'start_dir', 'filelist', 'NameToInfo')
+
+
+def write_raw_zip_member(output: ZipFile, src_zinfo: ZipInfo, raw: bytes, arcname: str):
+    """
+    Copy a member read with `read_raw_zip_member` into `output` as-is: the
+    compressed bytes, CRC and sizes are carried over, so nothing is recompressed.
+    Falls back to decompressing and writing it through `ZipFile.open` if this
+    Python's ZipFile lacks the internals the raw copy needs.
+    """
+    zinfo = ZipInfo(arcname, date_time=src_zinfo.date_time)
+    zinfo.compress_type = src_zinfo.compress_type
+    zinfo.external_attr = src_zinfo.external_attr or 0o600 << 16
+    if not all(hasattr(output, attr) for attr in _RAW_COPY_ATTRS):
+        data = decompress_zip_member(src_zinfo, raw)
+        if data is None:
+            raise NotImplementedError(f'Unsupported compression method for {src_zinfo.filename}')
+        zinfo.file_size = len(data)
+        with output.open(zinfo, 'w') as f:
+            f.write(data)
+        return
+
+    zinfo.CRC = src_zinfo.CRC
+    zinfo.compress_size = src_zinfo.compress_size
+    zinfo.file_size = src_zinfo.file_size
+    # The sizes are known up front, so no data descriptor (flag bit 3) is needed.
+    with output._lock:
+        if output._writing:
+            raise ValueError("Can't write to the ZIP file while there is another write handle open on it.")
+        output._writecheck(zinfo)
+        output._didModify = True
+        output.fp.seek(output.start_dir)
+        zinfo.header_offset = output.fp.tell()
+        output.fp.write(zinfo.FileHeader())
+        output.fp.write(raw)
+        output.start_dir = output.fp.tell()
+        output.filelist.append(zinfo)
+        output.NameToInfo[zinfo.filename] = zinfo
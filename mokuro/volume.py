@@ -1,10 +1,32 @@
 import uuid
 import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Iterable, Iterator
 
 from filetype import is_image
 from natsort import natsorted
 
+from mokuro.cache import VolumeManifest
+from mokuro.utils import decompress_zip_member, read_raw_zip_member
+
+
+class Page:
+    """
+    One page image as read from a volume. `raw_member` is the page's
+    (ZipInfo, compressed bytes) when it can be copied to the output as-is.
+    The cache fields are filled in by MokuroGenerator.
+    """
+    __slots__ = ('stem', 'name', 'img_bytes', 'raw_member', 'cache_key', 'cached')
+
+    def __init__(self, stem: str, name: str, img_bytes: bytes, raw_member=None):
+        self.stem = stem
+        self.name = name
+        self.img_bytes = img_bytes
+        self.raw_member = raw_member
+        self.cache_key = None
+        self.cached = None
+
 
 class Volume:
     supported_formats = ('.avif', '.jpg', '.jpeg', '.png', '.webp')
@@ -23,9 +45,20 @@ class Volume:
             self._set_namelist()
         return self._namelist
 
-    def get_img_paths(self):
+    def scan(self, manifest: VolumeManifest | None = None):
+        """Find the volume's images, reusing the manifest's entry when the volume hasn't changed."""
+        names = manifest.get(self.path) if manifest is not None else None
+        if names is not None:
+            self._namelist = [Path(name) for name in names]
+        else:
+            self._set_namelist()
+            if manifest is not None:
+                manifest.put(self.path, [path.as_posix() for path in self._namelist])
+
+    def get_pages(self) -> Iterator['Page']:
+        """Read each image once; the same bytes are decoded for OCR and written to the output."""
         for path in self.namelist:
-            yield path.stem, path
+            yield Page(path.stem, path.name, path.read_bytes())
 
     def _set_namelist(self):
         assert self.path.is_dir()
@@ -42,12 +75,21 @@ class Volume:
 
 class VolumeZip(Volume):
 
-    def get_img_paths(self):
+    def get_pages(self) -> Iterator['Page']:
+        # One archive is opened for the whole volume and every member is read
+        # from it directly, rather than through per-page zipfile.Path lookups.
         with zipfile.ZipFile(self.path) as archive:
             for path in self.namelist:
-                img_path = zipfile.Path(archive, at=str(path))
-                img_path.read = img_path.read_bytes  # a bit of a hack but works
-                yield path.stem, img_path
+                zinfo = archive.getinfo(path.as_posix())
+                if zinfo.flag_bits & 0x1:  # encrypted
+                    yield Page(path.stem, path.name, archive.read(zinfo))
+                    continue
+                raw = read_raw_zip_member(archive, zinfo)
+                img_bytes = None if raw is None else decompress_zip_member(zinfo, raw)
+                if img_bytes is None:
+                    yield Page(path.stem, path.name, archive.read(zinfo))
+                else:
+                    yield Page(path.stem, path.name, img_bytes, raw_member=(zinfo, raw))
 
     def _set_namelist(self):
         self._namelist = []
@@ -66,3 +108,19 @@ def volume_from_path(path: Path):
     if path.suffix in ('.zip', '.cbz'):
         return VolumeZip(path)
     return Volume(path)
+
+
+def scan_volumes(paths: Iterable[Path], manifest: VolumeManifest | None = None, max_workers=8) -> Iterator[Volume]:
+    """
+    Scan volumes on a thread pool, yielding each one (in input order) as soon
+    as it and the volumes before it are scanned. The manifest is saved at the end.
+    """
+    def scan(path):
+        volume = volume_from_path(path)
+        volume.scan(manifest)
+        return volume
+
+    with ThreadPoolExecutor(max_workers) as pool:
+        yield from pool.map(scan, paths)
+    if manifest is not None:
+        manifest.save()
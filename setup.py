@@ -32,7 +32,7 @@ setup(
         "pyclipper",
         "requests",
         "scipy",
-        "shapely",
+        "shapely>=2.0",
         "torch>=1.7.0",
         "torchsummary",
         "torchvision>=0.8.1",
@@ -40,6 +40,9 @@ setup(
         "tqdm>=4.41.0",
         "uuid-utils==0.8.0",
     ],
+    extras_require={
+        "onnxruntime": ["onnx", "onnxruntime"],
+    },
     entry_points={
         "console_scripts": [
             "mokuro=mokuro.__main__:main",
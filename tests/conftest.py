@@ -1,3 +1,4 @@
+import copy
 from pathlib import Path
 
 import pytest
@@ -25,3 +26,49 @@ def input_data_root(test_data_root):
 @pytest.fixture
 def expected_results_root(test_data_root):
     return test_data_root / 'expected_results'
+
+
+# The yolov5s layout of the text detector's block branch.
+YOLOV5S_CFG = {
+    'nc': 2, 'depth_multiple': 0.33, 'width_multiple': 0.5,
+    'anchors': [[10, 13, 16, 30, 33, 23], [30, 61, 62, 45, 59, 119], [116, 90, 156, 198, 373, 326]],
+    'backbone': [
+        [-1, 1, 'Conv', [64, 6, 2, 2]], [-1, 1, 'Conv', [128, 3, 2]], [-1, 3, 'C3', [128]],
+        [-1, 1, 'Conv', [256, 3, 2]], [-1, 6, 'C3', [256]], [-1, 1, 'Conv', [512, 3, 2]],
+        [-1, 9, 'C3', [512]], [-1, 1, 'Conv', [1024, 3, 2]], [-1, 3, 'C3', [1024]], [-1, 1, 'SPPF', [1024, 5]],
+    ],
+    'head': [
+        [-1, 1, 'Conv', [512, 1, 1]], [-1, 1, 'nn.Upsample', [None, 2, 'nearest']], [[-1, 6], 1, 'Concat', [1]],
+        [-1, 3, 'C3', [512, False]], [-1, 1, 'Conv', [256, 1, 1]], [-1, 1, 'nn.Upsample', [None, 2, 'nearest']],
+        [[-1, 4], 1, 'Concat', [1]], [-1, 3, 'C3', [256, False]], [-1, 1, 'Conv', [256, 3, 2]],
+        [[-1, 14], 1, 'Concat', [1]], [-1, 3, 'C3', [512, False]], [-1, 1, 'Conv', [512, 3, 2]],
+        [[-1, 10], 1, 'Concat', [1]], [-1, 3, 'C3', [1024, False]], [[17, 20, 23], 1, 'Detect', ['nc', 'anchors']],
+    ],
+}
+
+
+@pytest.fixture(scope='session')
+def random_detector_path(tmp_path_factory):
+    """
+    A text detector checkpoint with randomly initialized weights, for tests that don't need
+    real detections. Its block branch is biased to be confident, so that pages get blocks.
+    """
+    torch = pytest.importorskip('torch')
+    from mokuro.comic_text_detector.basemodel import DBHead, UnetHead
+    from mokuro.comic_text_detector.models.yolov5.yolo import Model
+
+    torch.manual_seed(0)
+    blk_det = Model(copy.deepcopy(YOLOV5S_CFG))
+    detect = blk_det.model[-1]
+    with torch.no_grad():
+        for conv in detect.m:
+            bias = conv.bias.view(detect.na, -1)
+            bias[:, 4:6] += 4  # objectness and the first class
+
+    path = tmp_path_factory.mktemp('models') / 'comictextdetector-random.pt'
+    torch.save({
+        'blk_det': {'cfg': copy.deepcopy(YOLOV5S_CFG), 'weights': blk_det.state_dict()},
+        'text_seg': UnetHead(act='leaky').state_dict(),
+        'text_det': DBHead(64, act='leaky').state_dict(),
+    }, path)
+    return path
@@ -0,0 +1,65 @@
+import json
+import os
+import time
+
+from mokuro.cache import PageResultCache, VolumeManifest, file_version
+
+
+def test_key_covers_bytes_and_versions():
+    key = PageResultCache.key(b'page', '1.0', 'model')
+    assert key == PageResultCache.key(b'page', '1.0', 'model')
+    assert key != PageResultCache.key(b'page2', '1.0', 'model')
+    assert key != PageResultCache.key(b'page', '1.1', 'model')
+    assert PageResultCache.key(b'page', 'ab', 'c') != PageResultCache.key(b'page', 'a', 'bc')
+
+
+def test_get_put_counts_hits_and_misses(tmp_path):
+    results = PageResultCache(tmp_path, max_size=1 << 20)
+    key = results.key(b'page')
+    assert results.get(key) is None
+    results.put(key, '{"blocks": []}')
+    assert results.get(key) == {'blocks': []}
+    assert (results.hits, results.misses) == (1, 1)
+
+
+def test_evicts_least_recently_used(tmp_path):
+    entry = '{"text": "%s"}' % ('x' * 1000)
+    results = PageResultCache(tmp_path, max_size=3500)
+    keys = [results.key(str(i).encode()) for i in range(4)]
+    now = time.time()
+    for age, key in zip((40, 30, 20), keys):
+        results.put(key, entry)
+        os.utime(results._path(key), (now - age, now - age))
+    assert results.get(keys[0]) is not None  # bumps the oldest entry
+
+    results.put(keys[3], entry)  # over max_size: drops the least recently used, down to 90% of it
+
+    assert [results.get(key) is not None for key in keys] == [True, False, True, True]
+
+
+def test_file_version_changes_with_contents(tmp_path):
+    path = tmp_path / 'weights.pt'
+    path.write_bytes(b'a' * 100)
+    version = file_version(path)
+    assert file_version(path) == version
+    path.write_bytes(b'b' * 101)
+    assert file_version(path) != version
+
+
+def test_manifest_drops_missing_and_changed_volumes(tmp_path):
+    volumes = [tmp_path / name for name in ('kept', 'deleted', 'changed')]
+    for path in volumes:
+        path.mkdir()
+    manifest = VolumeManifest(tmp_path / 'manifest.json')
+    for path in volumes:
+        manifest.put(path, ['001.jpg'])
+    manifest.save()
+
+    volumes[1].rmdir()
+    os.utime(volumes[2], ns=(0, 0))  # as if its contents had changed
+    manifest = VolumeManifest(tmp_path / 'manifest.json')
+    assert manifest.get(volumes[1]) is None and manifest.get(volumes[2]) is None
+    manifest.save()  # nothing new was put, but stale entries still go
+
+    assert set(json.loads((tmp_path / 'manifest.json').read_text())) == {str(volumes[0])}
+    assert VolumeManifest(tmp_path / 'manifest.json').get(volumes[0]) == ['001.jpg']
@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+
+cv2 = pytest.importorskip('cv2')
+
+from mokuro.comic_text_detector.utils.db_utils import SegDetectorRepresenter
+
+
+def boxes_from_bitmap_reference(rep, pred, bitmap, dest_width, dest_height, min_score):
+    """boxes_from_bitmap as it was before the min_score shortcut, filtered like TextDetector.detect_raw."""
+    height, width = bitmap.shape
+    contours, _ = cv2.findContours((bitmap * 255).astype(np.uint8), cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+    num_contours = min(len(contours), rep.max_candidates)
+    boxes = np.zeros((num_contours, 4, 2), dtype=np.int16)
+    scores = np.zeros((num_contours,), dtype=np.float32)
+
+    for index in range(num_contours):
+        contour = contours[index].squeeze(1)
+        points, sside = rep.get_mini_boxes(contour)
+        if sside < 2:
+            continue
+        points = np.array(points)
+        score = rep.box_score_fast(pred, contour)
+        box = rep.unclip(points, unclip_ratio=rep.unclip_ratio).reshape(-1, 1, 2)
+        box, sside = rep.get_mini_boxes(box)
+        box = np.array(box)
+        box[:, 0] = np.clip(np.round(box[:, 0] / width * dest_width), 0, dest_width)
+        box[:, 1] = np.clip(np.round(box[:, 1] / height * dest_height), 0, dest_height)
+        boxes[index, :, :] = box.astype(np.int16)
+        scores[index] = score
+    keep = scores > min_score
+    return boxes[keep], scores[keep]
+
+
+def rings_and_nested_shapes(seed):
+    """A probability map of bars, rings (some holding islands), and nested rings, with a noisy background."""
+    rng = np.random.default_rng(seed)
+    pred = rng.uniform(0, 0.35, (256, 256)).astype(np.float32)
+    for cy in range(32, 256, 64):
+        for cx in range(32, 256, 64):
+            kind = rng.integers(4)
+            ring, inner = rng.uniform(0.3, 0.7), rng.uniform(0.6, 1.0)
+            if kind == 0:  # a bar
+                pred[cy - 5: cy + 5, cx - 25: cx + 25] = rng.uniform(0.3, 1.0)
+            else:  # a ring, scoring low by itself
+                cv2.rectangle(pred, (cx - 26, cy - 26), (cx + 26, cy + 26), ring, 3)
+            if kind == 2:  # holding a high scoring island
+                pred[cy - 8: cy + 8, cx - 12: cx + 12] = inner
+            elif kind == 3:  # holding another ring, holding an island
+                cv2.rectangle(pred, (cx - 16, cy - 16), (cx + 16, cy + 16), ring, 2)
+                pred[cy - 5: cy + 5, cx - 5: cx + 5] = inner
+    return pred
+
+
+@pytest.mark.parametrize('seed', range(8))
+def test_boxes_from_bitmap_matches_reference(seed):
+    pred = rings_and_nested_shapes(seed)
+    rep = SegDetectorRepresenter(thresh=0.3, min_score=0.6)
+    bitmap = pred > 0.3
+
+    boxes, scores = rep.boxes_from_bitmap(pred, bitmap, 512, 384)
+    expected_boxes, expected_scores = boxes_from_bitmap_reference(rep, pred, bitmap, 512, 384, min_score=0.6)
+
+    assert len(expected_boxes) > 0
+    np.testing.assert_array_equal(boxes, expected_boxes)
+    np.testing.assert_array_equal(scores, expected_scores)
+
+
+def test_boxes_from_bitmap_keeps_ring_around_island():
+    pred = np.zeros((100, 100), np.float32)
+    cv2.rectangle(pred, (10, 10), (90, 90), 0.5, 2)  # the ring alone averages below min_score...
+    pred[14:87, 14:87] = 0.95  # ...but its fill doesn't
+
+    rep = SegDetectorRepresenter(thresh=0.3, min_score=0.6)
+    boxes, scores = rep.boxes_from_bitmap(pred, pred > 0.3, 100, 100)
+
+    assert len(boxes) == 3  # the island, and the ring along both its edges
+    assert all(score > 0.6 for score in scores)
+
+
+def test_boxes_from_bitmap_drops_low_scores():
+    pred = np.zeros((200, 200), np.float32)
+    pred[20:40, 20:120] = 0.9
+    pred[100:120, 20:120] = 0.5
+    pred[150:151, 20:120] = 0.9  # too thin for a box
+
+    rep = SegDetectorRepresenter(thresh=0.3, min_score=0.6)
+    boxes, scores = rep.boxes_from_bitmap(pred, pred > 0.3, 400, 400)
+
+    np.testing.assert_allclose(scores, [0.9])
+    x1, y1 = boxes[0].min(axis=0)
+    x2, y2 = boxes[0].max(axis=0)
+    assert x1 < 40 < 238 < x2 and y1 < 40 < 78 < y2
@@ -0,0 +1,134 @@
+import numpy as np
+import pytest
+
+cv2 = pytest.importorskip('cv2')
+torch = pytest.importorskip('torch')
+
+from mokuro.comic_text_detector.inference import TextDetector
+from mokuro.comic_text_detector.utils.textblock import TextBlk
+from mokuro.utils import imread
+
+
+@pytest.fixture
+def pages(input_data_root):
+    return [imread(p) for p in sorted((input_data_root / 'test0' / 'vol1').iterdir())[:2]]
+
+
+def blocks(blk_list):
+    return [(blk.xyxy, blk.vertical, blk.font_size, blk.lines_array().tolist()) for blk in blk_list]
+
+
+def test_refine_false_keeps_the_raw_mask(random_detector_path, pages):
+    detector = TextDetector(random_detector_path, input_size=512)
+
+    refined = detector.detect_batch(pages, refine=True, lazy_refine=True)
+    unrefined = detector.detect_batch(pages, refine=False)
+
+    for (mask, _, blk_list), (raw_mask, mask_refined, raw_blk_list) in zip(refined, unrefined):
+        assert mask_refined is None
+        np.testing.assert_array_equal(raw_mask, mask)
+        assert blocks(raw_blk_list) == blocks(blk_list)
+
+
+def test_detect_batch_matches_single_pages(random_detector_path, pages):
+    detector = TextDetector(random_detector_path, input_size=512)
+    pages = pages + [cv2.resize(pages[0], (900, 500))]  # letterboxed differently
+
+    batched = detector.detect_batch(pages, lazy_refine=True)
+
+    for img, (mask, _, blk_list) in zip(pages, batched):
+        single_mask, _, single_blk_list = detector(img, lazy_refine=True)
+        np.testing.assert_allclose(mask, single_mask, atol=1)
+        assert blocks(blk_list) == blocks(single_blk_list)
+
+
+class BrightRegionNet:
+    """Stands in for the network: "detects" a single block and its mask where the input is bright."""
+
+    def __call__(self, batch_in):
+        bright = batch_in.mean(dim=1, keepdim=True) > 0.5
+        blks = torch.zeros(len(batch_in), 1, 7)
+        for ii, page in enumerate(bright[:, 0]):
+            ys, xs = torch.nonzero(page, as_tuple=True)
+            x1, y1, x2, y2 = xs.min(), ys.min(), xs.max() + 1, ys.max() + 1
+            blks[ii, 0] = torch.tensor([(x1 + x2) / 2, (y1 + y2) / 2, x2 - x1, y2 - y1, 1, 1, 0])
+        return blks, bright.float(), torch.zeros_like(batch_in[:, :1])
+
+
+@pytest.mark.parametrize('dynamic_shape', [False, True])
+def test_detections_map_back_to_the_page(random_detector_path, dynamic_shape):
+    detector = TextDetector(random_detector_path, input_size=1024, dynamic_shape=dynamic_shape)
+    detector.net = BrightRegionNet()
+    rects = [(100, 150, 400, 250), (600, 40, 850, 420)]  # x1, y1, x2, y2
+    pages = []
+    for (x1, y1, x2, y2), (h, w) in zip(rects, [(800, 600), (500, 900)]):
+        img = np.zeros((h, w, 3), np.uint8)
+        img[y1:y2, x1:x2] = 255
+        pages.append(img)
+
+    for (x1, y1, x2, y2), img, (mask, _, blk_list) in zip(rects, pages, detector.detect_batch(pages, refine=False)):
+        assert mask.shape == img.shape[:2]
+        ys, xs = np.nonzero(mask > 127)
+        np.testing.assert_allclose([xs.min(), ys.min(), xs.max() + 1, ys.max() + 1], [x1, y1, x2, y2], atol=1)
+        assert len(blk_list) == 1
+        np.testing.assert_allclose(blk_list[0].xyxy, [x1, y1, x2, y2], atol=1)
+
+
+def test_needs_escalation(random_detector_path):
+    detector = TextDetector(random_detector_path, input_size=1024, coarse_input_size=512, min_font_size=10, max_uncovered=0.3)
+    mask = np.zeros((2000, 1000), np.uint8)
+    mask[100:200, 100:500] = 255
+    blk = TextBlk([100, 100, 500, 200], np.array([[[100, 100], [500, 100], [500, 200], [100, 200]]]))
+
+    blk.font_size = 40  # 10.24 px at the coarse input size
+    assert not detector.needs_escalation(mask.shape, mask, [blk])
+    blk.font_size = 39
+    assert detector.needs_escalation(mask.shape, mask, [blk])
+
+    blk.font_size = 40
+    mask[300:400, 100:240] = 255  # 140 / 540 of the mask isn't covered by a block
+    assert not detector.needs_escalation(mask.shape, mask, [blk])
+    mask[300:400, 240:300] = 255  # 200 / 600
+    assert detector.needs_escalation(mask.shape, mask, [blk])
+    assert detector.needs_escalation(mask.shape, mask, [])
+    assert not detector.needs_escalation(mask.shape, np.zeros_like(mask), [])
+
+
+@pytest.mark.parametrize('refine', [False, True])
+def test_coarse_detection_escalates(random_detector_path, pages, monkeypatch, refine):
+    detector = TextDetector(random_detector_path, input_size=512, coarse_input_size=256)
+    fine = TextDetector(random_detector_path, input_size=512)
+    coarse = TextDetector(random_detector_path, input_size=256)
+    pages = [pages[0], cv2.resize(pages[1], (700, 1000))]
+    monkeypatch.setattr(detector, 'needs_escalation', lambda img_shape, mask, blk_list: img_shape == pages[1].shape)
+
+    detections = detector.detect_batch(pages, refine=refine, lazy_refine=True)
+
+    assert (detector.num_coarse, detector.num_escalated) == (2, 1)  # counted whether or not the mask is refined
+    for (mask, _, blk_list), expected in zip(detections, [coarse(pages[0], lazy_refine=True), fine(pages[1], lazy_refine=True)]):
+        np.testing.assert_allclose(mask, expected[0], atol=1)
+        assert blocks(blk_list) == blocks(expected[2])
+
+
+@pytest.mark.parametrize('names, lines_channels', [
+    (('blks', 'mask', 'lines_map'), 1),
+    (('blk', 'seg', 'det'), 2),
+    (('output0', 'output1', 'output2'), 2),
+])
+def test_dnn_outputs_are_matched_by_name(names, lines_channels):
+    from mokuro.comic_text_detector.basemodel import TextDetBaseDNN
+
+    expected = np.zeros((1, 10, 7)), np.zeros((1, 1, 64, 64)), np.zeros((1, lines_channels, 64, 64))
+    outputs = dict(reversed(list(zip(names, expected))))  # not in graph order
+
+    ordered = TextDetBaseDNN.order_outputs(outputs)
+
+    assert all(out is exp for out, exp in zip(ordered, expected))
+
+
+def test_dnn_outputs_must_be_recognizable():
+    from mokuro.comic_text_detector.basemodel import TextDetBaseDNN
+
+    outputs = {'a': np.zeros((1, 10, 7)), 'b': np.zeros((1, 1, 64, 64)), 'c': np.zeros((1, 1, 64, 64))}
+    with pytest.raises(ValueError, match='Unrecognized text detector outputs'):
+        TextDetBaseDNN.order_outputs(outputs)
@@ -0,0 +1,27 @@
+import numpy as np
+import pytest
+
+from mokuro.utils import imread
+
+pytest.importorskip('onnxruntime')
+
+
+def test_onnxruntime_matches_torch(tmp_path, input_data_root, random_detector_path):
+    from mokuro.comic_text_detector.basemodel import TextDetBaseInference, TextDetBaseORT, export_onnx
+    from mokuro.comic_text_detector.inference import preprocess_img
+
+    input_size = 1024
+    onnx_path = tmp_path / 'comictextdetector.onnx'
+    export_onnx(random_detector_path, onnx_path, input_size=input_size)
+
+    imgs = [imread(p) for p in sorted((input_data_root / 'test0' / 'vol1').iterdir())[:2]]
+    batch = np.concatenate([preprocess_img(img, input_size=(input_size, input_size))[0].numpy() for img in imgs])
+
+    import torch
+    with torch.no_grad():
+        expected = [out.numpy() for out in TextDetBaseInference(random_detector_path)(torch.from_numpy(batch))]
+    actual = TextDetBaseORT(onnx_path)(batch)
+
+    for name, a, e in zip(('blks', 'mask', 'lines_map'), actual, expected):
+        assert a.shape == e.shape, name
+        np.testing.assert_allclose(a, e, atol=1e-3, err_msg=name)
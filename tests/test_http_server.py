@@ -0,0 +1,61 @@
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+import pytest
+
+from mokuro.http_server import PageOcrServer
+from mokuro.manga_page_ocr import OcrMemo
+from mokuro.mokuro_generator import MokuroGenerator
+
+
+@pytest.fixture
+def server():
+    # With OCR disabled the pipeline still reads and batches every page, without needing the models.
+    generator = MokuroGenerator(disable_ocr=True, queue_size=4, detector_batch_size=4)
+    server = PageOcrServer(('127.0.0.1', 0), generator, max_wait=0.5)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+def post(server, body):
+    url = f'http://127.0.0.1:{server.server_port}/ocr'
+    with urlopen(Request(url, data=body, method='POST')) as response:
+        return json.loads(response.read())
+
+
+def test_concurrent_pages_are_batched(server, input_data_root):
+    img_paths = sorted((input_data_root / 'test0' / 'vol1').iterdir())[:4]
+    with ThreadPoolExecutor(len(img_paths)) as pool:
+        results = list(pool.map(lambda p: post(server, p.read_bytes()), img_paths))
+
+    assert all(result['blocks'] == [] and result['img_width'] > 0 for result in results)
+    with urlopen(f'http://127.0.0.1:{server.server_port}/metrics') as response:
+        metrics = json.loads(response.read())
+    assert metrics['requests'] == 4 and metrics['queue_depth'] == 0
+    detect_batches = {int(size): count for size, count in metrics['batch_sizes']['detect'].items()}
+    assert sum(size * count for size, count in detect_batches.items()) == 4
+    assert max(detect_batches) > 1
+
+
+@pytest.mark.parametrize('body', [b'not an image', b''])
+def test_invalid_image_is_a_bad_request(server, body):
+    with pytest.raises(HTTPError) as e:
+        post(server, body)
+    assert e.value.code == 400
+    assert server.metrics()['errors'] == 1
+
+
+def test_ocr_memo_doesnt_outlive_a_batch(server, input_data_root):
+    memo = server.mpocr_model.ocr_memo = OcrMemo()
+    memo.put(((64, 320, 3), b'digest'), 'from an earlier request')
+
+    post(server, sorted((input_data_root / 'test0' / 'vol1').iterdir())[0].read_bytes())
+
+    assert memo.get(((64, 320, 3), b'digest')) is None
@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+cv2 = pytest.importorskip('cv2')
+
+from mokuro.comic_text_detector.utils.linecrop import LineCropper
+from mokuro.comic_text_detector.utils.textblock import TextBlk
+
+
+def blocks(im_w=600, im_h=800):
+    rng = np.random.default_rng(0)
+    blk_list = []
+    for ii in range(12):
+        vertical = ii % 2 == 0
+        font = int(rng.integers(16, 40))
+        x, y = int(rng.integers(100, im_w - 200)), int(rng.integers(100, im_h - 300))
+        lines = []
+        for jj in range(3):
+            length = font * int(rng.integers(2, 8))
+            w, h = (font, length) if vertical else (length, font)
+            quad = np.array([[x, y], [x + w, y], [x + w, y + h], [x, y + h]], np.float64)
+            if ii % 3 == 0:  # slightly rotated
+                c = quad.mean(axis=0)
+                rad = np.deg2rad(rng.uniform(-10, 10))
+                quad = (quad - c) @ np.array([[np.cos(rad), np.sin(rad)], [-np.sin(rad), np.cos(rad)]]) + c
+            lines.append(quad)
+            x, y = (x - font - 5, y) if vertical else (x, y + font + 5)
+        blk = TextBlk([0, 0, 1, 1], np.array(lines).astype(np.int32))
+        blk.vertical = vertical
+        blk.font_size = font
+        blk.language = ['ja', 'eng', 'unknown'][ii % 3]
+        blk_list.append(blk)
+
+    # lines touching or running past the page border
+    for language, lines in (
+        ('eng', [[im_w - 200, 20, im_w - 1, 20], [im_w - 200, 50, im_w - 1, 50]]),
+        ('ja', [[im_w - 150, im_h - 60, im_w + 30, im_h - 60], [-20, im_h - 30, 120, im_h - 30]]),
+    ):
+        quads = [[[x1, y1], [x2, y1], [x2, y1 + 24], [x1, y1 + 24]] for x1, y1, x2, _ in lines]
+        blk = TextBlk([0, 0, 1, 1], np.array(quads, np.int32))
+        blk.vertical = False
+        blk.font_size = 24
+        blk.language = language
+        blk_list.append(blk)
+    return blk_list
+
+
+def test_line_cropper_matches_get_transformed_region():
+    rng = np.random.default_rng(1)
+    img = cv2.GaussianBlur(rng.integers(0, 256, (800, 600, 3), dtype=np.uint8), (9, 9), 0)
+    blk_list = blocks()
+    cropper = LineCropper(blk_list, img.shape, textheight=64)
+    assert cropper.axis_aligned.any() and not cropper.axis_aligned.all()
+
+    for blk_idx, blk in enumerate(blk_list):
+        for line_idx in range(len(blk)):
+            expected = blk.get_transformed_region(img, line_idx, 64)
+            if blk.vertical:
+                expected = cv2.rotate(expected, cv2.ROTATE_90_CLOCKWISE)
+            actual = cropper.crop(img, blk_idx, line_idx)
+            assert actual.shape == expected.shape
+            diff = np.abs(actual.astype(int) - expected.astype(int))
+            if cropper.axis_aligned[cropper.line_index(blk_idx, line_idx)]:
+                # resize samples pixel centres rather than pinning the corners, so allow some drift
+                assert diff.mean() < 8
+            else:
+                assert diff.max() <= 1
+
+
+def test_line_cropper_warps_lines_past_the_border():
+    img = np.full((800, 600, 3), 255, np.uint8)
+    blk_list = blocks()
+    cropper = LineCropper(blk_list, img.shape, textheight=64)
+
+    for blk_idx in (len(blk_list) - 2, len(blk_list) - 1):
+        for line_idx in range(len(blk_list[blk_idx])):
+            assert not cropper.axis_aligned[cropper.line_index(blk_idx, line_idx)]
+            expected = blk_list[blk_idx].get_transformed_region(img, line_idx, 64)
+            np.testing.assert_allclose(cropper.crop(img, blk_idx, line_idx), expected, atol=1)
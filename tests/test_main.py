@@ -0,0 +1,36 @@
+import pytest
+
+from mokuro import __main__ as cli
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    calls = []
+
+    def run(*paths, force_cpu: bool = False):
+        calls.append(('run', paths, force_cpu))
+
+    def serve(socket_path: str = None, http_port: int = None):
+        calls.append(('serve', socket_path, http_port))
+
+    def submit(*paths, ignore_errors: bool = False):
+        calls.append(('submit', paths, ignore_errors))
+
+    monkeypatch.setitem(cli.COMMANDS, 'run', run)
+    monkeypatch.setitem(cli.COMMANDS, 'serve', serve)
+    monkeypatch.setitem(cli.COMMANDS, 'submit', submit)
+    return calls
+
+
+@pytest.mark.parametrize('argv, expected', [
+    (['vol1', 'vol2', '--force_cpu'], ('run', ('vol1', 'vol2'), True)),
+    ([], ('run', (), False)),
+    (['run', 'serve'], ('run', ('serve',), False)),
+    (['--force_cpu=True', 'serve'], ('run', ('serve',), True)),
+    (['vol1', 'serve'], ('run', ('vol1', 'serve'), False)),
+    (['serve', '--http_port', '8000'], ('serve', None, 8000)),
+    (['submit', 'vol1', '--ignore_errors'], ('submit', ('vol1',), True)),
+])
+def test_dispatch(calls, argv, expected):
+    cli.main(argv)
+    assert calls == [expected]
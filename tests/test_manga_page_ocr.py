@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+
+from mokuro.comic_text_detector.utils.linecrop import LineCropper
+from mokuro.comic_text_detector.utils.textblock import TextBlk
+from mokuro.comic_text_detector.utils.textmask import LazyRefinedMask, refine_mask, refine_undetected_mask
+from mokuro.manga_page_ocr import MangaPageOcr
+
+
+def page(num_lines_per_block):
+    result = {'img_width': 100, 'img_height': 100, 'blocks': [{'lines': []} for _ in num_lines_per_block]}
+    # one or two chunks per line, each chunk labelled with where it came from
+    crops = [
+        [[f'{b}.{l}.{c}' for c in range(1 + l % 2)] for l in range(num_lines)]
+        for b, num_lines in enumerate(num_lines_per_block)
+    ]
+    return result, crops
+
+
+def long_line_page():
+    """A page with one over-long line, whose block only covers its left half, as detected blocks sometimes do."""
+    rng = np.random.default_rng(0)
+    img = np.full((300, 1200, 3), 255, np.uint8)
+    pred_mask = np.zeros((300, 1200), np.uint8)
+    x = 40
+    while x < 1140:
+        w = int(rng.integers(8, 28))
+        img[102: 128, x: x + w] = 0
+        pred_mask[100: 130, x - 1: x + w + 1] = 255
+        x += w + int(rng.integers(4, 20))
+    blk = TextBlk([40, 98, 600, 132], np.array([[[40, 100], [1160, 100], [1160, 130], [40, 130]]], np.int32))
+    blk.vertical = False
+    blk.font_size = 30
+    return img, pred_mask, [blk]
+
+
+def test_split_into_chunks_lazy_mask_matches_eager():
+    img, pred_mask, blk_list = long_line_page()
+    cropper = LineCropper(blk_list, img.shape, textheight=64)
+
+    def cut_points(mask_refined):
+        return MangaPageOcr.split_into_chunks(img, mask_refined, cropper, blk_list[0], 0, 0, textheight=64, max_ratio=16)[1]
+
+    eager = refine_mask(img, pred_mask, blk_list, refine_mode=1)
+    eager = refine_undetected_mask(img, pred_mask.copy(), eager, blk_list, refine_mode=1)
+    lazy = LazyRefinedMask(img, pred_mask, blk_list, keep_undetected_mask=True, refine_mode=1)
+    without_undetected = LazyRefinedMask(img, pred_mask, blk_list, refine_mode=1)
+
+    assert cut_points(lazy) == cut_points(eager)
+    # the line's right half is only in the mask thanks to the undetected pass
+    assert cut_points(without_undetected) != cut_points(eager)
+
+
+def test_recognize_batch_scatters_text_back(monkeypatch):
+    mpocr = MangaPageOcr(disable_ocr=True)
+    batches = []
+
+    def ocr_crops(crops):
+        batches.append(crops)
+        return [f'<{crop}>' for crop in crops]
+
+    monkeypatch.setattr(mpocr, 'ocr_crops', ocr_crops)
+    results = mpocr.recognize_batch([page([2, 3]), page([]), page([1])])
+
+    assert len(batches) == 1  # every page's crops go through OCR together
+    assert results[0]['blocks'][1]['lines'] == ['<1.0.0>', '<1.1.0><1.1.1>', '<1.2.0>']
+    assert results[1]['blocks'] == []
+    assert results[2]['blocks'][0]['lines'] == ['<0.0.0>']
+
+
+def test_run_ocr_matches_single_crops():
+    pytest.importorskip('manga_ocr')
+    from huggingface_hub import try_to_load_from_cache
+    from manga_ocr import MangaOcr
+    from PIL import Image
+
+    if not isinstance(try_to_load_from_cache('kha-white/manga-ocr-base', 'config.json'), str):
+        pytest.skip('manga-ocr model not downloaded')
+    mocr = MangaOcr(force_cpu=True)
+    mpocr = MangaPageOcr(disable_ocr=True, ocr_batch_size=3)
+    mpocr.mocr = mocr
+
+    rng = np.random.default_rng(0)
+    crops = [np.full((64, w, 3), 255, np.uint8) for w in (64, 200, 320, 128, 500)]
+    for crop in crops:
+        crop[16:48, 8: crop.shape[1] - 8: 24] = rng.integers(0, 80)
+
+    assert mpocr.run_ocr(crops) == [mocr(Image.fromarray(crop)) for crop in crops]
@@ -0,0 +1,24 @@
+import numpy as np
+import pytest
+
+torch = pytest.importorskip('torch')
+pytest.importorskip('torchvision')
+
+from mokuro.comic_text_detector.utils.yolov5_utils import non_max_suppression, non_max_suppression_numpy
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_numpy_nms_matches_torchvision(seed):
+    rng = np.random.default_rng(seed)
+    n = 400
+    pred = np.empty((n, 5 + 2), np.float32)
+    pred[:, :2] = rng.uniform(0, 1024, (n, 2))
+    pred[:, 2:4] = rng.uniform(10, 300, (n, 2))
+    pred[:, 4:] = rng.uniform(0, 1, (n, 3))
+    # clusters of near-duplicate boxes, as the detector emits around each block
+    pred[n // 2:, :4] = pred[:n // 2, :4] + rng.normal(0, 5, (n // 2, 4))
+
+    expected = non_max_suppression(pred[None].copy(), 0.4, 0.35)[0].numpy()
+    actual = non_max_suppression_numpy(pred, 0.4, 0.35)
+
+    np.testing.assert_allclose(actual, expected, rtol=1e-6)
@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+cv2 = pytest.importorskip('cv2')
+
+from mokuro.manga_page_ocr import MangaPageOcr, OcrMemo
+
+
+def line_crop(text_seed, width=320, noise_seed=None):
+    """A 64px high line of random glyph-like strokes, optionally with a little scanner noise."""
+    rng = np.random.default_rng(text_seed)
+    crop = np.full((64, width, 3), 255, np.uint8)
+    for x in range(8, width - 48, 56):
+        for _ in range(4):
+            x1, y1 = x + rng.integers(0, 40), rng.integers(8, 48)
+            cv2.line(crop, (int(x1), int(y1)), (int(x1 + rng.integers(-8, 9)), int(y1 + rng.integers(4, 16))), (0, 0, 0), 4)
+    if noise_seed is not None:
+        noise = np.random.default_rng(noise_seed).integers(-3, 4, crop.shape)
+        crop = np.clip(crop.astype(int) + noise, 0, 255).astype(np.uint8)
+    return crop
+
+
+def test_fingerprint_matches_rescans_not_other_text():
+    memo = OcrMemo(fuzzy=True)
+    assert memo.key(line_crop(0)) == memo.key(line_crop(0, noise_seed=1))
+    assert len({memo.key(line_crop(seed)) for seed in range(1, 50)}) == 49
+    assert memo.key(line_crop(0)) != memo.key(line_crop(0, width=640))
+
+    exact = OcrMemo()
+    assert exact.key(line_crop(0)) == exact.key(line_crop(0))
+    assert exact.key(line_crop(0)) != exact.key(line_crop(0, noise_seed=1))
+
+
+def test_lru_eviction():
+    memo = OcrMemo(max_size=2)
+    a, b, c = (memo.key(line_crop(seed)) for seed in range(3))
+    assert memo.get(c) is None  # keyed, but without text yet
+    memo.put(a, 'A')
+    memo.put(b, 'B')
+    assert memo.get(a) == 'A'
+    memo.put(c, 'C')  # evicts b, the least recently used
+    assert (memo.get(a), memo.get(c)) == ('A', 'C')
+    assert memo.get(memo.key(line_crop(1))) is None
+    assert (memo.hits, memo.misses) == (3, 2)
+
+
+def test_eviction_keeps_thumbnails_in_step():
+    memo = OcrMemo(max_size=2, fuzzy=True)
+    memo.put(memo.key(line_crop(0)), 'A')
+    for seed in range(1, 6):  # keyed but never put: mustn't push out A
+        memo.key(line_crop(seed))
+    memo.discard_pending()
+    assert memo.get(memo.key(line_crop(0, noise_seed=1))) == 'A'
+
+    memo.put(memo.key(line_crop(1)), 'B')
+    memo.put(memo.key(line_crop(2)), 'C')  # evicts A
+    memo.put(memo.key(line_crop(0)), 'A')  # evicts B, and brings back A's thumbnail
+    assert memo.get(memo.key(line_crop(0, noise_seed=2))) == 'A'
+    assert memo.get(memo.key(line_crop(1, noise_seed=2))) is None
+    assert sorted(key for index in memo._thumbs.values() for key in index.keys) == sorted(memo._texts)
+
+
+def test_ocr_crops_runs_each_distinct_crop_once(monkeypatch):
+    mpocr = MangaPageOcr(disable_ocr=True)
+    mpocr.ocr_memo = OcrMemo(fuzzy=True)
+    seen = []
+
+    def run_ocr(crops):
+        seen.extend(crops)
+        return [f'text{len(seen) - len(crops) + i}' for i in range(len(crops))]
+
+    monkeypatch.setattr(mpocr, 'run_ocr', run_ocr)
+    crops = [line_crop(0), line_crop(1), line_crop(0, noise_seed=2)]
+    assert mpocr.ocr_crops(crops) == ['text0', 'text1', 'text0']
+    assert mpocr.ocr_crops([line_crop(1, noise_seed=3), line_crop(2)]) == ['text1', 'text2']
+    assert len(seen) == 3
+    assert mpocr.ocr_memo.hit_rate == pytest.approx(2 / 5)
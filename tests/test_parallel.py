@@ -0,0 +1,24 @@
+import json
+import shutil
+from zipfile import ZipFile
+
+from mokuro.parallel import process_volumes_parallel
+from mokuro.volume import scan_volumes
+
+
+def test_workers_process_every_volume(tmp_path, input_data_root):
+    # copies, since volumes are written next to their input
+    paths = [
+        shutil.copytree(input_data_root / 'test0' / 'vol1', tmp_path / 'series0' / 'vol1'),
+        shutil.copytree(input_data_root / 'test1_webp' / 'vol1', tmp_path / 'series1' / 'vol1'),
+        shutil.copy(input_data_root / 'test2_zip' / 'vol1.zip', tmp_path / 'vol2.zip'),
+    ]
+    volumes = list(scan_volumes(paths))
+
+    num_successful, cache_counts = process_volumes_parallel(volumes, workers=2, disable_ocr=True, detector_batch_size=2)
+
+    assert (num_successful, cache_counts) == (3, (0, 0))
+    for volume in volumes:
+        with ZipFile(volume.output_path) as output:
+            metadata = json.loads(output.read('mokuro-metadata.json'))
+            assert len(metadata['pages']) == len(volume.namelist) == 6
@@ -0,0 +1,78 @@
+import random
+import threading
+import time
+
+import pytest
+
+from mokuro.pipeline import Pipeline
+
+
+def _jittery_double(x):
+    time.sleep(random.random() / 100)
+    if x == 7:
+        raise ValueError(x)
+    return x * 2
+
+
+def test_pipeline_keeps_input_order():
+    pipeline = Pipeline([('double', _jittery_double), ('inc', lambda x: x + 1)], workers={'double': 4})
+    results = list(pipeline(range(12)))
+
+    assert [item for item, _ in results] == list(range(12))
+    assert isinstance(results[7][1], ValueError)
+    assert [output for item, output in results if item != 7] == [x * 2 + 1 for x in range(12) if x != 7]
+
+
+def test_pipeline_reraises_source_errors():
+    def pages():
+        yield 1
+        raise RuntimeError('source failed')
+
+    with pytest.raises(RuntimeError, match='source failed'):
+        list(Pipeline([('inc', lambda x: x + 1)])(pages()))
+
+
+def test_pipeline_batched_stage_isolates_failures():
+    def tenfold(values):
+        if 5 in values:
+            raise ValueError(5)
+        return [x * 10 for x in values]
+
+    pipeline = Pipeline([('identity', lambda x: x), ('tenfold', tenfold)], batch_sizes={'tenfold': 4}, queue_size=8)
+    results = dict(pipeline(range(12)))
+
+    assert isinstance(results.pop(5), ValueError)
+    assert results == {x: x * 10 for x in range(12) if x != 5}
+
+
+def test_pipeline_max_wait_fills_batches():
+    def trickle():
+        for x in range(8):
+            time.sleep(0.01)
+            yield x
+
+    pipeline = Pipeline([('sum', lambda values: values)], batch_sizes={'sum': 4}, max_wait=1.0)
+    assert [output for item, output in pipeline(trickle())] == list(range(8))
+    assert pipeline.batch_size_counts['sum'] == {4: 2}
+    snapshot = pipeline.batch_size_snapshot()
+    assert snapshot == {'sum': {4: 2}}
+    snapshot['sum'][1] = 1
+    assert pipeline.batch_size_counts['sum'] == {4: 2}
+
+
+def test_pipeline_close_waits_for_stages():
+    calls = []
+
+    def slow(x):
+        calls.append(x)
+        time.sleep(0.05)
+        return x
+
+    results = Pipeline([('slow', slow)], queue_size=2)(range(100))
+    next(results)
+    results.close()
+
+    assert not [thread for thread in threading.enumerate() if thread.name.startswith('mokuro-slow')]
+    num_calls = len(calls)
+    time.sleep(0.2)
+    assert len(calls) == num_calls < 100
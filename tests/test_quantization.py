@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from mokuro.comic_text_detector.basemodel import TextDetBaseInference
+from mokuro.comic_text_detector.inference import preprocess_img
+from mokuro.comic_text_detector import quantization
+from mokuro.comic_text_detector.quantization import load_quantized_detector, quantize_detector
+from mokuro.utils import imread
+
+
+@pytest.fixture
+def other_engine():
+    """Sets the process-wide quantized engine to one the detector doesn't pick, restoring it after."""
+    previous = torch.backends.quantized.engine
+    others = [engine for engine in torch.backends.quantized.supported_engines if engine not in ('x86', 'qnnpack')]
+    if not others:
+        pytest.skip('no other quantized engine to tell apart')
+    torch.backends.quantized.engine = others[0]
+    yield others[0]
+    torch.backends.quantized.engine = previous
+
+
+@pytest.mark.parametrize('engine', ['x86', 'qnnpack'])
+def test_quantized_detector_round_trip(tmp_path, random_detector_path, input_data_root, monkeypatch, other_engine, engine):
+    if engine not in torch.backends.quantized.supported_engines:
+        pytest.skip(f'no {engine} quantized engine')
+    monkeypatch.setattr(quantization, '_ENGINES', (engine,))
+    input_size = 256
+    imgs = [imread(p) for p in sorted((input_data_root / 'test0' / 'vol1').iterdir())[:3]]
+    int8_path = tmp_path / 'comictextdetector-int8.pt'
+    assert quantize_detector(random_detector_path, imgs[:2], int8_path, input_size=input_size) == 2
+    assert torch.load(int8_path)['engine'] == engine
+
+    net = load_quantized_detector(random_detector_path, int8_path)
+    assert torch.backends.quantized.engine == other_engine  # the choice stays local to quantize and load
+    x = preprocess_img(imgs[2], input_size=(input_size, input_size))[0]
+    with torch.no_grad():
+        expected = TextDetBaseInference(random_detector_path)(x)
+        actual = net(x)
+
+    for name, a, e in zip(('blks', 'mask', 'lines'), actual, expected):
+        assert a.shape == e.shape, name
+        assert torch.isfinite(a).all(), name
+    blks, mask, lines = actual
+    assert 0 <= mask.min() and mask.max() <= 1
+    assert 0 <= lines.min() and lines.max() <= 1
+    # int8 activations are coarse, but should still track the fp32 maps
+    assert (mask - expected[1]).abs().mean() < 0.05
+    assert (lines - expected[2]).abs().mean() < 0.05
+
+
+def test_missing_engine_is_reported(monkeypatch):
+    monkeypatch.setattr(quantization, '_ENGINES', ('no_such_engine',))
+    with pytest.raises(RuntimeError, match='quantized engines'):
+        quantization._pick_engine()
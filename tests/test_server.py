@@ -0,0 +1,53 @@
+import threading
+
+import pytest
+
+from mokuro.server import MokuroServer, submit
+
+
+class FakeGenerator:
+    """Stands in for MokuroGenerator: reports every page done without touching the models."""
+
+    def __init__(self):
+        self.processed = []
+
+    def process_volume(self, volume, ignore_errors=False, progress=None):
+        if volume.path.name == 'test1_webp':
+            raise RuntimeError('no pages')
+        for done in range(1, len(volume.namelist) + 1):
+            progress(done, len(volume.namelist))
+        self.processed.append(volume.path)
+
+
+@pytest.fixture
+def server(tmp_path):
+    server = MokuroServer(tmp_path / 'mokuro.sock', FakeGenerator())
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+def test_submit_streams_progress(server, input_data_root):
+    volume_path = input_data_root / 'test0' / 'vol1'
+    events = list(submit([volume_path], socket_path=server.server_address))
+
+    assert [e['event'] for e in events[:2]] == ['queued', 'volume_started']
+    total = events[1]['total']
+    assert total > 0
+    assert [e['done'] for e in events if e['event'] == 'page'] == list(range(1, total + 1))
+    assert events[-2]['event'] == 'volume_finished'
+    assert events[-1] == {'event': 'finished', 'num_successful': 1, 'num_volumes': 1}
+    assert server.generator.processed == [volume_path]
+
+
+def test_submit_reports_failures(server, input_data_root, tmp_path):
+    events = list(submit([tmp_path / 'missing'], socket_path=server.server_address))
+    assert [e['event'] for e in events] == ['error']
+
+    failing = input_data_root / 'test1_webp'
+    events = list(submit([failing], socket_path=server.server_address))
+    assert events[-2] == {'event': 'volume_failed', 'volume': str(failing), 'error': 'no pages'}
+    assert events[-1]['num_successful'] == 0
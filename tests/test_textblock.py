@@ -0,0 +1,88 @@
+import json
+
+import numpy as np
+import pytest
+
+from mokuro.comic_text_detector.utils import textblock
+
+
+def random_page(seed, im_w=1100, im_h=1600):
+    """
+    Detector-like output for a page: columns of vertical lines and stacks of horizontal ones,
+    some inside a detected block and some scattered (SFX), with gaps that force splits and
+    a few slightly rotated or overlapping lines.
+    """
+    rng = np.random.default_rng(seed)
+    lines, blk_boxes, blk_cls = [], [], []
+    for _ in range(rng.integers(4, 12)):
+        vertical = rng.random() < 0.7
+        font = int(rng.integers(14, 40))
+        x, y = int(rng.integers(100, im_w - 300)), int(rng.integers(50, im_h - 500))
+        angle = rng.choice([0, 0, 0, rng.uniform(-8, 8)])
+        cluster = []
+        for _ in range(rng.integers(1, 9)):
+            length = font * int(rng.integers(2, 10))
+            w, h = (font, length) if vertical else (length, font)
+            quad = np.array([[x, y], [x + w, y], [x + w, y + h], [x, y + h]], np.float64)
+            quad[:, 1] += rng.integers(-font // 2, font // 2 + 1)
+            if angle:
+                c = quad.mean(axis=0)
+                rad = np.deg2rad(angle)
+                rot = np.array([[np.cos(rad), -np.sin(rad)], [np.sin(rad), np.cos(rad)]])
+                quad = (quad - c) @ rot.T + c
+            if quad.min() >= 0 and quad[:, 0].max() <= im_w and quad[:, 1].max() <= im_h:
+                cluster.append(quad)
+            gap = font * rng.choice([0.1, 0.3, 0.5, 3.5]) if rng.random() < 0.9 else -font * 0.3
+            if vertical:
+                x -= int(font + gap)
+            else:
+                y += int(font + gap)
+        lines += cluster
+        if cluster and rng.random() < 0.6:
+            cluster = np.array(cluster)
+            pad = rng.integers(0, font)
+            blk_boxes.append([*(cluster.min(axis=(0, 1)) - pad), *(cluster.max(axis=(0, 1)) + pad)])
+            blk_cls.append(rng.choice([1, 1, 0, 2]))
+    # scattered SFX-like lines
+    for _ in range(rng.integers(0, 40)):
+        font = int(rng.integers(20, 60))
+        x, y = int(rng.integers(0, im_w - font)), int(rng.integers(0, im_h - 4 * font))
+        lines.append(np.array([[x, y], [x + font, y], [x + font, y + 3 * font], [x, y + 3 * font]], np.float64))
+
+    lines = np.array(lines).astype(np.int32)
+    blks = (np.array(blk_boxes, np.int64).reshape(-1, 4), np.array(blk_cls, np.int64), np.ones(len(blk_boxes)))
+    return blks, lines, im_w, im_h
+
+
+def describe(blk_list):
+    return [{
+        'xyxy': np.asarray(blk.xyxy).tolist(),
+        'lines': np.asarray(blk.lines).tolist(),
+        'vertical': bool(blk.vertical),
+        'language': blk.language,
+        'font_size': float(blk.font_size),
+        'angle': int(blk.angle),
+    } for blk in blk_list]
+
+
+def test_group_output_golden(test_data_root, regenerate):
+    golden_path = test_data_root / 'group_output_golden.json'
+    results = {str(seed): describe(textblock.group_output(*random_page(seed))) for seed in range(40)}
+
+    if regenerate:
+        golden_path.write_text(json.dumps(results))
+    else:
+        assert results == json.loads(golden_path.read_text())
+
+
+def test_quads_intersect_matches_shapely():
+    from shapely.geometry import Polygon
+
+    rng = np.random.default_rng(0)
+    centers = rng.integers(0, 100, size=(500, 2, 1, 2))
+    sizes = rng.integers(0, 30, size=(500, 2, 1, 2))
+    quads = centers + sizes * np.array([[-1, -1], [1, -1], [1, 1], [-1, 1]])
+    quads[::3, 1, 0, 0] += rng.integers(-20, 20, size=len(quads[::3]))    # skewed, some non-convex
+    expected = [Polygon(a).intersects(Polygon(b)) for a, b in quads]
+
+    np.testing.assert_array_equal(textblock.quads_intersect(quads[:, 0], quads[:, 1]), expected)
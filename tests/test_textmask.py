@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+
+cv2 = pytest.importorskip('cv2')
+
+from mokuro.comic_text_detector.utils.textmask import (
+    REFINEMASK_ANNOTATION,
+    REFINEMASK_INPAINT,
+    get_otsuthresh_masklist,
+    get_topk_masklist,
+    merge_mask_list,
+)
+
+
+def halftone_page(h=1600, w=1136, pitch=5, seed=0):
+    """A screentone-heavy page: a dot screen with a tone gradient, cleared behind a few columns of "text" strokes."""
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[:h, :w]
+    tone = 0.1 + 0.5 * xx / w  # fraction of each screen cell covered by its dot
+    d2 = (yy % pitch - (pitch - 1) / 2) ** 2 + (xx % pitch - (pitch - 1) / 2) ** 2
+    img = np.where(d2 <= tone * pitch ** 2 / np.pi, 0, 255).astype(np.uint8)
+
+    pred_mask = np.zeros((h, w), np.uint8)
+    for x in range(150, w - 150, 120):
+        y1, y2 = h // 8, int(rng.integers(h // 2, h - h // 8))
+        img[y1 - 10: y2 + 10, x - 10: x + 60] = 255
+        for y in range(y1, y2, 55):
+            for _ in range(6):
+                sx, sy = rng.integers(0, 40), rng.integers(0, 40)
+                sw, sh = (rng.integers(3, 6), rng.integers(10, 40)) if rng.random() < 0.5 else (rng.integers(10, 40), rng.integers(3, 6))
+                img[y + sy: y + sy + sh, x + sx: x + sx + sw] = 0
+        pred_mask[y1: y2, x: x + 50] = 255
+    pred_mask = cv2.GaussianBlur(pred_mask, (15, 15), 0)
+    return cv2.cvtColor(img, cv2.COLOR_GRAY2BGR), pred_mask
+
+
+def merge_mask_list_loop(mask_list, pred_mask, refine_mode=REFINEMASK_INPAINT):
+    """merge_mask_list as it was, deciding one connected component at a time."""
+    mask_list = sorted(mask_list, key=lambda x: x[1])
+    element = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3), (1, 1))
+    pred_mask = cv2.erode(pred_mask, element, iterations=1)
+    _, pred_mask = cv2.threshold(pred_mask, 60, 255, cv2.THRESH_BINARY)
+    mask_merged = np.zeros_like(pred_mask)
+
+    def try_add(labels, label_index, stat):
+        x, y, w, h, area = stat
+        x1, y1, x2, y2 = x, y, x + w, y + h
+        label_local = labels[y1: y2, x1: x2]
+        tmp_merged = np.zeros_like(label_local, np.uint8)
+        tmp_merged[np.where(label_local == label_index)] = 255
+        tmp_merged = cv2.bitwise_or(mask_merged[y1: y2, x1: x2], tmp_merged)
+        xor_merged = cv2.bitwise_xor(tmp_merged, pred_mask[y1: y2, x1: x2]).sum()
+        xor_origin = cv2.bitwise_xor(mask_merged[y1: y2, x1: x2], pred_mask[y1: y2, x1: x2]).sum()
+        if xor_merged < xor_origin:
+            mask_merged[y1: y2, x1: x2] = tmp_merged
+
+    for candidate_mask, xor_sum in mask_list:
+        num_labels, labels, stats, centroids = cv2.connectedComponentsWithStats(candidate_mask, 8, cv2.CV_16U)
+        for label_index in range(1, num_labels):
+            if stats[label_index][2] * stats[label_index][3] >= 3:
+                try_add(labels, label_index, stats[label_index])
+
+    if refine_mode == REFINEMASK_INPAINT:
+        mask_merged[:] = cv2.dilate(mask_merged, np.ones((3, 3), np.uint8), iterations=1)
+    num_labels, labels, stats, centroids = cv2.connectedComponentsWithStats(255 - mask_merged, 8, cv2.CV_16U)
+    sorted_area = np.sort(stats[:, -1])
+    area_thresh = sorted_area[-2] if len(sorted_area) > 1 else sorted_area[-1]
+    for label_index in range(num_labels):
+        if stats[label_index][-1] < area_thresh:
+            try_add(labels, label_index, stats[label_index])
+    return mask_merged
+
+
+def candidate_masks(img, pred_mask):
+    mask_list = get_topk_masklist(img, pred_mask)
+    mask_list += get_otsuthresh_masklist(img, pred_mask, per_channel=False)
+    return mask_list
+
+
+@pytest.mark.parametrize('refine_mode', [REFINEMASK_INPAINT, REFINEMASK_ANNOTATION])
+def test_merge_mask_list_matches_loop(refine_mode):
+    img, pred_mask = halftone_page(h=600, w=500)
+    mask_list = candidate_masks(img, pred_mask)
+
+    expected = merge_mask_list_loop(mask_list, pred_mask, refine_mode=refine_mode)
+    actual = merge_mask_list(list(mask_list), pred_mask, refine_mode=refine_mode)
+
+    np.testing.assert_array_equal(actual, expected)
+
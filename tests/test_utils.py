@@ -0,0 +1,57 @@
+from io import BytesIO
+from zipfile import ZIP_DEFLATED, ZIP_STORED, ZipFile
+
+import numpy as np
+import pytest
+
+from mokuro import utils
+from mokuro.utils import read_raw_zip_member, write_raw_zip_member
+from mokuro.volume import VolumeZip
+
+MEMBERS = {
+    'deflated.txt': (b'mokuro ' * 1000, ZIP_DEFLATED),
+    'stored.bin': (np.random.default_rng(0).bytes(5000), ZIP_STORED),
+}
+
+
+def copy_raw_members():
+    src = BytesIO()
+    with ZipFile(src, 'w') as archive:
+        for name, (data, compress_type) in MEMBERS.items():
+            archive.writestr(name, data, compress_type=compress_type)
+
+    dst = BytesIO()
+    with ZipFile(src) as archive, ZipFile(dst, 'w') as output:
+        output.writestr('_ocr/page.json', '{}')
+        for zinfo in archive.infolist():
+            write_raw_zip_member(output, zinfo, read_raw_zip_member(archive, zinfo), f'copy/{zinfo.filename}')
+    return dst
+
+
+@pytest.mark.parametrize('raw_copy', [True, False])
+def test_write_raw_zip_member_round_trip(monkeypatch, raw_copy):
+    if not raw_copy:  # as if ZipFile's internals had changed
+        monkeypatch.setattr(utils, '_RAW_COPY_ATTRS', ('_no_such_attribute',))
+
+    with ZipFile(copy_raw_members()) as archive:
+        assert archive.testzip() is None
+        assert archive.read('_ocr/page.json') == b'{}'
+        for name, (data, compress_type) in MEMBERS.items():
+            assert archive.getinfo(f'copy/{name}').compress_type == compress_type
+            assert archive.read(f'copy/{name}') == data
+
+
+@pytest.mark.parametrize('raw_read', [True, False])
+def test_volume_zip_pages(monkeypatch, input_data_root, raw_read):
+    if not raw_read:  # as if ZipFile's internals had changed
+        monkeypatch.setattr(utils, '_RAW_READ_ATTRS', ('_no_such_attribute',))
+
+    volume = VolumeZip(input_data_root / 'test2_zip' / 'vol1.zip')
+    volume.scan()
+    pages = list(volume.get_pages())
+
+    assert len(pages) == len(volume.namelist) == 6
+    with ZipFile(volume.path) as archive:
+        for page, path in zip(pages, volume.namelist):
+            assert page.img_bytes == archive.read(path.as_posix())
+            assert (page.raw_member is not None) == raw_read